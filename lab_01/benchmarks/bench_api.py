@@ -0,0 +1,278 @@
+"""
+HTTP benchmark suite for the products API: req/s, p50/p95/p99 latency and peak RSS per
+endpoint on synthetic catalogs of growing size.
+
+Run from lab_01/:
+    poetry run python benchmarks/bench_api.py [--mode asgi|uvicorn] [--sizes 1k,100k,1m]
+        [--history 3] [--requests 2000] [--concurrency 8] [--output results.json] [--compare old.json]
+
+Modes (neither needs the network):
+- asgi: in-process httpx client over ASGITransport, the app talks to the catalog through
+  get_db / get_read_db overrides; RSS is this process (client + app);
+- uvicorn: the app runs in a local uvicorn subprocess on 127.0.0.1; RSS is the server's.
+
+Each catalog is a fresh SQLite file with N products spread over all categories and
+`--history` versions per product, loaded with lab_01.bulk_seed (ids 1..N).
+Results are written as JSON (default: benchmarks/results/bench_api-<commit>-<mode>.json)
+together with the commit, so runs of two commits can be compared with --compare.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from lab_01 import bulk_seed
+from lab_01.database import create_db_engine, get_db, get_read_db, session_factory
+from lab_01.services import PRICE_RULES
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+ENDPOINTS = ["POST /products/", "GET /products/", "GET /products/{id}", "PUT /products/{id}", "GET /products/{id}/history"]
+
+# --- synthetic catalog ---
+
+def build_catalog(path: str, size: int, history: int) -> float:
+    engine = create_db_engine(f"sqlite:///{path}")
+    stats = bulk_seed.seed(engine, math.ceil(size / len(PRICE_RULES)), history=history)
+    engine.dispose()
+    return stats.seconds
+
+# --- peak RSS ---
+
+class RssSampler:
+    """Samples VmRSS of `pid` every few ms between start() and stop(); peak in MiB."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_kb(self) -> int:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        # no /proc (macOS): lifetime peak of this process only
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, self._read_kb())
+            self._stop.wait(0.005)
+
+    def start(self):
+        self.peak_kb = self._read_kb()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> float:
+        self._stop.set()
+        self._thread.join()
+        return round(self.peak_kb / 1024, 1)
+
+# --- load ---
+
+def _request(client: httpx.AsyncClient, endpoint: str, rnd: random.Random, size: int, seq: list):
+    pid = rnd.randint(1, size)
+    if endpoint == "POST /products/":
+        seq[0] += 1
+        return client.post("/api/v1/products/", json={"name": f"New{seq[0]}x{rnd.randint(0, 10**6)}", "category": "books", "price": 20.0, "quantity": 1})
+    if endpoint == "GET /products/":
+        params = {"limit": 50, "sort": "price", "min_price": rnd.randint(5, 400), "category": rnd.choice(list(PRICE_RULES))}
+        return client.get("/api/v1/products/", params=params)
+    if endpoint == "GET /products/{id}":
+        return client.get(f"/api/v1/products/{pid}")
+    if endpoint == "PUT /products/{id}":
+        return client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": None, "quantity": rnd.randint(0, 99)})
+    return client.get(f"/api/v1/products/{pid}/history", params={"limit": 20})
+
+async def _run_endpoint(client: httpx.AsyncClient, endpoint: str, total: int, concurrency: int, size: int) -> dict:
+    rnd = random.Random(endpoint)
+    latencies, errors, left, seq = [], 0, [total], [0]
+
+    async def worker():
+        nonlocal errors
+        while left[0] > 0:
+            left[0] -= 1
+            start = time.perf_counter()
+            try:
+                r = await _request(client, endpoint, rnd, size, seq)
+                if r.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    began = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - began
+    latencies.sort()
+    pct = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+    return {"requests": total, "rps": round(total / elapsed, 1), "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99), "errors": errors}
+
+async def _run_all(client: httpx.AsyncClient, args, size: int, sampler: RssSampler) -> list:
+    results = []
+    for endpoint in ENDPOINTS:
+        sampler.start()
+        res = await _run_endpoint(client, endpoint, args.requests, args.concurrency, size)
+        res["peak_rss_mb"] = sampler.stop()
+        results.append({"endpoint": endpoint, **res})
+    return results
+
+def _bench_asgi(path: str, args, size: int) -> list:
+    from lab_01.main import app
+
+    engine = create_db_engine(f"sqlite:///{path}")
+    read_engine = create_db_engine(f"sqlite:///{path}", read_only=True)
+    Session = session_factory(engine)
+    ReadSession = session_factory(read_engine)
+
+    def override(factory):
+        def get_session():
+            db = factory()
+            try:
+                yield db
+            finally:
+                db.close()
+        return get_session
+
+    app.dependency_overrides[get_db] = override(Session)
+    app.dependency_overrides[get_read_db] = override(ReadSession)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await _run_all(client, args, size, RssSampler(os.getpid()))
+    try:
+        return asyncio.run(run())
+    finally:
+        app.dependency_overrides.clear()
+        engine.dispose()
+        read_engine.dispose()
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _bench_uvicorn(path: str, args, size: int) -> list:
+    port = _free_port()
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{path}"}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "lab_01.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                httpx.get(f"{base}/api/v1/products/?limit=1", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.time() > deadline:
+                    raise RuntimeError("uvicorn did not start")
+                time.sleep(0.2)
+
+        async def run():
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+                return await _run_all(client, args, size, RssSampler(proc.pid))
+        return asyncio.run(run())
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+# --- results ---
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _compare(current: dict, path: str):
+    with open(path) as f:
+        old = json.load(f)
+    before = {(r["catalog"], r["endpoint"]): r for r in old["results"]}
+    print(f"\ncompared with {old['commit']} ({path}):")
+    print(f"{'catalog':<7} | {'endpoint':<28} | {'req/s':>14} | {'p99 ms':>16}")
+    for r in current["results"]:
+        o = before.get((r["catalog"], r["endpoint"]))
+        if o is None:
+            continue
+        change = lambda new, prev: f"{(new - prev) / prev * 100:+.0f}%" if prev else "n/a"
+        print(f"{r['catalog']:<7} | {r['endpoint']:<28} | {r['rps']:>7.0f} {change(r['rps'], o['rps']):>6} | {r['p99_ms']:>8.2f} {change(r['p99_ms'], o['p99_ms']):>7}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--sizes", default="1k,100k,1m", help="comma separated: " + ", ".join(SIZES))
+    parser.add_argument("--history", type=int, default=3, help="history versions per product")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "mode": args.mode,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {"history": args.history, "requests": args.requests, "concurrency": args.concurrency},
+        "results": [],
+    }
+
+    print(f"{'catalog':<7} | {'endpoint':<28} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'RSS MiB':>8} | errors")
+    for label in args.sizes.split(","):
+        size = SIZES[label.strip().lower()]
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            built = build_catalog(path, size, args.history)
+            print(f"# {label}: {size} products, {size * args.history} history rows built in {built:.1f} s")
+            run = _bench_asgi if args.mode == "asgi" else _bench_uvicorn
+            for r in run(path, args, size):
+                r = {"catalog": label, "products": size, **r}
+                report["results"].append(r)
+                print(f"{label:<7} | {r['endpoint']:<28} | {r['rps']:>8.0f} | {r['p50_ms']:>8.2f} | {r['p95_ms']:>8.2f} | {r['p99_ms']:>8.2f} | {r['peak_rss_mb']:>8.1f} | {r['errors']}")
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"bench_api-{commit}-{args.mode}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"\nresults written to {output}")
+    if args.compare:
+        _compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Load test: sync vs. async database mode (DB_MODE), 50 and 500 concurrent clients.
+
+Run from lab_01/:  poetry run python benchmarks/bench_async_load.py [--requests 3000] [--products 5000]
+(async mode needs the `async` extra: aiosqlite + greenlet)
+
+For each mode a uvicorn server is started on a scratch SQLite file and hammered with a
+mix of 80% GET /products/{id}, 10% GET /products/?limit=20 and 10% PUT /products/{id}.
+Client and server share the machine, so compare the modes with each other, not with
+absolute numbers from other hosts.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine, insert
+
+from lab_01 import models
+from lab_01.database import Base
+
+CONCURRENCY = [50, 500]
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _prepare_db(path: str, products: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Product), [
+            {"name": f"Load{i}", "category": "books", "price": 10.0 + i % 400, "quantity": i % 100}
+            for i in range(products)
+        ])
+    engine.dispose()
+
+def _start_server(mode: str, db_path: str, port: int) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{db_path}", "DB_MODE": mode}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "lab_01.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/v1/products/?limit=1", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"server in {mode} mode did not start")
+
+async def _run_load(base: str, concurrency: int, total: int, products: int):
+    latencies = []
+    errors = 0
+    rnd = random.Random(concurrency)
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(rnd.random())
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                pick = queue.get_nowait()
+                pid = rnd.randint(1, products)
+                start = time.perf_counter()
+                try:
+                    if pick < 0.8:
+                        r = await client.get(f"/api/v1/products/{pid}")
+                    elif pick < 0.9:
+                        r = await client.get("/api/v1/products/", params={"limit": 20})
+                    else:
+                        r = await client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": None, "quantity": rnd.randint(0, 50)})
+                    if r.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        began = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return {"rps": total / elapsed, "p50": p(0.50), "p99": p(0.99), "errors": errors}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--products", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} | {'clients':>7} | {'req/s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | errors")
+    for mode in ("sync", "async"):
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        _prepare_db(path, args.products)
+        port = _free_port()
+        proc = _start_server(mode, path, port)
+        try:
+            for concurrency in CONCURRENCY:
+                res = asyncio.run(_run_load(f"http://127.0.0.1:{port}", concurrency, args.requests, args.products))
+                print(f"{mode:<6} | {concurrency:>7} | {res['rps']:>8.0f} | {res['p50']:>8.1f} | {res['p99']:>8.1f} | {res['errors']}")
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            os.unlink(path)
+
+if __name__ == "__main__":
+    main()
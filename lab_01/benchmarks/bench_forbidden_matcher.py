@@ -0,0 +1,78 @@
+"""
+Micro-benchmark: forbidden-phrase check, old per-phrase loop vs. the cached automaton.
+
+Run from lab_01/:  poetry run python benchmarks/bench_forbidden_matcher.py
+
+"loop + scan" is what every create/rename used to pay: SELECT all phrases, then one
+substring search per phrase. "loop" is the in-memory part only.
+"""
+import random
+import string
+import timeit
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from lab_01 import models
+from lab_01.database import Base
+from lab_01.forbidden_matcher import ForbiddenMatcher
+from lab_01.repositories import ForbiddenRepository
+
+SIZES = [10, 1_000, 50_000]
+NAMES = 200
+
+def _phrases(n: int, rnd: random.Random):
+    seen = set()
+    while len(seen) < n:
+        seen.add("".join(rnd.choice(string.ascii_letters) for _ in range(rnd.randint(5, 12))))
+    return list(seen)
+
+def _names(rnd: random.Random):
+    alphabet = string.ascii_letters + string.digits
+    return ["".join(rnd.choice(alphabet) for _ in range(rnd.randint(3, 20))) for _ in range(NAMES)]
+
+def legacy_check(phrases, name):
+    lowered = name.lower()
+    for ph in phrases:
+        if ph.lower() in lowered:
+            return ph
+    return None
+
+def main():
+    rnd = random.Random(42)
+    names = _names(rnd)
+    print(f"{'phrases':>8} | {'loop+scan us':>12} | {'loop us':>10} | {'matcher us':>10} | {'build ms':>8} | speedup")
+    for size in SIZES:
+        phrases = _phrases(size, rnd)
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(models.ForbiddenPhrase), [{"phrase": p} for p in phrases])
+        db = sessionmaker(bind=engine)()
+        repo = ForbiddenRepository(db)
+
+        def loop_with_scan():
+            for name in names[:5]:
+                legacy_check([p.phrase for p in repo.list_all()], name)
+                db.expunge_all()
+
+        matcher = ForbiddenMatcher(enumerate(phrases))
+        build_s = min(timeit.repeat(lambda: ForbiddenMatcher(enumerate(phrases)).find("x"), number=1, repeat=3))
+        matcher.find("warmup")
+
+        scan_runs = 3
+        scan_s = min(timeit.repeat(loop_with_scan, number=scan_runs, repeat=3)) / (scan_runs * 5)
+        loop_s = min(timeit.repeat(lambda: [legacy_check(phrases, n) for n in names], number=1, repeat=3)) / NAMES
+        match_s = min(timeit.repeat(lambda: [matcher.find(n) for n in names], number=20, repeat=3)) / (20 * NAMES)
+
+        # sanity: both implementations agree
+        for n in names:
+            assert (legacy_check(phrases, n) is None) == (matcher.find(n) is None)
+
+        print(f"{size:>8} | {scan_s * 1e6:>12.1f} | {loop_s * 1e6:>10.1f} | {match_s * 1e6:>10.2f} | {build_s * 1e3:>8.1f} | {scan_s / match_s:,.0f}x")
+        db.close()
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Batch name check (POST /products/validate-names) vs. checking candidate names one at a time.
+
+Run from lab_01/:  poetry run python benchmarks/bench_name_check.py [--names 100000] [--products 300000] [--phrases 10,1000]
+
+The catalog has --products products and the given numbers of forbidden phrases. The candidates
+are random names with a category and price each; about 5% are taken, some contain a phrase,
+are malformed, repeated or priced out of range. "one by one" is what a pre-check by attempted
+creates costs even before the INSERT: _check_forbidden and get_by_name per name (timed on a
+sample and extrapolated). "endpoint" is the whole request in process: JSON body in, verdicts out.
+"""
+import argparse
+import json
+import os
+import random
+import string
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, insert
+
+from lab_01 import forbidden_matcher, models
+from lab_01.database import Base, create_db_engine, get_db, get_read_db, session_factory
+from lab_01.main import create_app
+from lab_01.services import PRICE_RULES, ProductService
+
+SAMPLE = 2000
+
+def _candidates(n: int, products: int, rnd: random.Random) -> dict:
+    alphabet = string.ascii_letters + string.digits
+    names, categories, prices = [], [], []
+    for i in range(n):
+        pick = rnd.random()
+        if pick < 0.05:
+            name = f"Load{rnd.randrange(products)}"                     # taken
+        elif pick < 0.06:
+            name = names[rnd.randrange(len(names))] if names else "Dup1"  # repeated
+        elif pick < 0.07:
+            name = "x!"                                                   # malformed
+        else:
+            name = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(6, 16)))
+        category = rnd.choice(list(PRICE_RULES))
+        rules = PRICE_RULES[category]
+        price = round(rnd.uniform(rules["min"], rules["max"]), 2) if rnd.random() > 0.02 else rules["max"] * 2
+        names.append(name)
+        categories.append(category)
+        prices.append(price)
+    return {"names": names, "categories": categories, "prices": prices}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=100_000)
+    parser.add_argument("--products", type=int, default=300_000)
+    parser.add_argument("--phrases", default="10,1000")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_db_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Product), [
+            {"name": f"Load{i}", "category": "books", "price": 10.0, "quantity": 1} for i in range(args.products)
+        ])
+    Session = session_factory(engine)
+    app = create_app(seed=False)
+
+    def override():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override
+    app.dependency_overrides[get_read_db] = override
+    client = TestClient(app)
+    rnd = random.Random(42)
+    body = json.dumps(_candidates(args.names, args.products, rnd)).encode()
+    names = json.loads(body)["names"]
+
+    print(f"{'phrases':>7} | {'one by one s':>12} | {'endpoint s':>10} | {'rejected':>8} | speedup")
+    try:
+        for size in (int(p) for p in args.phrases.split(",")):
+            with engine.begin() as conn:
+                conn.execute(delete(models.ForbiddenPhrase))
+                conn.execute(insert(models.ForbiddenPhrase), [
+                    {"phrase": "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(4, 8)))} for _ in range(size)
+                ])
+            forbidden_matcher.reset()
+
+            with Session() as db:
+                svc = ProductService(db)
+                svc.validate_names(names[:10])  # loads the matcher
+                start = time.perf_counter()
+                for name in names[:SAMPLE]:
+                    try:
+                        svc._check_forbidden(name)
+                    except Exception:
+                        pass
+                    svc.repo.get_by_name(name)
+                    db.expunge_all()
+                one_by_one = (time.perf_counter() - start) / SAMPLE * len(names)
+
+            best, result = None, None
+            for _ in range(3):
+                start = time.perf_counter()
+                r = client.post("/api/v1/products/validate-names", content=body, headers={"content-type": "application/json"})
+                elapsed = time.perf_counter() - start
+                assert r.status_code == 200, r.text
+                result = r.json()
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{size:>7} | {one_by_one:>12.2f} | {best:>10.3f} | {result['rejected']:>8} | {one_by_one / best:,.0f}x")
+    finally:
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+if __name__ == "__main__":
+    main()
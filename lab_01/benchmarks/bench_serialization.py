@@ -0,0 +1,155 @@
+"""
+Micro-benchmark: list and history responses, ORM objects + per-row Pydantic validation
+(the old path) vs. column rows encoded straight to JSON (fast_json).
+
+Run from lab_01/:  poetry run python benchmarks/bench_serialization.py [--rows 10000]
+
+Both paths include the queries and produce the same documents (checked); products are read
+as pages of 1000 (the endpoint maximum) and history as pages of 1000 versions of one
+product. Reported per 10k rows: CPU time (process_time, best of 5) and the peak of
+memory allocated while serving them (tracemalloc, separate run).
+"""
+from typing import List
+import argparse
+import json
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+
+from pydantic import TypeAdapter
+from sqlalchemy import insert, select
+
+from lab_01 import bulk_seed, fast_json, models, schemas, services
+from lab_01.database import create_db_engine, session_factory
+from lab_01.routers.products import product_list_json
+
+PAGE = 1000
+PRODUCT_LIST = TypeAdapter(List[schemas.ProductOut])
+HISTORY_LIST = TypeAdapter(List[schemas.ProductHistoryOut])
+
+# --- old path ---
+
+def legacy_products(db, rows: int) -> List[bytes]:
+    P = models.Product
+    pages, last = [], 0
+    for _ in range(math.ceil(rows / PAGE)):
+        items = db.execute(select(P).where(P.id > last).order_by(P.id).limit(PAGE)).scalars().all()
+        pages.append(PRODUCT_LIST.dump_json(PRODUCT_LIST.validate_python(items, from_attributes=True)))
+        last = items[-1].id
+        db.expunge_all()
+    return pages
+
+def legacy_history(db, product_id: int, rows: int) -> List[bytes]:
+    H = models.ProductHistory
+    pages, cursor = [], None
+    for _ in range(math.ceil(rows / PAGE)):
+        stmt = select(H).where(H.product_id == product_id)
+        if cursor is not None:
+            stmt = stmt.where(H.version < cursor)
+        page = db.execute(stmt.order_by(H.version.desc()).limit(PAGE)).scalars().all()
+        low, high = page[-1].version, page[0].version
+        base = select(H.version).where(H.product_id == product_id, H.is_snapshot, H.version <= low).order_by(H.version.desc()).limit(1).scalar_subquery()
+        replay = db.execute(select(H).where(H.product_id == product_id, H.version >= base, H.version <= high).order_by(H.version)).scalars().all()
+        states, state = {}, {}
+        for h in replay:
+            change = json.loads(h.data)
+            state = change if h.is_snapshot else {**state, **change}
+            states[h.version] = state
+        items = [
+            {"id": h.id, "product_id": h.product_id, "changed_at": h.changed_at, "operation": h.operation,
+             "version": h.version, "snapshot": json.dumps(states[h.version], default=str)}
+            for h in page
+        ]
+        # what FastAPI does with a response_model: validate, dump to JSON-able python, json.dumps
+        content = HISTORY_LIST.dump_python(HISTORY_LIST.validate_python(items), mode="json")
+        pages.append(json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode())
+        cursor = low
+        db.expunge_all()
+    return pages
+
+# --- new path ---
+
+def fast_products(db, rows: int) -> List[bytes]:
+    svc = services.ProductService(db)
+    pages, cursor = [], None
+    for _ in range(math.ceil(rows / PAGE)):
+        items, cursor = svc.list_products(limit=PAGE, cursor=cursor)
+        pages.append(product_list_json(items))
+    return pages
+
+def fast_history(db, product_id: int, rows: int) -> List[bytes]:
+    svc = services.ProductService(db)
+    pages, cursor = [], None
+    for _ in range(math.ceil(rows / PAGE)):
+        items, cursor = svc.get_history(product_id, limit=PAGE, cursor=cursor)
+        pages.append(fast_json.dumps(items))
+    return pages
+
+# --- measurement ---
+
+def _cpu(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        best = min(best, time.process_time() - start)
+    return best
+
+def _peak_kib(fn) -> float:
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+def _deep_history(conn, product_id: int, versions: int):
+    # one product with `versions` quantity updates, stored like HistoryRepository does
+    every = bulk_seed.HISTORY_SNAPSHOT_EVERY
+    product = {"id": product_id, "name": f"Deep{product_id}", "category": "books", "price": 10.0, "quantity": 0}
+    conn.execute(insert(models.Product), [product])
+    history = []
+    for v in range(1, versions + 1):
+        product["quantity"] = v
+        snapshot = (v - 1) % every == 0
+        history.append({"product_id": product_id, "operation": "create" if v == 1 else "update", "version": v,
+                        "is_snapshot": snapshot, "data": bulk_seed._snapshot_json(product) if snapshot else '{"quantity":%d}' % v})
+    conn.execute(insert(models.ProductHistory), history)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_db_engine(f"sqlite:///{path}")
+    bulk_seed.seed(engine, math.ceil(args.rows / len(services.PRICE_RULES)), history=0)
+    deep_id = args.rows * 10
+    with engine.begin() as conn:
+        _deep_history(conn, deep_id, args.rows)
+    Session = session_factory(engine)
+
+    scale = 10_000 / args.rows
+    print(f"encoder: {'orjson' if fast_json.orjson else 'json'}; {args.rows} rows, per 10k rows:")
+    print(f"{'endpoint':>10} | {'old cpu ms':>10} | {'new cpu ms':>10} | {'speedup':>7} | {'old peak KiB':>12} | {'new peak KiB':>12}")
+    cases = [
+        ("list", lambda db: legacy_products(db, args.rows), lambda db: fast_products(db, args.rows)),
+        ("history", lambda db: legacy_history(db, deep_id, args.rows), lambda db: fast_history(db, deep_id, args.rows)),
+    ]
+    for name, old, new in cases:
+        with Session() as db:
+            # sanity: same documents
+            assert [json.loads(p) for p in old(db)] == [json.loads(p) for p in new(db)]
+            old_cpu, new_cpu = _cpu(lambda: old(db)) * scale, _cpu(lambda: new(db)) * scale
+            old_mem, new_mem = _peak_kib(lambda: old(db)) * scale, _peak_kib(lambda: new(db)) * scale
+        print(f"{name:>10} | {old_cpu * 1e3:>10.1f} | {new_cpu * 1e3:>10.1f} | {old_cpu / new_cpu:>6.1f}x | {old_mem:>12.0f} | {new_mem:>12.0f}")
+
+    engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+
+if __name__ == "__main__":
+    main()
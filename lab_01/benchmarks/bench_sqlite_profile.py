@@ -0,0 +1,96 @@
+"""
+Mixed read/write throughput on a SQLite file: SQLITE_PROFILE=default vs. production.
+
+Run from lab_01/:  poetry run python benchmarks/bench_sqlite_profile.py [--seconds 5] [--readers 8] [--writers 4]
+
+Readers page through the product list and fetch single products, writers update a random
+product's quantity (SELECT + UPDATE + history INSERT + COMMIT) through ProductService,
+all on one engine built by database.create_db_engine, the same way the app builds its engine.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from lab_01 import models, schemas
+from lab_01.database import Base, create_db_engine, session_factory
+from lab_01.services import ProductService
+
+PRODUCTS = 20_000
+
+def _run(profile: str, seconds: float, readers: int, writers: int):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_db_engine(f"sqlite:///{path}", profile=profile)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Product), [
+            {"name": f"Mix{i}", "category": "books", "price": 10.0, "quantity": 1} for i in range(PRODUCTS)
+        ])
+    Session = session_factory(engine)
+
+    counts = {"reads": 0, "writes": 0, "locked": 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def reader(seed: int):
+        rnd = random.Random(seed)
+        while time.perf_counter() < stop:
+            with Session() as db:
+                svc = ProductService(db)
+                svc.list_products(limit=50, sort=schemas.ProductSort.price)
+                svc.get_product(rnd.randint(1, PRODUCTS))
+            with lock:
+                counts["reads"] += 1
+
+    def writer(seed: int):
+        rnd = random.Random(seed)
+        while time.perf_counter() < stop:
+            key = "writes"
+            with Session() as db:
+                try:
+                    ProductService(db).update_product(
+                        rnd.randint(1, PRODUCTS),
+                        schemas.ProductUpdate(name=None, category=None, price=None, quantity=rnd.randint(0, 99)),
+                    )
+                except OperationalError:
+                    db.rollback()
+                    key = "locked"
+                except HTTPException:
+                    pass
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(100 + i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+    return {k: v / seconds for k, v in counts.items()}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'profile':<10} | {'reads/s':>8} | {'writes/s':>8} | {'locked errors/s':>15}")
+    for profile in ("default", "production"):
+        res = _run(profile, args.seconds, args.readers, args.writers)
+        print(f"{profile:<10} | {res['reads']:>8.0f} | {res['writes']:>8.0f} | {res['locked']:>15.1f}")
+
+if __name__ == "__main__":
+    main()
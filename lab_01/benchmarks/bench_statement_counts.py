@@ -0,0 +1,74 @@
+"""
+Counts SQL statements and commits issued per endpoint call.
+
+Run from lab_01/:  poetry run python benchmarks/bench_statement_counts.py
+
+Each endpoint is called once against a fresh SQLite file with a few seeded rows;
+BEGIN/COMMIT are reported separately from the statements the app executes.
+"""
+import os
+import tempfile
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+
+from lab_01.database import Base, get_db, get_read_db, session_factory
+from lab_01.main import app
+
+def main():
+    fd, path = tempfile.mkstemp(suffix=".db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    # same session options as the app, bound to the scratch database
+    TestingSessionLocal = session_factory(engine)
+
+    def override_get_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # GET routes too: every statement is counted on the one engine
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    counts = {"statements": 0, "commits": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_statement(*args):
+        counts["statements"] += 1
+
+    @event.listens_for(engine, "commit")
+    def _count_commit(*args):
+        counts["commits"] += 1
+
+    client = TestClient(app)
+    client.post("/api/v1/forbidden/", json={"phrase": "bad"})
+    pid = client.post("/api/v1/products/", json={"name": "Seed1", "category": "books", "price": 10.0, "quantity": 1}).json()["id"]
+    other = client.post("/api/v1/products/", json={"name": "Seed2", "category": "books", "price": 10.0, "quantity": 1}).json()["id"]
+
+    calls = [
+        ("POST /products/", lambda: client.post("/api/v1/products/", json={"name": "Fresh1", "category": "books", "price": 10.0, "quantity": 1})),
+        ("POST /products/ (dup name)", lambda: client.post("/api/v1/products/", json={"name": "Seed1", "category": "books", "price": 10.0, "quantity": 1})),
+        ("GET /products/{id}", lambda: client.get(f"/api/v1/products/{pid}")),
+        ("GET /products/{id} (cached)", lambda: client.get(f"/api/v1/products/{pid}")),
+        ("GET /products/{id} (304)", lambda: client.get(f"/api/v1/products/{pid}", headers={"If-None-Match": client.get(f"/api/v1/products/{pid}").headers.get("ETag", "")})),
+        ("PUT /products/{id}", lambda: client.put(f"/api/v1/products/{pid}", json={"name": "Seed1b", "category": "books", "price": 12.0, "quantity": 2})),
+        ("GET /products/{id}/history", lambda: client.get(f"/api/v1/products/{pid}/history")),
+        ("DELETE /products/{id}", lambda: client.delete(f"/api/v1/products/{other}")),
+        ("POST /forbidden/", lambda: client.post("/api/v1/forbidden/", json={"phrase": "ugly"})),
+        ("DELETE /forbidden/{id}", lambda: client.delete("/api/v1/forbidden/1")),
+    ]
+    print(f"{'endpoint':<28} | status | statements | commits")
+    for label, call in calls:
+        counts.update(statements=0, commits=0)
+        r = call()
+        print(f"{label:<28} | {r.status_code:>6} | {counts['statements']:>10} | {counts['commits']:>7}")
+
+    app.dependency_overrides.clear()
+    engine.dispose()
+    os.close(fd)
+    os.unlink(path)
+
+if __name__ == "__main__":
+    main()
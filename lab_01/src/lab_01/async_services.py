@@ -0,0 +1,99 @@
+"""
+Async facades over ProductService / ForbiddenService for DB_MODE=async (experimental).
+
+The business rules and repositories are not duplicated: each call runs the sync
+service on the AsyncSession's underlying Session through `run_sync`. That only makes
+the session's own queries async (over aiosqlite); everything else the service does runs
+on the event loop. The parts that block on their own sync engine (cache_sync reads,
+the first load of the forbidden phrase matcher, a history sink flush under
+backpressure) are done in the threadpool first, so that inside run_sync they find
+their work done. Not a throughput improvement on SQLite: aiosqlite runs every query
+on its own thread anyway (see benchmarks/bench_async_load.py).
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import cache_sync, forbidden_matcher, history_sink, models, schemas, services
+from .database import sync_engine
+
+def _load_matcher(db: AsyncSession):
+    engine = sync_engine(db)  # a new sync engine on the async session's database
+    try:
+        with Session(engine) as s:
+            forbidden_matcher.get_matcher(s)
+    finally:
+        engine.dispose()
+
+async def off_loop(db: AsyncSession, names: bool = False, writes: bool = False):
+    """
+    Before a run_sync call: the blocking side work the sync service would otherwise do on
+    the event loop. `names`: the call checks names against forbidden phrases; `writes`: it
+    commits product changes (history). Another request may still fill the history queue
+    in between; record() then flushes on the loop as before.
+    """
+    if cache_sync.CACHE_SYNC:
+        await run_in_threadpool(cache_sync.check, db)
+    if names and not forbidden_matcher.loaded(db):
+        await run_in_threadpool(_load_matcher, db)
+    if writes and history_sink.batched():
+        sink = history_sink.for_session(db)
+        if sink.full():
+            await run_in_threadpool(sink.flush)
+
+class AsyncProductService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def create_product(self, data: schemas.ProductCreate) -> models.Product:
+        await off_loop(self.db, names=True, writes=True)
+        return await self.db.run_sync(lambda s: services.ProductService(s).create_product(data))
+
+    async def list_products(self, **filters) -> Tuple[List[Row], Optional[str]]:
+        return await self.db.run_sync(lambda s: services.ProductService(s).list_products(**filters))
+
+    async def get_category_stats(self) -> List[dict]:
+        return await self.db.run_sync(lambda s: services.ProductService(s).get_category_stats())
+
+    async def search_products(self, **params) -> Tuple[List[Row], Optional[str]]:
+        return await self.db.run_sync(lambda s: services.ProductService(s).search_products(**params))
+
+    async def get_product(self, product_id: int) -> models.Product:
+        return await self.db.run_sync(lambda s: services.ProductService(s).get_product(product_id))
+
+    async def update_product(self, product_id: int, data: schemas.ProductUpdate, if_match: Optional[int] = None) -> models.Product:
+        await off_loop(self.db, names=True, writes=True)
+        return await self.db.run_sync(lambda s: services.ProductService(s).update_product(product_id, data, if_match))
+
+    async def delete_product(self, product_id: int, version: Optional[int] = None, if_match: Optional[int] = None):
+        await off_loop(self.db, writes=True)
+        return await self.db.run_sync(lambda s: services.ProductService(s).delete_product(product_id, version, if_match))
+
+    async def adjust_stock(self, product_id: int, delta: int) -> dict:
+        await off_loop(self.db, writes=True)
+        return await self.db.run_sync(lambda s: services.ProductService(s).adjust_stock(product_id, delta))
+
+    async def get_history(self, product_id: int, limit: int = 100, cursor: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+        return await self.db.run_sync(lambda s: services.ProductService(s).get_history(product_id, limit, cursor))
+
+    async def get_product_as_of(self, product_id: int, moment: datetime) -> dict:
+        return await self.db.run_sync(lambda s: services.ProductService(s).get_product_as_of(product_id, moment))
+
+class AsyncForbiddenService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def list_phrases(self) -> List[models.ForbiddenPhrase]:
+        return await self.db.run_sync(lambda s: services.ForbiddenService(s).list_phrases())
+
+    async def create_phrase(self, phrase: str) -> models.ForbiddenPhrase:
+        await off_loop(self.db)
+        return await self.db.run_sync(lambda s: services.ForbiddenService(s).create_phrase(phrase))
+
+    async def delete_phrase(self, phrase_id: int):
+        await off_loop(self.db)
+        return await self.db.run_sync(lambda s: services.ForbiddenService(s).delete_phrase(phrase_id))
@@ -0,0 +1,230 @@
+"""
+Bulk loading of forbidden phrases and synthetic products.
+
+Rows go in with DBAPI executemany of a Core-compiled INSERT (no per-row ORM or Core
+parameter handling), in chunks, all in one transaction, with product ids assigned up
+front so their history rows need no RETURNING. For large loads the non-unique secondary
+indexes are dropped first and rebuilt at the end: one sort per index instead of a B-tree
+insert per row and index. Generated products follow the same rules as the API (name
+pattern, PRICE_RULES, no forbidden phrase in the name, no name that is already taken).
+
+Command line (`poetry run seed`):
+    seed --per-category 333334 --history 3 [--seed 0] [--database-url sqlite:///...]
+"""
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+from typing import Collection, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import argparse
+import random
+import re
+import time
+
+from sqlalchemy import Integer, Table, cast, func, insert, or_, select
+from sqlalchemy.engine import Connection, Engine
+
+from . import models
+from .database import DATABASE_URL, Base, create_db_engine
+from .forbidden_matcher import ForbiddenMatcher
+from .repositories import HISTORY_SNAPSHOT_EVERY, StatsRepository
+from .services import PRICE_RULES
+
+CHUNK_SIZE = 50_000
+DEFER_INDEXES_MIN_ROWS = 100_000
+PRODUCT_COLUMNS = ("id", "name", "category", "price", "quantity", "version")
+HISTORY_COLUMNS = ("product_id", "operation", "version", "is_snapshot", "data", "changed_at")
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9]{3,20}$")
+NAME_PREFIXES = {"electronics": "Elec", "books": "Book", "clothing": "Wear"}
+
+class SeedStats(NamedTuple):
+    products: int
+    histories: int
+    seconds: float
+
+def insert_forbidden(conn: Connection, phrases: Iterable[str]) -> int:
+    """Insert the phrases that are not there yet; returns how many were added."""
+    F = models.ForbiddenPhrase
+    existing = set(conn.execute(select(F.phrase)).scalars())
+    new = [{"phrase": p} for p in dict.fromkeys(phrases) if p not in existing]
+    if new:
+        conn.execute(insert(F), new)
+    return len(new)
+
+def load_matcher(conn: Connection) -> ForbiddenMatcher:
+    F = models.ForbiddenPhrase
+    return ForbiddenMatcher(conn.execute(select(F.id, F.phrase)).all())
+
+def is_valid(product: dict, matcher: ForbiddenMatcher) -> bool:
+    """The create_product rules, without the database round trips."""
+    rules = PRICE_RULES.get(product["category"])
+    return (
+        rules is not None
+        and rules["min"] <= product["price"] <= rules["max"]
+        and product["quantity"] >= 0
+        and NAME_PATTERN.match(product["name"]) is not None
+        and matcher.find(product["name"]) is None
+    )
+
+def _prefix_can_match(prefix: str, matcher: ForbiddenMatcher) -> bool:
+    """Whether some name `prefix` + digits may contain a forbidden phrase."""
+    prefix = prefix.lower()
+    for phrase in matcher.phrases():
+        phrase = phrase.lower()
+        # a phrase inside "prefix123" is either inside the prefix, or a (possibly empty)
+        # tail of the prefix followed by digits only
+        letters = phrase.rstrip("0123456789")
+        if phrase in prefix or prefix.endswith(letters):
+            return True
+    return False
+
+def taken_names(conn: Connection, start: int) -> set:
+    """Existing names that generate_products could produce for ids from `start` (set by hand through the API)."""
+    P = models.Product
+    return set(conn.execute(select(P.name).where(or_(*(
+        P.name.like(prefix + "%") & (cast(func.substr(P.name, len(prefix) + 1), Integer) >= start)
+        for prefix in {NAME_PREFIXES.get(category, "Item") for category in PRICE_RULES}
+    )))).scalars())
+
+def generate_products(per_category: int, matcher: ForbiddenMatcher, start: int = 1, seed: int = 0, taken: Collection[str] = ()) -> Iterator[dict]:
+    """
+    `per_category` valid products per category, ids from `start`, categories interleaved.
+    Names are a category prefix plus the id, so they are unique among generated rows;
+    names that would contain a forbidden phrase or are in `taken` are skipped.
+    """
+    rnd = random.Random(seed)
+    remaining = {category: per_category for category in PRICE_RULES}
+    prefixes = {category: NAME_PREFIXES.get(category, "Item") for category in PRICE_RULES}
+    check = {category: _prefix_can_match(prefix, matcher) for category, prefix in prefixes.items()}
+    pid = start
+    while any(remaining.values()):
+        for category, rules in PRICE_RULES.items():
+            if not remaining[category]:
+                continue
+            name = prefixes[category] + str(pid)
+            if (not check[category] or matcher.find(name) is None) and name not in taken:
+                remaining[category] -= 1
+                yield {
+                    "id": pid,
+                    "name": name,
+                    "category": category,
+                    "price": round(rnd.uniform(rules["min"], rules["max"]), 2),
+                    "quantity": rnd.randint(0, 1000),
+                }
+            pid += 1
+
+def _snapshot_json(p: dict) -> str:
+    # same text as the compact JSON the repository writes; names are [A-Za-z0-9] and
+    # categories are enum values, so nothing needs escaping
+    return '{"id":%d,"name":"%s","category":"%s","price":%r,"quantity":%d}' % (
+        p["id"], p["name"], p["category"], float(p["price"]), p["quantity"])
+
+class _BulkInsert:
+    """INSERT of `columns` into `table`, executed straight through the DBAPI cursor (rows hold DBAPI values)."""
+
+    def __init__(self, conn: Connection, table: Table, columns: Tuple[str, ...]):
+        self.conn = conn
+        compiled = insert(table).compile(dialect=conn.dialect, column_keys=list(columns))
+        self.sql = str(compiled)
+        # parameter order of the compiled statement (table order, not `columns` order)
+        self.keys = tuple(compiled.positiontup) if compiled.positional else None
+
+    def __call__(self, rows: List[dict]):
+        if rows:
+            if self.keys is not None:
+                rows = [tuple(row[k] for k in self.keys) for row in rows]
+            self.conn.exec_driver_sql(self.sql, rows)
+
+def insert_products(conn: Connection, products: Iterable[dict], history: int = 1, seed: int = 0, chunk_size: int = CHUNK_SIZE) -> SeedStats:
+    """
+    Insert products (with ids set), their search index entries and `history` versions for
+    each, in chunks: the create and history-1 quantity updates one hour apart, the last one
+    now, stored the way HistoryRepository stores them. The product row is the state of its
+    last version, and has that version number.
+    """
+    start = time.perf_counter()
+    rnd = random.Random(seed)
+    H = models.ProductHistory
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    to_db = H.changed_at.type._cached_bind_processor(conn.dialect) or (lambda v: v)
+    stamps = [to_db(now - timedelta(hours=history - v)) for v in range(1, history + 1)]
+    every = HISTORY_SNAPSHOT_EVERY
+    insert_product_rows = _BulkInsert(conn, models.Product.__table__, PRODUCT_COLUMNS)
+    insert_history_rows = _BulkInsert(conn, H.__table__, HISTORY_COLUMNS)
+    insert_search_rows = _BulkInsert(conn, models.products_fts, ("rowid", "name"))
+    counts = [0, 0]
+    chunk: List[dict] = []
+    histories: List[dict] = []
+
+    def write():
+        insert_product_rows(chunk)
+        insert_history_rows(histories)
+        insert_search_rows([{"rowid": p["id"], "name": p["name"]} for p in chunk])
+        counts[0] += len(chunk)
+        counts[1] += len(histories)
+        chunk.clear()
+        histories.clear()
+
+    for product in products:
+        product = dict(product, version=max(history, 1))
+        for v in range(1, history + 1):
+            if v > 1:
+                product["quantity"] = rnd.randint(0, 1000)
+            snapshot = (v - 1) % every == 0
+            histories.append({
+                "product_id": product["id"],
+                "operation": "create" if v == 1 else "update",
+                "version": v,
+                "is_snapshot": snapshot,
+                "data": _snapshot_json(product) if snapshot else '{"quantity":%d}' % product["quantity"],
+                "changed_at": stamps[v - 1],
+            })
+        chunk.append(product)
+        if len(chunk) >= chunk_size:
+            write()
+    write()
+    return SeedStats(counts[0], counts[1], time.perf_counter() - start)
+
+@contextmanager
+def deferred_indexes(conn: Connection, *tables: Table):
+    """
+    Drop the non-unique secondary indexes of `tables` and build them again on exit (same
+    transaction). Unique ones stay, so a duplicate fails at its INSERT, not at the rebuild.
+    """
+    indexes = [index for table in tables for index in table.indexes if not index.unique]
+    for index in indexes:
+        index.drop(conn)
+    yield
+    for index in indexes:
+        index.create(conn)
+
+def seed(engine: Engine, per_category: int, history: int = 1, seed: int = 0, chunk_size: int = CHUNK_SIZE) -> SeedStats:
+    """Create the tables if needed and add `per_category` generated products per category in one transaction."""
+    Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        # past deleted products too: their history keeps their ids
+        first_id = max(conn.execute(select(func.max(models.Product.id))).scalar() or 0,
+                       conn.execute(select(func.max(models.ProductHistory.product_id))).scalar() or 0) + 1
+        products = generate_products(per_category, load_matcher(conn), start=first_id, seed=seed, taken=taken_names(conn, first_id))
+        tables = (models.Product.__table__, models.ProductHistory.__table__)
+        large = per_category * len(PRICE_RULES) >= DEFER_INDEXES_MIN_ROWS
+        with deferred_indexes(conn, *tables) if large else nullcontext():
+            stats = insert_products(conn, products, history=history, seed=seed, chunk_size=chunk_size)
+        StatsRepository(conn).rebuild()
+    return stats._replace(seconds=time.perf_counter() - start)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk-load synthetic products (with history) into the database.")
+    parser.add_argument("--per-category", type=int, required=True, help="products generated for each category")
+    parser.add_argument("--history", type=int, default=1, help="history versions per product (0 = none)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for prices and quantities")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    engine = create_db_engine(args.database_url)
+    stats = seed(engine, args.per_category, history=args.history, seed=args.seed, chunk_size=args.chunk_size)
+    engine.dispose()
+    print(f"inserted {stats.products} products and {stats.histories} history rows in {stats.seconds:.1f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Invalidation of the in-process caches (response_cache, forbidden_matcher) across worker processes.
+
+Each worker started by `run_prod` has its own caches and only sees its own writes. So that
+the others notice them, every write also bumps a counter in the cache_generations table
+("products" or "forbidden") in the same transaction. Each process remembers the generations
+its caches are built at and, at most every CACHE_SYNC_INTERVAL_MS, reads the table (one
+SELECT of a couple of rows); a counter that moved means another process wrote, and the
+caches registered for it are dropped for that database. The interval bounds how long a
+worker may serve a response or check a name against phrases another worker has changed.
+
+Enabled when WORKERS > 1 (or CACHE_SYNC=on); a single process adds no statements.
+"""
+from typing import Callable, Dict, List
+import os
+import threading
+import time
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .database import database_key, sync_engine
+from .repositories import GenerationRepository
+
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+CACHE_SYNC = os.getenv("CACHE_SYNC", "on" if WORKERS > 1 else "off").lower() == "on"
+CACHE_SYNC_INTERVAL_MS = float(os.getenv("CACHE_SYNC_INTERVAL_MS", "100"))
+
+# cache name -> callbacks dropping that cache for one database (by database_key)
+_listeners: Dict[str, List[Callable[[str], None]]] = {}
+
+def on_invalidate(name: str, callback: Callable[[str], None]):
+    _listeners.setdefault(name, []).append(callback)
+
+def _invalidate(key: str, name: str):
+    for callback in _listeners.get(name, ()):
+        callback(key)
+
+class _Generations:
+    def __init__(self, key: str, engine: Engine):
+        self.key = key
+        self.engine = engine
+        self.seen = self._read()
+        self.checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, int]:
+        with Session(self.engine) as db:
+            return GenerationRepository(db).all()
+
+    def check(self, interval: float):
+        if time.monotonic() - self.checked_at < interval:
+            return
+        with self._lock:
+            if time.monotonic() - self.checked_at < interval:
+                return
+            current = self._read()
+            self.checked_at = time.monotonic()
+            for name, generation in current.items():
+                if generation > self.seen.get(name, 0):
+                    self.seen[name] = generation
+                    _invalidate(self.key, name)
+
+    def committed(self, name: str, generation: int):
+        with self._lock:
+            seen = self.seen.get(name, 0)
+            if generation <= seen:
+                return
+            self.seen[name] = generation
+        # skipped a generation: another process wrote in between
+        if generation != seen + 1:
+            _invalidate(self.key, name)
+
+_states: Dict[str, _Generations] = {}
+_states_lock = threading.Lock()
+
+def _state(db) -> _Generations:
+    key = database_key(db)
+    state = _states.get(key)
+    if state is None:
+        with _states_lock:
+            state = _states.get(key)
+            if state is None:
+                state = _states[key] = _Generations(key, sync_engine(db))
+    return state
+
+def check(db):
+    """Drop the caches other processes have invalidated; called before a cache is used."""
+    if CACHE_SYNC:
+        _state(db).check(CACHE_SYNC_INTERVAL_MS / 1000)
+
+def bump(db: Session, name: str):
+    """
+    Mark cache `name` as changed in the current transaction (call right before the commit);
+    returns a token for committed(), None when disabled.
+    """
+    if not CACHE_SYNC:
+        return None
+    _state(db)  # the generations before this write
+    return GenerationRepository(db).bump(name)
+
+def committed(db, name: str, generation):
+    if generation is not None:
+        _state(db).committed(name, generation)
+
+def reset():
+    with _states_lock:
+        _states.clear()
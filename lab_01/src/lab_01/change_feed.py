@@ -0,0 +1,208 @@
+"""
+Change feed: committed product_histories rows pushed to subscribers as Server-Sent Events.
+
+One ChangeFeed per database and process. Its loader thread reads the history rows after
+the newest one it has seen, once per wake-up: ProductService and the history sink wake it
+after each commit, and it also looks every FEED_POLL_INTERVAL_MS for rows written by other
+processes. Each event is encoded once into an SSE frame and kept in a buffer of the last
+FEED_BUFFER_SIZE events. Subscribers read only that buffer and are woken through one
+asyncio.Event per event loop, so the database sees the same queries for one subscriber or
+thousands. A subscriber resuming from a cursor older than the buffer pages through the
+table itself (FEED_PAGE_SIZE rows per query) until it reaches the buffer.
+
+The cursor is the history id. Ids follow commit order because SQLite has a single writer.
+"""
+from bisect import bisect_right
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import fast_json, metrics
+from .database import database_key, sync_engine
+from .repositories import HistoryRepository
+
+FEED_BUFFER_SIZE = int(os.getenv("FEED_BUFFER_SIZE", "10000"))
+FEED_PAGE_SIZE = int(os.getenv("FEED_PAGE_SIZE", "500"))
+FEED_POLL_INTERVAL_MS = float(os.getenv("FEED_POLL_INTERVAL_MS", "1000"))
+FEED_KEEPALIVE_S = float(os.getenv("FEED_KEEPALIVE_S", "15"))
+
+SUBSCRIBERS = metrics.Gauge("change_feed_subscribers", "Open change feed streams")
+LOADED_EVENTS = metrics.Counter("change_feed_loaded_events_total", "History events loaded into the change feed buffer")
+CATCH_UP_QUERIES = metrics.Counter("change_feed_catch_up_queries_total", "Pages read for subscribers behind the buffer")
+
+logger = logging.getLogger(__name__)
+
+def _frame(event: dict) -> bytes:
+    return b"id: %d\ndata: %s\n\n" % (event["id"], fast_json.dumps(event))
+
+class ChangeFeed:
+    def __init__(
+        self,
+        engine: Engine,
+        buffer_size: int = FEED_BUFFER_SIZE,
+        page_size: int = FEED_PAGE_SIZE,
+        poll_interval_ms: float = FEED_POLL_INTERVAL_MS,
+    ):
+        self.engine = engine
+        self.buffer_size = max(1, buffer_size)
+        self.page_size = max(1, page_size)
+        self.poll_interval = poll_interval_ms / 1000
+        # the buffer holds every event with base < id <= head
+        self.base = 0
+        self.head = 0
+        self._ids: List[int] = []
+        self._frames: List[bytes] = []
+        self._lock = threading.Lock()
+        self._waiters: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+        self._wakeup = threading.Condition()
+        self._changed = False
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def start(self):
+        """Read the current head and start the loader (once). Blocking: not on the event loop."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            with Session(self.engine) as db:
+                self.base = self.head = HistoryRepository(db).last_id()
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        with self._wakeup:
+            self._changed = True
+            self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                self._wakeup.wait_for(lambda: self._changed or self._closed, timeout=self.poll_interval)
+                if self._closed:
+                    return
+                self._changed = False
+            try:
+                self._load()
+            except Exception:
+                logger.exception("change feed load failed")
+
+    def _load(self):
+        while True:
+            with Session(self.engine) as db:
+                events = HistoryRepository(db).changes(self.head, self.page_size)
+            if not events:
+                return
+            frames = [_frame(e) for e in events]
+            with self._lock:
+                self._ids.extend(e["id"] for e in events)
+                self._frames.extend(frames)
+                self.head = self._ids[-1]
+                evicted = len(self._ids) - self.buffer_size
+                if evicted > 0:
+                    self.base = self._ids[evicted - 1]
+                    del self._ids[:evicted], self._frames[:evicted]
+                waiters, self._waiters = self._waiters, {}
+            LOADED_EVENTS.inc(len(events))
+            for loop, event in waiters.items():
+                try:
+                    loop.call_soon_threadsafe(event.set)
+                except RuntimeError:  # loop closed meanwhile
+                    pass
+            if len(events) < self.page_size:
+                return
+
+    def read(self, cursor: int, limit: int) -> Optional[List[Tuple[int, bytes]]]:
+        """Buffered (id, frame) pairs after `cursor`; None if the buffer no longer reaches back to it."""
+        with self._lock:
+            if cursor < self.base:
+                return None
+            i = bisect_right(self._ids, cursor)
+            return list(zip(self._ids[i:i + limit], self._frames[i:i + limit]))
+
+    def catch_up(self, cursor: int, limit: int) -> List[Tuple[int, bytes]]:
+        """(id, frame) pairs after `cursor` read from the table, up to the start of the buffer. Blocking."""
+        CATCH_UP_QUERIES.inc()
+        base = self.base
+        with Session(self.engine) as db:
+            events = HistoryRepository(db).changes(cursor, min(limit, self.page_size), upto_id=base)
+        # nothing left below the buffer: continue from its start
+        return [(e["id"], _frame(e)) for e in events] or [(base, b"")]
+
+    async def wait(self, cursor: int, timeout: float) -> bool:
+        """Until an event after `cursor` is buffered; False on timeout."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.head > cursor:
+                return True
+            event = self._waiters.get(loop)
+            if event is None:
+                event = self._waiters[loop] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self):
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+
+_feeds: Dict[str, ChangeFeed] = {}
+_feeds_lock = threading.Lock()
+
+def for_session(db) -> ChangeFeed:
+    key = database_key(db)
+    feed = _feeds.get(key)
+    if feed is None:
+        with _feeds_lock:
+            feed = _feeds.get(key)
+            if feed is None:
+                feed = _feeds[key] = ChangeFeed(sync_engine(db), FEED_BUFFER_SIZE, FEED_PAGE_SIZE, FEED_POLL_INTERVAL_MS)
+    return feed
+
+def notify(db):
+    """Called after history rows were committed; no-op while nobody has subscribed."""
+    feed = _feeds.get(database_key(db))
+    if feed is not None:
+        feed.notify()
+
+def shutdown():
+    with _feeds_lock:
+        feeds = list(_feeds.values())
+        _feeds.clear()
+    for feed in feeds:
+        feed.close()
+
+async def stream(feed: ChangeFeed, cursor: int, limit: Optional[int] = None) -> AsyncIterator[bytes]:
+    """SSE body: the events after `cursor`, then new ones as they are committed (`limit` events at most)."""
+    remaining = limit
+    SUBSCRIBERS.inc()
+    try:
+        # tell the client how often to reconnect if the connection drops
+        yield b"retry: 1000\n\n"
+        while remaining is None or remaining > 0:
+            size = feed.page_size if remaining is None else min(remaining, feed.page_size)
+            batch = feed.read(cursor, size)
+            if batch is None:
+                batch = await run_in_threadpool(feed.catch_up, cursor, size)
+            if batch:
+                cursor = batch[-1][0]
+                frames = [frame for _, frame in batch if frame]
+                if frames:
+                    if remaining is not None:
+                        remaining -= len(frames)
+                    yield b"".join(frames)
+            elif not await feed.wait(cursor, FEED_KEEPALIVE_S):
+                yield b": keepalive\n\n"
+    finally:
+        SUBSCRIBERS.dec()
@@ -1,7 +1,14 @@
 import os
+import time
 from pathlib import Path
-from sqlalchemy import create_engine
+from typing import Dict, Optional
+from fastapi import Request, Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+
+from . import instrumentation
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 
@@ -9,17 +16,204 @@ DEFAULT_DB_PATH = PROJECT_ROOT / "lab01.db"
 
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DEFAULT_DB_PATH}")
 
-# sqlite needs check_same_thread=False when using sessions across threads
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+# GET routes read through a separate engine: by default the same database opened with
+# PRAGMA query_only (its own pool, so long reads don't hold write connections), or a replica
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", DATABASE_URL)
+
+# "sync" (default) or "async"; async mode needs the optional `async` extra (aiosqlite, greenlet)
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgresql:"):
+        return "postgresql+asyncpg:" + url[len("postgresql:"):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+
+# --- SQLite tuning profile ---
+# "production" (default): WAL, so readers don't wait for the writer; synchronous=NORMAL (durable
+# at checkpoints, safe with WAL); writers wait busy_timeout ms for the lock instead of failing
+# with "database is locked"; bigger page cache, mmap'd reads, temp tables in memory.
+# "default": plain SQLite settings (rollback journal, synchronous=FULL, no busy timeout).
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production").lower()
+
+SQLITE_PRAGMAS = {
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),  # negative = KiB
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "temp_store": "MEMORY",
+    },
+    "default": {},
+}
+
+# QueuePool settings (file databases / server databases; an in-memory SQLite database lives in
+# a single connection, shared by every session through StaticPool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(DB_POOL_SIZE)))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", str(DB_MAX_OVERFLOW)))
+
+# read-your-writes: after a write, the client's GETs go to the primary for this many seconds
+# (a cookie set on the write response); needed only when READ_DATABASE_URL is a lagging replica
+READ_YOUR_WRITES_S = float(os.getenv("READ_YOUR_WRITES_S", "0" if READ_DATABASE_URL == DATABASE_URL else "5"))
+READ_PRIMARY_COOKIE = "read_primary"
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and make_url(url).database in (None, "", ":memory:")
+
+def apply_sqlite_profile(engine: Engine, profile: str = SQLITE_PROFILE):
+    """Run the profile's PRAGMAs on every new DBAPI connection of `engine` (sync engine)."""
+    pragmas = SQLITE_PRAGMAS[profile]
+    if not pragmas or _is_memory_sqlite(str(engine.url)):
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def instrument_engine(engine: Engine):
+    """Time every statement of `engine` (sync engine) for /metrics and the current request's profile."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+        instrumentation.sql_executed(statement, time.perf_counter() - context._query_start)
+
+def pool_options(url: str, read_only: bool = False) -> dict:
+    if _is_memory_sqlite(url):
+        return {"poolclass": StaticPool}
+    if read_only:
+        return {"pool_size": DB_READ_POOL_SIZE, "max_overflow": DB_READ_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+
+def make_read_only(engine: Engine):
+    """Refuse writes on every new DBAPI connection of `engine` (sync engine)."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _query_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+def create_db_engine(url: str, profile: Optional[str] = None, read_only: bool = False) -> Engine:
+    # sqlite needs check_same_thread=False when using sessions across threads
+    connect_args = {"check_same_thread": False} if _is_sqlite(url) else {}
+    if read_only and make_url(url).get_backend_name() == "postgresql":
+        connect_args["options"] = "-c default_transaction_read_only=on"
+    new_engine = create_engine(url, connect_args=connect_args, future=True, **pool_options(url, read_only))
+    if _is_sqlite(url):
+        apply_sqlite_profile(new_engine, profile or SQLITE_PROFILE)
+    if read_only:
+        make_read_only(new_engine)
+    instrument_engine(new_engine)
+    return new_engine
+
+def session_factory(bind, **kw) -> sessionmaker:
+    """Sessions on `bind` (an engine, or a connection whose transaction they join) configured like SessionLocal."""
+    # objects stay loaded after commit, so returning them does not trigger a refresh SELECT
+    return sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=bind, future=True, **kw)
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args, future=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
+# engines connect lazily: importing this module opens no database
+engine = create_db_engine(DATABASE_URL)
+SessionLocal = session_factory(engine)
+
+# an in-memory database exists only in its own connection: reads must use the primary engine
+read_engine = engine if _is_memory_sqlite(READ_DATABASE_URL) else create_db_engine(READ_DATABASE_URL, read_only=True)
+ReadSessionLocal = session_factory(read_engine)
 
 Base = declarative_base()
 
+def _url_key(url) -> str:
+    # the same database through the sync and the async driver gets the same key
+    url = make_url(url)
+    return str(url.set(drivername=url.get_backend_name()))
+
+# a replica shares the primary's caches: writes invalidate them under the primary's key
+_key_aliases: Dict[str, str] = {_url_key(READ_DATABASE_URL): _url_key(DATABASE_URL)}
+
+def database_key(db) -> str:
+    """Identity of the database behind a (sync or async) session, used to key process-wide caches."""
+    key = _url_key(db.get_bind().engine.url)
+    return _key_aliases.get(key, key)
+
+def sync_engine(db) -> Engine:
+    """A sync engine on the database behind `db`, for background threads (history sink, change feed)."""
+    bind = db.get_bind()
+    if not bind.dialect.is_async:
+        return bind.engine
+    # DB_MODE=async: a sync engine on the same database
+    url = bind.engine.url.set(drivername=bind.engine.url.get_backend_name())
+    return create_db_engine(url.render_as_string(hide_password=False))
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def reads_from_primary(request: Request) -> bool:
+    return READ_PRIMARY_COOKIE in request.cookies
+
+def written(response: Response):
+    """Send the client's next READ_YOUR_WRITES_S seconds of GETs to the primary."""
+    if READ_YOUR_WRITES_S > 0:
+        response.set_cookie(READ_PRIMARY_COOKIE, "1", max_age=int(max(1, READ_YOUR_WRITES_S)), httponly=True, samesite="lax")
+
+def get_read_db(request: Request):
+    """Session for GET routes: the read engine, or the primary right after the client's own write."""
+    db = SessionLocal() if reads_from_primary(request) else ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# The sync engine above stays available in async mode: seeding, exports and batch routes use it.
+async_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL))
+    if _is_sqlite(ASYNC_DATABASE_URL):
+        apply_sqlite_profile(async_engine.sync_engine)
+    instrument_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    AsyncReadSessionLocal = AsyncSessionLocal
+    if read_engine is not engine:
+        read_url = _async_url(READ_DATABASE_URL)
+        async_read_engine = create_async_engine(read_url, **pool_options(read_url, read_only=True))
+        if _is_sqlite(read_url):
+            apply_sqlite_profile(async_read_engine.sync_engine)
+        make_read_only(async_read_engine.sync_engine)
+        instrument_engine(async_read_engine.sync_engine)
+        AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db(request: Request):
+    factory = AsyncSessionLocal if reads_from_primary(request) else AsyncReadSessionLocal
+    async with factory() as db:
+        yield db
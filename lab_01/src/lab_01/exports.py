@@ -0,0 +1,55 @@
+from datetime import datetime
+from typing import Iterable, Iterator, Sequence
+import csv
+import io
+import json
+
+from sqlalchemy.engine import Result
+
+# rows are fetched and encoded in batches: one chunk on the wire per batch
+EXPORT_BATCH_SIZE = 1000
+# history export: products whose last exported state is kept to apply the next delta to
+# (others are replayed from their nearest snapshot), so memory does not grow with the table
+EXPORT_HISTORY_STATES = 10_000
+
+# columns of the history export: each version with the product's full state, as the history endpoint returns it
+HISTORY_FIELDS = ("id", "product_id", "changed_at", "operation", "snapshot")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def ndjson_chunks(fields: Sequence[str], batches: Iterable[Sequence]) -> Iterator[str]:
+    dumps = json.JSONEncoder(separators=(",", ":"), default=_json_default).encode
+    for batch in batches:
+        yield "".join(dumps(dict(zip(fields, row))) + "\n" for row in batch)
+
+def csv_chunks(fields: Sequence[str], batches: Iterable[Sequence]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(fields)
+    # header goes out before the first batch is fetched
+    yield buf.getvalue()
+    for batch in batches:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(
+            [v.isoformat() if isinstance(v, datetime) else v for v in row] for row in batch
+        )
+        yield buf.getvalue()
+
+def stream(fmt: str, result: Result) -> Iterator[str]:
+    """Encode a `yield_per` result as NDJSON or CSV, one chunk per fetched partition."""
+    return encode(fmt, list(result.keys()), result.partitions())
+
+def encode(fmt: str, fields: Sequence[str], batches: Iterable[Sequence]) -> Iterator[str]:
+    """Encode batches of rows with the given columns as NDJSON or CSV, one chunk per batch."""
+    if fmt == "csv":
+        return csv_chunks(fields, batches)
+    return ndjson_chunks(fields, batches)
@@ -0,0 +1,33 @@
+"""
+Response bodies for the read-heavy endpoints, encoded straight from column tuples.
+
+The list and history endpoints select plain columns (no ORM objects) and turn the rows
+into JSON bytes here, without building a Pydantic model per row. The output matches
+what the response_model would produce (same keys, floats, ISO datetimes), and the routes
+keep their response_model, so the OpenAPI schema does not change. Encoding uses orjson
+when it is installed (optional `speedups` extra), the standard json module otherwise.
+"""
+from datetime import datetime
+from typing import Any, Iterable, Sequence
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=_default).encode
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return _encode(obj).encode()
+
+def rows(fields: Sequence[str], values: Iterable[Sequence]) -> bytes:
+    """JSON array of objects: one per row, keys `fields` in order."""
+    return dumps([dict(zip(fields, row)) for row in values])
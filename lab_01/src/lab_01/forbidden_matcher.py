@@ -0,0 +1,229 @@
+from bisect import bisect_right
+from collections import deque
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+import threading
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import cache_sync, repositories
+from .database import database_key
+
+class ForbiddenMatcher:
+    """
+    Case-insensitive Aho-Corasick automaton over the forbidden phrases.
+    A lookup costs O(len(name)) no matter how many phrases are loaded.
+    When several phrases match, the one with the lowest id wins, so the reported
+    phrase is the same one the old per-phrase loop (table order) would report.
+
+    Added phrases are patched in as a small pending list (checked by substring)
+    and folded into the automaton once there are more than PENDING_LIMIT of them;
+    removals rebuild it lazily on the next lookup.
+    """
+
+    PENDING_LIMIT = 32
+    # find_many with up to this many phrases searches the batch once per phrase (str.find, in C)
+    # instead of walking the automaton through it character by character in Python
+    SCAN_LIMIT = 100
+
+    def __init__(self, phrases: Iterable[Tuple[int, str]] = ()):
+        self._phrases: Dict[int, str] = dict(phrases)
+        self._lock = threading.Lock()
+        # (automaton, pending) swapped as one object so lookups never see a half update
+        self._state = None
+
+    def __len__(self) -> int:
+        return len(self._phrases)
+
+    def phrases(self) -> List[str]:
+        return list(self._phrases.values())
+
+    def add(self, phrase_id: int, phrase: str):
+        with self._lock:
+            self._phrases[phrase_id] = phrase
+            if self._state is None or len(self._state[1]) >= self.PENDING_LIMIT:
+                self._state = None
+            else:
+                automaton, pending = self._state
+                self._state = (automaton, {**pending, phrase_id: phrase.lower()})
+
+    def remove(self, phrase_id: int):
+        with self._lock:
+            if self._phrases.pop(phrase_id, None) is None:
+                return
+            if self._state is not None and phrase_id in self._state[1]:
+                automaton, pending = self._state
+                self._state = (automaton, {k: v for k, v in pending.items() if k != phrase_id})
+            else:
+                self._state = None
+
+    def find(self, text: str) -> Optional[str]:
+        """Return the matching phrase (as stored) or None."""
+        state = self._state
+        if state is None:
+            state = self._build()
+        return self._match(state, text)
+
+    def find_many(self, texts: List[str]) -> List[Optional[str]]:
+        """find() of every text, in one pass over the whole batch."""
+        state = self._state
+        if state is None:
+            state = self._build()
+        phrases = {ph.lower() for ph in list(self._phrases.values())}
+        if len(phrases) > self.SCAN_LIMIT:
+            # _match inlined: calling it for every text costs about a third of the walk itself
+            (goto, fail, best), pending = state
+            found_ids: List[Optional[int]] = []
+            for text in texts:
+                lowered = text.lower()
+                found = best[0]
+                for phrase_id, ph in pending.items():
+                    if ph in lowered and (found is None or phrase_id < found):
+                        found = phrase_id
+                node = 0
+                for ch in lowered:
+                    while node and ch not in goto[node]:
+                        node = fail[node]
+                    node = goto[node].get(ch, 0)
+                    hit = best[node]
+                    if hit is not None and (found is None or hit < found):
+                        found = hit
+                found_ids.append(found)
+            return [self._phrases.get(found) if found is not None else None for found in found_ids]
+
+        # every occurrence of every phrase in the joined batch; a hit across two texts is
+        # ruled out by the exact check of its candidates below
+        lowered = [text.lower() for text in texts]
+        batch = "\n".join(lowered)
+        starts = list(accumulate((len(t) + 1 for t in lowered), initial=0))
+        candidates = set()
+        for ph in phrases:
+            i = batch.find(ph)
+            while i != -1:
+                candidates.add(bisect_right(starts, i) - 1)
+                i = batch.find(ph, i + 1)
+        return [self._match(state, texts[i]) if i in candidates else None for i in range(len(texts))]
+
+    def _match(self, state, text: str) -> Optional[str]:
+        (goto, fail, best), pending = state
+
+        lowered = text.lower()
+        found = best[0]
+        for phrase_id, ph in pending.items():
+            if ph in lowered and (found is None or phrase_id < found):
+                found = phrase_id
+        node = 0
+        for ch in lowered:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = best[node]
+            if hit is not None and (found is None or hit < found):
+                found = hit
+        return self._phrases.get(found) if found is not None else None
+
+    def _build(self):
+        with self._lock:
+            if self._state is not None:
+                return self._state
+            phrases = dict(self._phrases)
+
+            goto: List[Dict[str, int]] = [{}]
+            own: List[Optional[int]] = [None]
+            for phrase_id in sorted(phrases):
+                node = 0
+                for ch in phrases[phrase_id].lower():
+                    nxt = goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[node][ch] = nxt
+                        goto.append({})
+                        own.append(None)
+                    node = nxt
+                if own[node] is None:
+                    own[node] = phrase_id
+
+            # best[n] = lowest phrase id ending at n or at any suffix of n (via fail links)
+            fail = [0] * len(goto)
+            best: List[Optional[int]] = list(own)
+            queue = deque(goto[0].values())
+            for child in queue:
+                best[child] = _min_id(own[child], best[0])
+            while queue:
+                node = queue.popleft()
+                for ch, child in goto[node].items():
+                    f = fail[node]
+                    while f and ch not in goto[f]:
+                        f = fail[f]
+                    fail[child] = goto[f].get(ch, 0)
+                    best[child] = _min_id(own[child], best[fail[child]])
+                    queue.append(child)
+
+            self._state = ((goto, fail, best), {})
+            return self._state
+
+
+def _min_id(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+# one matcher per database, shared by every session/request in the process; the lock is
+# held while a matcher loads, so a phrase change committed meanwhile is applied after it
+_matchers: Dict[str, ForbiddenMatcher] = {}
+_matchers_lock = threading.Lock()
+
+def _load(db: Session) -> ForbiddenMatcher:
+    bind = db.get_bind()
+    if isinstance(bind, Engine):
+        # a connection of its own: the caller's transaction may have started before a phrase
+        # change committed (and whose hook found no matcher to update)
+        with Session(bind) as fresh:
+            return ForbiddenMatcher((p.id, p.phrase) for p in repositories.ForbiddenRepository(fresh).list_all())
+    # a session joined to a connection it was given (the tests' outer transaction)
+    return ForbiddenMatcher((p.id, p.phrase) for p in repositories.ForbiddenRepository(db).list_all())
+
+def get_matcher(db: Session) -> ForbiddenMatcher:
+    cache_sync.check(db)
+    key = database_key(db)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        with _matchers_lock:
+            matcher = _matchers.get(key)
+            if matcher is None:
+                matcher = _matchers[key] = _load(db)
+    return matcher
+
+def loaded(db) -> bool:
+    """Whether get_matcher() has the automaton for this database without reading the table."""
+    return database_key(db) in _matchers
+
+def phrase_added(db: Session, phrase_id: int, phrase: str):
+    # not built yet -> it will be loaded from the table (including this phrase) on first use;
+    # a load in progress may have read the table before the commit: wait for it and patch it
+    with _matchers_lock:
+        matcher = _matchers.get(database_key(db))
+    if matcher is not None:
+        matcher.add(phrase_id, phrase)
+
+def phrase_removed(db: Session, phrase_id: int):
+    with _matchers_lock:
+        matcher = _matchers.get(database_key(db))
+    if matcher is not None:
+        matcher.remove(phrase_id)
+
+def _changed_elsewhere(key: str):
+    # phrases added or removed by another worker: reload on next use
+    with _matchers_lock:
+        _matchers.pop(key, None)
+
+cache_sync.on_invalidate("forbidden", _changed_elsewhere)
+
+def reset():
+    """Drop every cached matcher (next lookup reloads from the database)."""
+    with _matchers_lock:
+        _matchers.clear()
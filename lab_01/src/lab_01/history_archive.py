@@ -0,0 +1,210 @@
+"""
+History retention: old product_histories rows move to compressed segment files.
+
+`compact` (`poetry run maintenance compact-history`) walks the products in batches. Versions
+past the retention policy (older than a given age, or beyond the newest N of the product)
+are written with their full state, replayed from the stored deltas, to a new segment file
+in HISTORY_ARCHIVE_DIR. Each product's newest version always stays in the table, because
+new versions are numbered from it. The first version that stays becomes a full snapshot, so
+replays never need the archive. In the same transaction the archived rows are deleted
+(one batch of products per transaction) and their blocks are indexed in history_archive.
+
+A segment file is only ever appended to. It is a series of gzip members (`zcat` reads it
+whole), each an NDJSON block of up to ARCHIVE_BLOCK_BYTES holding whole products. The index
+has one row per product and block, with its version and changed_at range, so a history page
+or an as-of lookup decompresses only the blocks it needs. A block is written and fsynced
+before the transaction that indexes it commits: a failed run leaves at most unreferenced
+bytes at the end of a segment file.
+
+The change feed and the history export read the table only, so they do not include archived versions.
+"""
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+import gzip
+import json
+import os
+import time
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .database import PROJECT_ROOT
+from .repositories import HistoryArchiveRepository, HistoryRepository, replay
+
+HISTORY_ARCHIVE_DIR = Path(os.getenv("HISTORY_ARCHIVE_DIR", str(PROJECT_ROOT / "history_archive")))
+ARCHIVE_BATCH_PRODUCTS = int(os.getenv("ARCHIVE_BATCH_PRODUCTS", "1000"))
+ARCHIVE_BLOCK_BYTES = int(os.getenv("ARCHIVE_BLOCK_BYTES", str(256 * 1024)))
+
+class RetentionPolicy(NamedTuple):
+    older_than: Optional[datetime] = None  # archive versions written before this (naive UTC)
+    keep_versions: Optional[int] = None    # keep at most this many newest versions of each product
+
+    @classmethod
+    def of(cls, days: Optional[float] = None, versions: Optional[int] = None) -> "RetentionPolicy":
+        cutoff = None
+        if days is not None:
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+        return cls(cutoff, max(1, versions) if versions is not None else None)
+
+    def keeps(self, changed_at: datetime, newer: int) -> bool:
+        """Whether a version stays in the table; `newer` = versions of the product after it."""
+        if newer == 0:
+            return True
+        if self.keep_versions is not None and newer >= self.keep_versions:
+            return False
+        return self.older_than is None or changed_at >= self.older_than
+
+class CompactionStats(NamedTuple):
+    products: int       # products with archived versions
+    archived: int       # history rows moved to the archive
+    segment: Optional[str]
+    bytes: int          # compressed size written
+    seconds: float
+
+def _archived_row(row, state: dict) -> dict:
+    return {
+        "id": row.id, "product_id": row.product_id, "changed_at": row.changed_at.isoformat(),
+        "operation": row.operation, "version": row.version, "product": state,
+    }
+
+class _Segment:
+    """A new segment file, appended to block by block."""
+
+    def __init__(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self.name = f"history-{stamp}.ndjson.gz"
+        self.file = open(directory / self.name, "xb")
+        self.size = 0
+
+    def write(self, products: List[List[dict]], data: bytes) -> List[dict]:
+        """Append one block (`data`: the NDJSON lines of `products`); index entries for it."""
+        block = gzip.compress(data, mtime=0)
+        offset = self.size
+        self.file.write(block)
+        self.size += len(block)
+        return [
+            {
+                "product_id": rows[0]["product_id"], "segment": self.name,
+                "block_offset": offset, "block_length": len(block),
+                "first_version": rows[0]["version"], "last_version": rows[-1]["version"],
+                "first_changed_at": datetime.fromisoformat(rows[0]["changed_at"]),
+                "last_changed_at": datetime.fromisoformat(rows[-1]["changed_at"]),
+            }
+            for rows in products
+        ]
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def compact(
+    engine: Engine,
+    policy: RetentionPolicy,
+    archive_dir: Optional[Path] = None,
+    batch_products: int = ARCHIVE_BATCH_PRODUCTS,
+    block_bytes: int = ARCHIVE_BLOCK_BYTES,
+) -> CompactionStats:
+    """Move the versions `policy` does not keep into a new segment file; one transaction per batch of products."""
+    start = time.perf_counter()
+    directory = Path(archive_dir or HISTORY_ARCHIVE_DIR)
+    segment: Optional[_Segment] = None
+    products = archived = 0
+    after = 0
+    try:
+        while True:
+            with Session(engine) as db:
+                history = HistoryRepository(db)
+                ids = history.product_ids_after(after, batch_products)
+                if not ids:
+                    break
+                after = ids[-1]
+                by_product: Dict[int, list] = {}
+                for row in history.rows_of_products(ids[0], ids[-1]):
+                    by_product.setdefault(row.product_id, []).append(row)
+
+                moved: List[List[dict]] = []
+                snapshots: List[dict] = []
+                for rows in by_product.values():
+                    # the oldest versions up to the first one kept (the newest always is)
+                    count = next(i for i, r in enumerate(rows) if policy.keeps(r.changed_at, len(rows) - 1 - i))
+                    if not count:
+                        continue
+                    # the table's oldest row is a snapshot (a create, or the previous run's boundary)
+                    states = replay((r.version, r.is_snapshot, r.data) for r in rows[:count + 1])
+                    moved.append([_archived_row(r, states[r.version]) for r in rows[:count]])
+                    boundary = rows[count]
+                    if not boundary.is_snapshot:
+                        snapshots.append({"id": boundary.id, "state": states[boundary.version]})
+                if not moved:
+                    continue
+
+                if segment is None:
+                    segment = _Segment(directory)
+                entries: List[dict] = []
+                block: List[List[dict]] = []
+                lines: List[bytes] = []
+                size = 0
+                for rows in moved:
+                    block.append(rows)
+                    for r in rows:
+                        lines.append(json.dumps(r, separators=(",", ":")).encode() + b"\n")
+                        size += len(lines[-1])
+                    if size >= block_bytes:
+                        entries += segment.write(block, b"".join(lines))
+                        block, lines, size = [], [], 0
+                if block:
+                    entries += segment.write(block, b"".join(lines))
+                segment.sync()
+
+                HistoryArchiveRepository(db).add(entries)
+                history.make_snapshots(snapshots)
+                expected = sum(len(rows) for rows in moved)
+                if history.delete_ids([r["id"] for rows in moved for r in rows]) != expected:
+                    # another compaction got there first: leave this batch to it
+                    db.rollback()
+                    continue
+                db.commit()
+                products += len(moved)
+                archived += expected
+    finally:
+        if segment is not None:
+            segment.close()
+    return CompactionStats(products, archived, segment.name if segment else None, segment.size if segment else 0, time.perf_counter() - start)
+
+# --- reading ---
+
+def _block_rows(entry, archive_dir: Optional[Path] = None) -> List[dict]:
+    """The archived versions of the entry's product in its block, oldest first."""
+    with open(Path(archive_dir or HISTORY_ARCHIVE_DIR) / entry.segment, "rb") as f:
+        f.seek(entry.block_offset)
+        data = gzip.decompress(f.read(entry.block_length))
+    rows = []
+    for line in data.splitlines():
+        row = json.loads(line)
+        if row["product_id"] == entry.product_id:
+            row["changed_at"] = datetime.fromisoformat(row["changed_at"])
+            rows.append(row)
+    return rows
+
+def page(db, product_id: int, limit: int, before_version: Optional[int] = None) -> List[dict]:
+    """Up to `limit` archived versions of a product older than `before_version`, newest first."""
+    found: List[dict] = []
+    for entry in HistoryArchiveRepository(db).before_version(product_id, before_version):
+        rows = [r for r in _block_rows(entry) if before_version is None or r["version"] < before_version]
+        found += reversed(rows)
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+def at(db, product_id: int, moment: datetime) -> Optional[dict]:
+    """The product's last archived version written at or before `moment`."""
+    entry = HistoryArchiveRepository(db).at(product_id, moment)
+    if entry is None:
+        return None
+    rows = [r for r in _block_rows(entry) if r["changed_at"] <= moment]
+    return rows[-1] if rows else None
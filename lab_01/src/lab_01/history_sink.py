@@ -0,0 +1,161 @@
+"""
+Write-behind recorder for product history.
+
+HISTORY_DURABILITY picks where ProductService writes history:
+- "sync" (default): in the same transaction as the product change, so history is
+  never behind or out of order with the products table;
+- "batched": the events are queued in memory after the product change commits and a
+  background thread writes them with multi-row INSERTs, once HISTORY_BATCH_SIZE events
+  are waiting or HISTORY_FLUSH_INTERVAL_MS after the first one arrived. History then lags
+  by up to the interval and events still queued when the process is killed are lost;
+  the app flushes the queue on shutdown (lifespan in main.py).
+
+One queue and one writer per database keep each product's versions in order.
+Version numbers are assigned by the INSERT itself, so the sinks of several worker
+processes (WORKERS > 1) share one sequence per product instead of colliding.
+The queue holds at most HISTORY_QUEUE_MAX events: a request that finds it full
+flushes it itself before queueing (backpressure instead of unbounded memory).
+"""
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import change_feed, metrics
+from .database import database_key, sync_engine
+from .repositories import HistoryEvent, HistoryRepository
+
+HISTORY_DURABILITY = os.getenv("HISTORY_DURABILITY", "sync").lower()
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+HISTORY_FLUSH_INTERVAL_MS = float(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200"))
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "10000"))
+
+QUEUE_DEPTH = metrics.Gauge("history_sink_queue_depth", "History events waiting to be written")
+FLUSH_SECONDS = metrics.Histogram("history_sink_flush_seconds", "Time to write one batch of history events")
+FLUSHED_EVENTS = metrics.Counter("history_sink_flushed_events_total", "History events written by the sink")
+DROPPED_EVENTS = metrics.Counter("history_sink_dropped_events_total", "History events lost because a flush failed")
+BACKPRESSURE = metrics.Counter("history_sink_backpressure_total", "Requests that flushed a full queue themselves")
+
+logger = logging.getLogger(__name__)
+
+def batched() -> bool:
+    return HISTORY_DURABILITY == "batched"
+
+def utcnow() -> datetime:
+    # same representation as the database's CURRENT_TIMESTAMP (naive UTC)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class HistorySink:
+    def __init__(
+        self,
+        engine: Engine,
+        batch_size: int = HISTORY_BATCH_SIZE,
+        flush_interval_ms: float = HISTORY_FLUSH_INTERVAL_MS,
+        max_queue: int = HISTORY_QUEUE_MAX,
+    ):
+        self.engine = engine
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max(self.batch_size, max_queue)
+        self._queue: Deque[HistoryEvent] = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # one writer at a time keeps per-product order
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def full(self) -> bool:
+        """Whether a record() of up to a batch of events would flush on the caller's thread."""
+        return len(self._queue) + self.batch_size > self.max_queue
+
+    def record(self, events: List[HistoryEvent]):
+        if len(self._queue) + len(events) > self.max_queue:
+            BACKPRESSURE.inc()
+            self.flush()
+        with self._cond:
+            self._queue.extend(events)
+            QUEUE_DEPTH.inc(len(events))
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="history-sink", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        if self._closed:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if self._closed:
+                    return
+                self._cond.wait_for(lambda: len(self._queue) >= self.batch_size or self._closed, timeout=self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write everything queued so far (in batches of batch_size)."""
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    return
+                self._write(batch)
+
+    def _write(self, batch: List[HistoryEvent]):
+        start = time.perf_counter()
+        with Session(self.engine) as db:
+            try:
+                HistoryRepository(db).bulk_add(batch)
+                db.commit()
+                change_feed.notify(db)
+                FLUSHED_EVENTS.inc(len(batch))
+            except Exception:
+                db.rollback()
+                DROPPED_EVENTS.inc(len(batch))
+                logger.exception("history flush failed, %d events dropped", len(batch))
+        QUEUE_DEPTH.dec(len(batch))
+        FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+_sinks: Dict[str, HistorySink] = {}
+_sinks_lock = threading.Lock()
+
+def for_session(db) -> HistorySink:
+    key = database_key(db)
+    sink = _sinks.get(key)
+    if sink is None:
+        with _sinks_lock:
+            sink = _sinks.get(key)
+            if sink is None:
+                sink = _sinks[key] = HistorySink(sync_engine(db), HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL_MS, HISTORY_QUEUE_MAX)
+    return sink
+
+def record(db, events: List[HistoryEvent]):
+    """Called by ProductService after the product change committed."""
+    if events:
+        for_session(db).record(events)
+
+def flush_all():
+    for sink in list(_sinks.values()):
+        sink.flush()
+
+def shutdown():
+    """Flush and stop every sink (app shutdown)."""
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
@@ -0,0 +1,162 @@
+"""
+Streaming product import from CSV or NDJSON, the counterpart of exports.py.
+
+Records are parsed one line at a time and handed to ProductService.import_products in
+chunks of IMPORT_CHUNK_SIZE. Each chunk is validated with the create_product rules, then
+inserted and committed on its own. Memory therefore depends on the chunk size, not on the
+file size, and an interrupted import keeps the chunks it has committed. A rejected line is
+reported with its line number and the error detail the API would return for it. Columns
+other than name, category, price and quantity are ignored, so an export can be imported
+into another database.
+
+Command line (`poetry run import`):
+    import products.csv [--format csv|ndjson] [--chunk-size 1000] [--errors errors.ndjson] [--database-url sqlite:///...]
+"""
+from typing import AsyncIterator, BinaryIO, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import argparse
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+
+from fastapi import HTTPException
+
+from . import fast_json, metrics
+from .database import DATABASE_URL, Base, create_db_engine, session_factory
+from .services import ProductService
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# an upload is kept in memory up to this size, then spooled to a temporary file
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(1024 * 1024)))
+
+IMPORTED = metrics.Counter("import_products_total", "Products created by imports")
+REJECTED = metrics.Counter("import_rejected_lines_total", "Import lines rejected by validation")
+
+class ImportProgress(NamedTuple):
+    records: int                  # records read so far
+    imported: int
+    failed: int
+    errors: List[Tuple[int, dict]]  # (line number, error) of the last chunk
+    seconds: float
+
+def parse_csv(lines: Iterable[str]) -> Iterator[Tuple[int, Optional[dict], Optional[dict]]]:
+    """(line number, fields, None) per record, (line number, None, error) for a line that cannot be read."""
+    reader = csv.DictReader(lines)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.line_num, None, {"line": str(e)}
+            continue
+        row.pop(None, None)  # values past the header
+        yield reader.line_num, row, None
+
+def parse_ndjson(lines: Iterable[str]) -> Iterator[Tuple[int, Optional[dict], Optional[dict]]]:
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+        except ValueError as e:
+            yield number, None, {"line": f"Invalid JSON: {e}"}
+            continue
+        if not isinstance(fields, dict):
+            yield number, None, {"line": "Expected a JSON object"}
+            continue
+        yield number, fields, None
+
+PARSERS = {"csv": parse_csv, "ndjson": parse_ndjson}
+
+def run(svc: ProductService, fmt: str, lines: Iterable[str], chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[ImportProgress]:
+    """Import the records of `lines` through `svc` (a ProductService); progress after every chunk."""
+    start = time.perf_counter()
+    records = imported = failed = 0
+    chunk: List[Tuple[int, dict]] = []
+    errors: List[Tuple[int, dict]] = []
+
+    def flush() -> ImportProgress:
+        nonlocal imported, failed
+        try:
+            created, rejected = svc.import_products(chunk) if chunk else (0, [])
+        except HTTPException as e:
+            created, rejected = 0, [(line, e.detail) for line, _ in chunk]
+        rejected = sorted(errors + rejected, key=lambda e: e[0])
+        imported += created
+        failed += len(rejected)
+        IMPORTED.inc(created)
+        REJECTED.inc(len(rejected))
+        chunk.clear()
+        errors.clear()
+        return ImportProgress(records, imported, failed, rejected, time.perf_counter() - start)
+
+    for line, fields, error in PARSERS[fmt](lines):
+        records += 1
+        if error is not None:
+            errors.append((line, error))
+        else:
+            chunk.append((line, fields))
+        if len(chunk) + len(errors) >= chunk_size:
+            yield flush()
+    if chunk or errors or not records:
+        yield flush()
+
+def text_lines(upload: BinaryIO) -> io.TextIOWrapper:
+    # undecodable bytes end up in a field, which then fails validation on its line
+    return io.TextIOWrapper(upload, encoding="utf-8-sig", errors="replace", newline="")
+
+async def spool(chunks: AsyncIterator[bytes]) -> BinaryIO:
+    """Receive an upload into a temporary file (in memory up to IMPORT_SPOOL_BYTES)."""
+    upload = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    async for chunk in chunks:
+        upload.write(chunk)
+    upload.seek(0)
+    return upload
+
+def report(svc: ProductService, fmt: str, upload: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+    """
+    NDJSON body of the import endpoint, written while the import runs: the rejected lines of
+    each chunk ({"event": "error", ...}), then its progress, and a final "done" event.
+    """
+    try:
+        progress = None
+        for progress in run(svc, fmt, text_lines(upload), chunk_size):
+            yield b"".join(fast_json.dumps({"event": "error", "line": line, "error": error}) + b"\n" for line, error in progress.errors)
+            yield fast_json.dumps({"event": "progress", **_counts(progress)}) + b"\n"
+        yield fast_json.dumps({"event": "done", **_counts(progress)}) + b"\n"
+    finally:
+        upload.close()
+
+def _counts(progress: ImportProgress) -> dict:
+    return {"records": progress.records, "imported": progress.imported, "failed": progress.failed, "seconds": round(progress.seconds, 3)}
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Import products from a CSV or NDJSON file.")
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=sorted(PARSERS), help="default: from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--errors", help="write rejected lines here (NDJSON: line, error)")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    args = parser.parse_args(argv)
+    fmt = args.format or ("csv" if args.file.lower().endswith(".csv") else "ndjson")
+
+    engine = create_db_engine(args.database_url)
+    Base.metadata.create_all(engine)
+    Session = session_factory(engine)
+    errors_file = open(args.errors, "wb") if args.errors else None
+    try:
+        with open(args.file, "rb") as upload, Session() as db:
+            for progress in run(ProductService(db), fmt, text_lines(upload), max(1, args.chunk_size)):
+                if errors_file is not None:
+                    errors_file.writelines(fast_json.dumps({"line": line, "error": error}) + b"\n" for line, error in progress.errors)
+                print(f"{progress.records} records: {progress.imported} imported, {progress.failed} rejected ({progress.seconds:.1f} s)", flush=True)
+    finally:
+        if errors_file is not None:
+            errors_file.close()
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Per-request profiling: route latency, SQL statements and named spans.
+
+RequestMetricsMiddleware opens a RequestProfile for every HTTP request. SQL timing
+(database.instrument_engine) and span() blocks inside the services add to the profile
+of the request they run for: it lives in a context variable, which FastAPI carries into
+the threadpool (sync routes) and run_sync (async routes). When the response is sent, the
+totals go to the process-wide histograms in metrics.py (served at /metrics), and requests
+slower than SLOW_REQUEST_MS are logged with their SQL and span breakdown.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import time
+
+from . import metrics
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_QUERIES = 20  # statements kept per request for the slow-request log
+
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 1000)
+
+REQUEST_SECONDS = metrics.Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"])
+REQUEST_SQL_STATEMENTS = metrics.Histogram("http_request_sql_statements", "SQL statements per HTTP request", ["method", "route"], buckets=COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = metrics.Histogram("http_request_sql_seconds", "Time spent in SQL per HTTP request", ["method", "route"])
+SQL_SECONDS = metrics.Histogram("sql_statement_duration_seconds", "Latency of single SQL statements")
+SPAN_SECONDS = metrics.Histogram("app_span_duration_seconds", "Latency of named spans inside the services", ["span"])
+SLOW_REQUESTS = metrics.Counter("http_slow_requests_total", "Requests slower than SLOW_REQUEST_MS", ["method", "route"])
+
+logger = logging.getLogger(__name__)
+
+class RequestProfile:
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.queries: List[Tuple[float, str]] = []
+        self.spans: Dict[str, float] = {}
+
+    def add_statement(self, statement: str, seconds: float):
+        self.statements += 1
+        self.sql_seconds += seconds
+        if len(self.queries) < SLOW_REQUEST_QUERIES:
+            self.queries.append((seconds, " ".join(statement.split())[:200]))
+
+_profile: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+def current() -> Optional[RequestProfile]:
+    return _profile.get()
+
+def sql_executed(statement: str, seconds: float):
+    """Called by the engine hooks in database.py for every statement."""
+    SQL_SECONDS.observe(seconds)
+    profile = _profile.get()
+    if profile is not None:
+        profile.add_statement(statement, seconds)
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.observe(elapsed, span=name)
+        profile = _profile.get()
+        if profile is not None:
+            profile.spans[name] = profile.spans.get(name, 0.0) + elapsed
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are measured until their last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        status = [500]
+        event_stream = [False]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                event_stream[0] = any(k == b"content-type" and v.startswith(b"text/event-stream") for k, v in message["headers"])
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _profile.reset(token)
+            # route template, not the raw path, keeps the label set bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            REQUEST_SECONDS.observe(elapsed, method=method, route=route, status=str(status[0]))
+            REQUEST_SQL_STATEMENTS.observe(profile.statements, method=method, route=route)
+            REQUEST_SQL_SECONDS.observe(profile.sql_seconds, method=method, route=route)
+            # change feed streams stay open by design: not slow requests
+            if elapsed * 1000 >= SLOW_REQUEST_MS and not event_stream[0]:
+                SLOW_REQUESTS.inc(method=method, route=route)
+                _log_slow(method, scope.get("path", route), status[0], elapsed, profile)
+
+def _log_slow(method: str, path: str, status: int, elapsed: float, profile: RequestProfile):
+    spans = ", ".join(f"{name}={s * 1000:.1f}ms" for name, s in sorted(profile.spans.items(), key=lambda kv: -kv[1]))
+    queries = "".join(f"\n  {s * 1000:8.2f} ms  {sql}" for s, sql in sorted(profile.queries, reverse=True))
+    logger.warning(
+        "slow request %s %s -> %d in %.1f ms: %d SQL statements, %.1f ms in SQL; spans: %s%s",
+        method, path, status, elapsed * 1000, profile.statements, profile.sql_seconds * 1000, spans or "-", queries,
+    )
@@ -1,24 +1,78 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import os
+from fastapi import FastAPI, APIRouter, Response
+from fastapi.routing import APIRoute
 import uvicorn
 
+from . import cache_sync, change_feed, database, history_sink, metrics
+from .instrumentation import RequestMetricsMiddleware
 from .routers import products, forbidden
 from .seeds import initialize_db_and_seed
 
-app = FastAPI(title="Lab 01 - Products API")
+def _use_async_routes(app: FastAPI, *routers: APIRouter):
+    """Swap sync routes for their async twins in place (route order decides matching)."""
+    twins = {}
+    for router in routers:
+        for route in router.routes:
+            for method in route.methods:
+                twins[(route.path, method)] = route
+    for i, route in enumerate(app.router.routes):
+        if isinstance(route, APIRoute):
+            twin = twins.get((route.path, next(iter(route.methods))))
+            if twin is not None:
+                app.router.routes[i] = twin
 
-app.include_router(products.router)
-app.include_router(forbidden.router)
+def create_app(seed: bool = True) -> FastAPI:
+    """
+    The application. Nothing touches the database until it starts: with `seed`, the lifespan
+    creates the schema and seeds an empty database (unless run_prod already did). Tests build
+    theirs with seed=False and point get_db/get_read_db at their own sessions.
+    """
 
-@app.on_event("startup")
-async def on_startup():
-    # initialize DB and seed WHEN file DB doesn't yet exist
-    initialize_db_and_seed()
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if seed and os.getenv("DB_INITIALIZED") != "1":
+            initialize_db_and_seed()
+        yield
+        # write out history still queued by HISTORY_DURABILITY=batched
+        history_sink.shutdown()
+        change_feed.shutdown()
+
+    app = FastAPI(title="Lab 01 - Products API", lifespan=lifespan)
+    # route latency, SQL statements and service spans per request, see instrumentation.py
+    app.add_middleware(RequestMetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    app.include_router(products.router)
+    app.include_router(forbidden.router)
+
+    if database.DB_MODE == "async":
+        from .routers import products_async, forbidden_async
+        _use_async_routes(app, products_async.router, forbidden_async.router)
+    return app
+
+app = create_app()
 
 def run_dev() -> None:
     uvicorn.run("lab_01.main:app", host="127.0.0.1", port=8000, reload=True, log_level="debug")
 
 def run_prod() -> None:
-    uvicorn.run("lab_01.main:app", host="0.0.0.0", port=8000, reload=False, log_level="info")
+    """
+    WORKERS uvicorn worker processes (default 1) sharing port 8000. Schema changes and seeding
+    run once here, before any worker starts; the engines are disposed afterwards, so no
+    connection is inherited and each worker opens its own pool. Workers are fresh
+    interpreters (spawned, not forked): WORKERS and DB_INITIALIZED reach them through the
+    environment, and cache_sync keeps their caches consistent.
+    """
+    initialize_db_and_seed()
+    database.engine.dispose()
+    database.read_engine.dispose()
+    os.environ["DB_INITIALIZED"] = "1"
+    os.environ["WORKERS"] = str(cache_sync.WORKERS)
+    uvicorn.run("lab_01.main:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")), reload=False, log_level="info", workers=cache_sync.WORKERS)
 
 if __name__ == "__main__":
     run_dev()
@@ -0,0 +1,52 @@
+"""
+Maintenance commands (`poetry run maintenance <command>`):
+    rebuild-stats    recompute category_stats from the products table
+    compact-history  move history versions past the retention policy to the archive
+                     (--older-than-days N and/or --keep-versions N, default HISTORY_RETENTION_DAYS /
+                     HISTORY_RETENTION_VERSIONS; see history_archive.py)
+"""
+from typing import List, Optional
+import argparse
+import os
+
+from sqlalchemy.orm import Session
+
+from . import history_archive
+from .database import DATABASE_URL, Base, create_db_engine
+from .repositories import StatsRepository
+
+def _env_number(name: str, kind):
+    value = os.getenv(name)
+    return kind(value) if value else None
+
+def rebuild_stats(engine):
+    with Session(engine) as db:
+        StatsRepository(db).rebuild()
+        db.commit()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Maintenance commands.")
+    parser.add_argument("command", choices=["rebuild-stats", "compact-history"])
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--older-than-days", type=float, default=_env_number("HISTORY_RETENTION_DAYS", float))
+    parser.add_argument("--keep-versions", type=int, default=_env_number("HISTORY_RETENTION_VERSIONS", int))
+    parser.add_argument("--archive-dir", default=str(history_archive.HISTORY_ARCHIVE_DIR))
+    parser.add_argument("--batch-products", type=int, default=history_archive.ARCHIVE_BATCH_PRODUCTS)
+    args = parser.parse_args(argv)
+    if args.command == "compact-history" and args.older_than_days is None and args.keep_versions is None:
+        parser.error("compact-history needs --older-than-days and/or --keep-versions")
+
+    engine = create_db_engine(args.database_url)
+    Base.metadata.create_all(engine)
+    if args.command == "rebuild-stats":
+        rebuild_stats(engine)
+        print("category_stats rebuilt")
+    elif args.command == "compact-history":
+        policy = history_archive.RetentionPolicy.of(args.older_than_days, args.keep_versions)
+        stats = history_archive.compact(engine, policy, args.archive_dir, max(1, args.batch_products))
+        print(f"archived {stats.archived} history rows of {stats.products} products"
+              f" to {stats.segment or '-'} ({stats.bytes} bytes) in {stats.seconds:.1f} s")
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Index, Boolean, UniqueConstraint, event, text
+from sqlalchemy.sql import column, func, table
 from sqlalchemy.types import JSON
 
 from .database import Base
@@ -13,20 +12,86 @@ class Product(Base):
     category = Column(String(50), nullable=False)
     price = Column(Float, nullable=False)
     quantity = Column(Integer, nullable=False, default=0)
+    # optimistic concurrency: bumped by every write, which only applies if the row still has
+    # the version it was read at (the ORM adds "AND version = :old" to its UPDATEs; the Core
+    # writes in ProductRepository do the same by hand). Equals the product's last history version.
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
 
-    histories = relationship("ProductHistory", back_populates="product", cascade="all, delete-orphan")
+    # keyset pagination: every (filter, sort) combination of the list endpoint walks one of these
+    # (the unique index on name serves sort=name without a category filter)
+    __table_args__ = (
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_category_id", "category", "id"),
+        Index("ix_products_category_name", "category", "name"),
+        Index("ix_products_category_price_id", "category", "price", "id"),
+        # case-insensitive prefix search (/search), with and without the category filter
+        Index("ix_products_name_lower_id", func.lower(name), id),
+        Index("ix_products_category_name_lower_id", category, func.lower(name), id),
+        # ids are never reused: a deleted product's history stays under its id
+        {"sqlite_autoincrement": True},
+    )
+
+    # set by ProductService (version + 1), so a write without changed columns still gets a version
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
 
 
 class ProductHistory(Base):
     __tablename__ = "product_histories"
 
     id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    # no foreign key: the history of a deleted product is kept, ending with its 'delete' version
+    product_id = Column(Integer, nullable=False)
     changed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
-    operation = Column(String(20), nullable=False)  # 'create', 'update', 'delete'
-    snapshot = Column(Text, nullable=False)  # JSON string snapshot
+    operation = Column(String(20), nullable=False)  # 'create', 'update', 'adjust', 'delete'
+    version = Column(Integer, nullable=False)  # per product, 1 = create
+    is_snapshot = Column(Boolean, nullable=False, default=False)
+    # compact JSON: the full product state if is_snapshot, otherwise only the fields that changed
+    data = Column(Text, nullable=False)
+
+    # history export walks changed_at ranges in order; the history endpoints walk one product's
+    # versions (unique index) or look up its state at a point in time (product_id, changed_at)
+    __table_args__ = (
+        Index("ix_product_histories_changed_at", "changed_at"),
+        Index("ix_product_histories_product_changed_at", "product_id", "changed_at"),
+        UniqueConstraint("product_id", "version", name="uq_product_histories_product_version"),
+    )
+
+
+
+class HistoryArchiveEntry(Base):
+    """
+    Index of the history archive (history_archive.py): one row per product and gzip block of
+    a segment file, with the range of versions and changed_at the block holds for the product.
+    """
+    __tablename__ = "history_archive"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    segment = Column(String(100), nullable=False)  # file name in HISTORY_ARCHIVE_DIR
+    block_offset = Column(Integer, nullable=False)
+    block_length = Column(Integer, nullable=False)
+    first_version = Column(Integer, nullable=False)
+    last_version = Column(Integer, nullable=False)
+    first_changed_at = Column(DateTime(timezone=True), nullable=False)
+    last_changed_at = Column(DateTime(timezone=True), nullable=False)
+
+    # history pages walk a product's versions backwards, as-of looks up a point in time
+    __table_args__ = (
+        Index("ix_history_archive_product_version", "product_id", "last_version"),
+        Index("ix_history_archive_product_changed_at", "product_id", "first_changed_at"),
+    )
+
+class CategoryStats(Base):
+    """Per-category inventory aggregates, kept up to date by ProductService on every write."""
+    __tablename__ = "category_stats"
 
-    product = relationship("Product", back_populates="histories")
+    category = Column(String(50), primary_key=True)
+    product_count = Column(Integer, nullable=False, default=0)
+    total_quantity = Column(Integer, nullable=False, default=0)
+    stock_value = Column(Float, nullable=False, default=0.0)  # sum(price * quantity)
+    price_sum = Column(Float, nullable=False, default=0.0)  # for the average price
+    min_price = Column(Float, nullable=True)
+    max_price = Column(Float, nullable=True)
 
 
 class ForbiddenPhrase(Base):
@@ -34,3 +99,32 @@ class ForbiddenPhrase(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     phrase = Column(String(200), unique=True, nullable=False, index=True)
+
+
+class CacheGeneration(Base):
+    """Write counters of the in-process caches, bumped with every change (see cache_sync.py)."""
+    __tablename__ = "cache_generations"
+
+    name = Column(String(50), primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+
+# Substring search over product names: SQLite FTS5 table with the trigram tokenizer
+# (case-insensitive, matches any substring of 3+ characters). rowid is the product id.
+# Not an ORM model: ProductService keeps it in sync (SearchRepository), bulk_seed fills it.
+products_fts = table("products_fts", column("rowid"), column("name"))
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_products_fts(target, connection, **kw):
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")).first()
+    if exists is None:
+        connection.execute(text("CREATE VIRTUAL TABLE products_fts USING fts5(name, tokenize='trigram')"))
+        # databases created before the search index existed
+        connection.execute(text("INSERT INTO products_fts (rowid, name) SELECT id, name FROM products"))
+
+@event.listens_for(Base.metadata, "before_drop")
+def _drop_products_fts(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("DROP TABLE IF EXISTS products_fts"))
@@ -1,10 +1,56 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select, delete
-from typing import Optional, List
+from sqlalchemy import select, delete, insert, update, tuple_, func, case, bindparam, literal, literal_column
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Result, Row
+from datetime import datetime
+from typing import Optional, List, Any, Tuple, Dict, Iterable, Iterator, NamedTuple
 import json
+import os
 
 from . import models
 
+# Repositories never commit: the service owning the request decides when the
+# unit of work ends (one commit per request). flush() sends pending INSERT/UPDATEs
+# and fills generated primary keys without a refresh round trip.
+
+# Product history is stored as versions: every HISTORY_SNAPSHOT_EVERY-th version (starting
+# with the create) keeps the full state, the ones in between only the fields that changed.
+# Reading any version replays at most that many rows.
+HISTORY_SNAPSHOT_EVERY = max(1, int(os.getenv("HISTORY_SNAPSHOT_EVERY", "10")))
+
+# columns of the product rows returned by list_page (same keys as schemas.ProductOut)
+PRODUCT_FIELDS = ("id", "name", "category", "price", "quantity", "version")
+
+# ids per stock-adjustment UPDATE (5 bound parameters each, under SQLite's 32766 limit)
+ADJUST_CHUNK_SIZE = 2000
+
+def _compact(obj: dict) -> str:
+    # a product's version is the history row's own version column, not part of the data
+    return json.dumps({k: v for k, v in obj.items() if k != "version"}, separators=(",", ":"), default=str)
+
+class HistoryEvent(NamedTuple):
+    product_id: int
+    operation: str
+    before: Optional[dict]  # state before the change, None on create
+    state: dict
+    changed_at: Optional[datetime] = None  # None: database time of the INSERT
+
+def _delta(before: Optional[dict], after: dict) -> dict:
+    if before is None:
+        return after
+    return {k: v for k, v in after.items() if before.get(k) != v}
+
+def replay(rows: Iterable[Tuple[int, bool, str]]) -> Dict[int, dict]:
+    """(version, is_snapshot, data) rows oldest first, starting with a full snapshot; maps version -> full state."""
+    states: Dict[int, dict] = {}
+    state: dict = {}
+    loads = json.loads
+    for version, is_snapshot, data in rows:
+        change = loads(data)
+        state = change if is_snapshot else {**state, **change}
+        states[version] = state
+    return states
+
 class ProductRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -20,21 +66,175 @@ class ProductRepository:
         stmt = select(models.Product)
         return self.db.execute(stmt).scalars().all()
 
+    def list_page(
+        self,
+        limit: int,
+        sort: str = "id",
+        descending: bool = False,
+        after: Optional[Tuple[Any, int]] = None,
+        category: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_quantity: Optional[int] = None,
+        max_quantity: Optional[int] = None,
+    ) -> List[Row]:
+        """
+        Keyset page ordered by (sort, id), as plain PRODUCT_FIELDS rows.
+        `after` is the (sort value, id) of the last row of the previous page, so the query
+        seeks in the index instead of skipping rows.
+        """
+        P = models.Product
+        stmt = select(*[getattr(P, f) for f in PRODUCT_FIELDS])
+        if category is not None:
+            stmt = stmt.where(P.category == category)
+        if min_price is not None:
+            stmt = stmt.where(P.price >= min_price)
+        if max_price is not None:
+            stmt = stmt.where(P.price <= max_price)
+        if min_quantity is not None:
+            stmt = stmt.where(P.quantity >= min_quantity)
+        if max_quantity is not None:
+            stmt = stmt.where(P.quantity <= max_quantity)
+
+        if sort == "id":
+            keys = [P.id]
+        else:
+            keys = [getattr(P, sort), P.id]
+
+        if after is not None:
+            value, last_id = after
+            if sort == "id":
+                key, bound = P.id, last_id
+            else:
+                key, bound = tuple_(*keys), tuple_(value, last_id)
+            stmt = stmt.where(key < bound if descending else key > bound)
+
+        stmt = stmt.order_by(*[k.desc() if descending else k.asc() for k in keys]).limit(limit)
+        return self.db.execute(stmt).all()
+
+    def stream_rows(self, category: Optional[str] = None, batch_size: int = 1000) -> Result:
+        """Plain column rows fetched `batch_size` at a time (no ORM objects, no full materialization)."""
+        P = models.Product
+        stmt = select(P.id, P.name, P.category, P.price, P.quantity).order_by(P.id)
+        if category is not None:
+            stmt = stmt.where(P.category == category)
+        return self.db.execute(stmt.execution_options(yield_per=batch_size))
+
     def create(self, product: models.Product) -> models.Product:
         self.db.add(product)
-        self.db.commit()
-        self.db.refresh(product)
+        self.db.flush()
         return product
 
     def update(self, product: models.Product) -> models.Product:
         self.db.add(product)
-        self.db.commit()
-        self.db.refresh(product)
+        self.db.flush()
         return product
 
-    def delete(self, product: models.Product):
-        self.db.delete(product)
-        self.db.commit()
+    def delete(self, product_id: int, version: Optional[int] = None) -> Optional[dict]:
+        """
+        Delete a product (only if it is at `version`, when given); returns its last state
+        (PRODUCT_FIELDS), None if no row matched.
+        """
+        P = models.Product
+        stmt = delete(P).where(P.id == product_id)
+        if version is not None:
+            stmt = stmt.where(P.version == version)
+        row = self.db.execute(stmt.returning(*[getattr(P, f) for f in PRODUCT_FIELDS])).first()
+        return dict(row._mapping) if row is not None else None
+
+    # --- bulk helpers ---
+
+    def rows_by_ids(self, ids: Iterable[int]) -> Dict[int, dict]:
+        P = models.Product
+        stmt = select(*[getattr(P, f) for f in PRODUCT_FIELDS]).where(P.id.in_(set(ids)))
+        return {row.id: dict(row._mapping) for row in self.db.execute(stmt)}
+
+    def existing_ids(self, ids: Iterable[int]) -> set:
+        P = models.Product
+        return set(self.db.execute(select(P.id).where(P.id.in_(set(ids)))).scalars())
+
+    def ids_by_names(self, names: Iterable[str]) -> Dict[str, int]:
+        P = models.Product
+        stmt = select(P.name, P.id).where(P.name.in_(set(names)))
+        return {name: pid for name, pid in self.db.execute(stmt)}
+
+    def existing_names(self, names: Iterable[str]) -> set:
+        """
+        Which of `names` products have. One query for any number of names: they are passed as a
+        single JSON array expanded by json_each, not as one bound parameter each (SQLite allows 32766).
+        """
+        P = models.Product
+        # sorted, so the lookups walk the name index in order
+        values = func.json_each(json.dumps(sorted(set(names)))).table_valued("value")
+        stmt = select(P.name).where(P.name.in_(select(values.c.value)))
+        return set(self.db.execute(stmt).scalars())
+
+    def bulk_insert(self, rows: List[dict]) -> List[int]:
+        """Multi-row INSERT ... RETURNING; ids come back in the order of `rows`."""
+        if not rows:
+            return []
+        P = models.Product
+        # RETURNING order of a multi-row VALUES is not guaranteed (asking SQLAlchemy to sort it
+        # degrades to one INSERT per row), so match the generated ids back by the unique name
+        stmt = insert(P).returning(P.name, P.id)
+        ids = dict(self.db.execute(stmt, [{k: v for k, v in row.items() if k != "id"} for row in rows]).all())
+        return [ids[row["name"]] for row in rows]
+
+    def bulk_update(self, rows: List[dict], read_versions: Dict[int, int], park: Iterable[int] = ()) -> bool:
+        """
+        Write `rows` (new version included) by id in one executemany, each only if the product
+        is still at its version from `read_versions`. False if any row had changed meanwhile.
+        The products in `park` first get a placeholder name (no valid name has a NUL): their
+        current names are taken over by other rows, which the unique index would reject partway
+        through the executemany (swaps, or chains written in the wrong order).
+        """
+        if not rows:
+            return True
+        T = models.Product.__table__
+        park = list(park)
+        if park:
+            stmt = update(T).where(T.c.id == bindparam("pid"), T.c.version == bindparam("read_version")).values(name=bindparam("parked"))
+            params = [{"pid": pid, "read_version": read_versions[pid], "parked": f"\0{pid}"} for pid in park]
+            if self.db.execute(stmt, params).rowcount != len(park):
+                return False
+        stmt = update(T).where(T.c.id == bindparam("pid"), T.c.version == bindparam("read_version"))
+        params = [{**{k: v for k, v in row.items() if k != "id"}, "pid": row["id"], "read_version": read_versions[row["id"]]} for row in rows]
+        return self.db.execute(stmt, params).rowcount == len(rows)
+
+    def bulk_delete(self, ids: List[int], read_versions: Dict[int, int]) -> bool:
+        """Delete by id, each only if still at its version from `read_versions`; False if any had changed."""
+        if not ids:
+            return True
+        P = models.Product
+        stmt = delete(P).where(tuple_(P.id, P.version).in_([(pid, read_versions[pid]) for pid in ids]))
+        return self.db.execute(stmt).rowcount == len(ids)
+
+    def adjust_quantities(self, deltas: Dict[int, int]) -> List[Row]:
+        """
+        quantity += delta for every id with a conditional UPDATE ... RETURNING (one per
+        ADJUST_CHUNK_SIZE ids): the check and the write are a single statement, so concurrent
+        adjustments cannot lose each other's updates. Rows whose quantity would go below 0 (and unknown ids) are left
+        alone and missing from the result (PRODUCT_FIELDS rows, new values).
+        """
+        P = models.Product
+        items = list(deltas.items())
+        rows: List[Row] = []
+        for start in range(0, len(items), ADJUST_CHUNK_SIZE):
+            chunk = dict(items[start:start + ADJUST_CHUNK_SIZE])
+            if len(chunk) == 1:
+                (pid, d), = chunk.items()
+                delta, match = literal(d), P.id == pid
+            else:
+                # SQLite has no UPDATE ... FROM (VALUES ...) AS d(id, delta): per-row delta by CASE
+                delta, match = case(chunk, value=P.id), P.id.in_(chunk)
+            stmt = (
+                update(P)
+                .where(match, P.quantity + delta >= 0)
+                .values(quantity=P.quantity + delta, version=P.version + 1)
+                .returning(*[getattr(P, f) for f in PRODUCT_FIELDS])
+            )
+            rows.extend(self.db.execute(stmt).all())
+        return rows
 
 class ForbiddenRepository:
     def __init__(self, db: Session):
@@ -51,27 +251,348 @@ class ForbiddenRepository:
     def create(self, phrase: str) -> models.ForbiddenPhrase:
         obj = models.ForbiddenPhrase(phrase=phrase)
         self.db.add(obj)
-        self.db.commit()
-        self.db.refresh(obj)
+        self.db.flush()
         return obj
 
     def delete_by_id(self, phrase_id: int):
         stmt = delete(models.ForbiddenPhrase).where(models.ForbiddenPhrase.id == phrase_id)
         self.db.execute(stmt)
-        self.db.commit()
+
+class GenerationRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def all(self) -> Dict[str, int]:
+        G = models.CacheGeneration
+        return dict(self.db.execute(select(G.name, G.generation)).all())
+
+    def bump(self, name: str) -> int:
+        """Increment (or create) the counter in the current transaction; returns the new value."""
+        G = models.CacheGeneration
+        stmt = sqlite_insert(G).values(name=name, generation=1)
+        stmt = stmt.on_conflict_do_update(index_elements=[G.name], set_={G.generation: G.generation + 1})
+        return self.db.execute(stmt.returning(G.generation)).scalar_one()
 
 class HistoryRepository:
     def __init__(self, db: Session):
         self.db = db
 
-    def add_history(self, product_id: int, operation: str, snapshot_obj: dict) -> models.ProductHistory:
-        snapshot_json = json.dumps(snapshot_obj, default=str)
-        hist = models.ProductHistory(product_id=product_id, operation=operation, snapshot=snapshot_json)
-        self.db.add(hist)
-        self.db.commit()
-        self.db.refresh(hist)
-        return hist
+    def add_history(self, product_id: int, operation: str, state: dict, before: Optional[dict] = None):
+        """Append the next version of a product; `before` is its state before the change (None on create)."""
+        H = models.ProductHistory
+        # version number, snapshot flag and payload are all decided inside the single INSERT
+        version = select(func.coalesce(func.max(H.version), 0) + 1).where(H.product_id == product_id).scalar_subquery()
+        on_snapshot = (version - 1) % HISTORY_SNAPSHOT_EVERY == 0
+        self.db.execute(insert(H).values(
+            product_id=product_id,
+            operation=operation,
+            version=version,
+            is_snapshot=on_snapshot,
+            data=case((on_snapshot, _compact(state)), else_=_compact(_delta(before, state))),
+        ))
+
+    def bulk_add(self, entries: List[HistoryEvent]):
+        """Append versions in one executemany, in list order (changed_at set on all entries or on none)."""
+        if not entries:
+            return
+        H = models.ProductHistory
+        # as in add_history the version is computed by each INSERT (under the write lock), so
+        # sinks of several worker processes never hand out the same version of a product
+        version = select(func.coalesce(func.max(H.version), 0) + 1).where(H.product_id == bindparam("pid")).scalar_subquery()
+        on_snapshot = (version - 1) % HISTORY_SNAPSHOT_EVERY == 0
+        values = dict(
+            product_id=bindparam("pid"),
+            operation=bindparam("op"),
+            version=version,
+            is_snapshot=on_snapshot,
+            data=case((on_snapshot, bindparam("state")), else_=bindparam("delta")),
+        )
+        if entries[0].changed_at is not None:
+            values["changed_at"] = bindparam("at")
+        rows = []
+        for e in entries:
+            state = _compact(e.state)
+            row = {"pid": e.product_id, "op": e.operation, "state": state,
+                   "delta": state if e.before is None else _compact(_delta(e.before, e.state))}
+            if e.changed_at is not None:
+                row["at"] = e.changed_at
+            rows.append(row)
+        self.db.execute(insert(H).values(**values), rows)
+
+    def page(self, product_id: int, limit: int, before_version: Optional[int] = None) -> List[Row]:
+        """
+        (id, product_id, changed_at, operation, version) rows, newest version first,
+        optionally only those older than `before_version`.
+        """
+        H = models.ProductHistory
+        stmt = select(H.id, H.product_id, H.changed_at, H.operation, H.version).where(H.product_id == product_id)
+        if before_version is not None:
+            stmt = stmt.where(H.version < before_version)
+        return self.db.execute(stmt.order_by(H.version.desc()).limit(limit)).all()
+
+    def at(self, product_id: int, moment: datetime) -> Optional[models.ProductHistory]:
+        """The product's last version written at or before `moment`."""
+        H = models.ProductHistory
+        stmt = (
+            select(H)
+            .where(H.product_id == product_id, H.changed_at <= moment)
+            .order_by(H.changed_at.desc(), H.version.desc())
+            .limit(1)
+        )
+        return self.db.execute(stmt).scalars().first()
+
+    def replay_rows(self, product_id: int, low: int, high: int) -> List[Row]:
+        """(version, is_snapshot, data) up to `high`, oldest first, starting at the last full snapshot at or before `low`."""
+        H = models.ProductHistory
+        base = (
+            select(func.max(H.version))
+            .where(H.product_id == product_id, H.is_snapshot, H.version <= low)
+            .scalar_subquery()
+        )
+        stmt = (
+            select(H.version, H.is_snapshot, H.data)
+            .where(H.product_id == product_id, H.version >= base, H.version <= high)
+            .order_by(H.version)
+        )
+        return self.db.execute(stmt).all()
 
-    def list_for_product(self, product_id: int):
-        stmt = select(models.ProductHistory).where(models.ProductHistory.product_id == product_id).order_by(models.ProductHistory.changed_at.desc())
+    def last_id(self) -> int:
+        return self.db.execute(select(func.max(models.ProductHistory.id))).scalar() or 0
+
+    def changes(self, after_id: int, limit: int, upto_id: Optional[int] = None) -> List[dict]:
+        """
+        History rows with after_id < id <= upto_id in id (commit) order, each with the full
+        product state of its version. Snapshot rows carry the state; products with delta rows
+        in the page get one replay query each.
+        """
+        H = models.ProductHistory
+        stmt = select(H.id, H.product_id, H.changed_at, H.operation, H.version, H.is_snapshot, H.data).where(H.id > after_id)
+        if upto_id is not None:
+            stmt = stmt.where(H.id <= upto_id)
+        rows = self.db.execute(stmt.order_by(H.id).limit(limit)).all()
+        spans: Dict[int, Tuple[int, int]] = {}  # product_id -> (lowest, highest) delta version in the page
+        for row in rows:
+            if not row.is_snapshot:
+                low, high = spans.get(row.product_id, (row.version, row.version))
+                spans[row.product_id] = (min(low, row.version), max(high, row.version))
+        states = {pid: replay(self.replay_rows(pid, low, high)) for pid, (low, high) in spans.items()}
+        return [
+            {
+                "id": row.id, "product_id": row.product_id, "changed_at": row.changed_at, "operation": row.operation,
+                "version": row.version,
+                "product": {**(json.loads(row.data) if row.is_snapshot else states[row.product_id][row.version]), "version": row.version},
+            }
+            for row in rows
+        ]
+
+    # --- retention (history_archive.compact) ---
+
+    def product_ids_after(self, after: int, limit: int) -> List[int]:
+        H = models.ProductHistory
+        stmt = select(H.product_id).where(H.product_id > after).group_by(H.product_id).order_by(H.product_id).limit(limit)
         return self.db.execute(stmt).scalars().all()
+
+    def rows_of_products(self, low: int, high: int) -> List[Row]:
+        """Every version of the products low..high, by product and version."""
+        H = models.ProductHistory
+        stmt = (
+            select(H.id, H.product_id, H.changed_at, H.operation, H.version, H.is_snapshot, H.data)
+            .where(H.product_id.between(low, high))
+            .order_by(H.product_id, H.version)
+        )
+        return self.db.execute(stmt).all()
+
+    def make_snapshots(self, rows: List[dict]):
+        """Store the full state in the given (id, state) rows, so replays can start there."""
+        if rows:
+            H = models.ProductHistory.__table__
+            self.db.execute(
+                update(H).where(H.c.id == bindparam("hid")).values(is_snapshot=True, data=bindparam("state")),
+                [{"hid": r["id"], "state": _compact(r["state"])} for r in rows],
+            )
+
+    def delete_ids(self, ids: List[int]) -> int:
+        """Delete history rows by id (in chunks under SQLite's parameter limit); returns how many were deleted."""
+        H = models.ProductHistory
+        deleted = 0
+        for i in range(0, len(ids), ADJUST_CHUNK_SIZE):
+            deleted += self.db.execute(delete(H).where(H.id.in_(ids[i:i + ADJUST_CHUNK_SIZE]))).rowcount
+        return deleted
+
+    def stream_rows(
+        self,
+        product_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        batch_size: int = 1000,
+    ) -> Result:
+        H = models.ProductHistory
+        stmt = (
+            select(H.id, H.product_id, H.changed_at, H.operation, H.version, H.is_snapshot, H.data)
+            .order_by(H.changed_at, H.id)
+        )
+        if product_id is not None:
+            stmt = stmt.where(H.product_id == product_id)
+        if since is not None:
+            stmt = stmt.where(H.changed_at >= since)
+        if until is not None:
+            stmt = stmt.where(H.changed_at < until)
+        return self.db.execute(stmt.execution_options(yield_per=batch_size))
+
+def _stats_key(row: Optional[dict]):
+    return (row["category"], row["price"], row["quantity"]) if row else None
+
+def stats_deltas(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]) -> List[dict]:
+    """
+    Per-category changes of the CategoryStats sums for (row before, row after) pairs of
+    products (None before a create / after a delete). min/max_price hold the lowest and
+    highest price added, which is all a category without a stats row can have.
+    """
+    deltas: Dict[str, dict] = {}
+    for before, after in changes:
+        if _stats_key(before) == _stats_key(after):
+            continue
+        for row, sign in ((before, -1), (after, 1)):
+            if row is None:
+                continue
+            d = deltas.get(row["category"])
+            if d is None:
+                d = deltas[row["category"]] = {
+                    "category": row["category"], "product_count": 0, "total_quantity": 0,
+                    "stock_value": 0.0, "price_sum": 0.0, "min_price": None, "max_price": None,
+                }
+            d["product_count"] += sign
+            d["total_quantity"] += sign * row["quantity"]
+            d["stock_value"] += sign * row["price"] * row["quantity"]
+            d["price_sum"] += sign * row["price"]
+            if sign > 0:
+                d["min_price"] = row["price"] if d["min_price"] is None else min(d["min_price"], row["price"])
+                d["max_price"] = row["price"] if d["max_price"] is None else max(d["max_price"], row["price"])
+    return list(deltas.values())
+
+class StatsRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def all(self) -> List[models.CategoryStats]:
+        return self.db.execute(select(models.CategoryStats)).scalars().all()
+
+    def apply(self, deltas: List[dict]):
+        """
+        Add stats_deltas() to the aggregates in one upsert. Call after the product rows are
+        written: min/max of an existing category are read again through the (category,
+        price) index, since a deleted or repriced product may have been the extreme.
+        """
+        if not deltas:
+            return
+        S, P = models.CategoryStats, models.Product
+        stmt = sqlite_insert(S)
+        new = stmt.excluded
+        # spelled out: SQLAlchemy would add `excluded` to the subquery's FROM instead of correlating it
+        extreme = lambda agg: select(agg(P.price)).where(P.category == literal_column("excluded.category")).scalar_subquery()
+        self.db.execute(stmt.on_conflict_do_update(index_elements=[S.category], set_={
+            S.product_count: S.product_count + new.product_count,
+            S.total_quantity: S.total_quantity + new.total_quantity,
+            S.stock_value: S.stock_value + new.stock_value,
+            S.price_sum: S.price_sum + new.price_sum,
+            S.min_price: extreme(func.min),
+            S.max_price: extreme(func.max),
+        }), deltas)
+
+    def rebuild(self):
+        """Recompute every category from the products table (repair)."""
+        S, P = models.CategoryStats, models.Product
+        self.db.execute(delete(S))
+        self.db.execute(insert(S).from_select(
+            [S.category, S.product_count, S.total_quantity, S.stock_value, S.price_sum, S.min_price, S.max_price],
+            select(
+                P.category, func.count(), func.sum(P.quantity), func.sum(P.price * P.quantity),
+                func.sum(P.price), func.min(P.price), func.max(P.price),
+            ).group_by(P.category),
+        ))
+
+class HistoryArchiveRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add(self, entries: List[dict]):
+        if entries:
+            self.db.execute(insert(models.HistoryArchiveEntry), entries)
+
+    def before_version(self, product_id: int, version: Optional[int]) -> Iterator[models.HistoryArchiveEntry]:
+        """Blocks holding versions of the product older than `version` (all if None), newest first."""
+        A = models.HistoryArchiveEntry
+        stmt = select(A).where(A.product_id == product_id)
+        if version is not None:
+            stmt = stmt.where(A.first_version < version)
+        return iter(self.db.execute(stmt.order_by(A.last_version.desc())).scalars().all())
+
+    def at(self, product_id: int, moment: datetime) -> Optional[models.HistoryArchiveEntry]:
+        """The block with the product's last archived version written at or before `moment`."""
+        A = models.HistoryArchiveEntry
+        stmt = (
+            select(A)
+            .where(A.product_id == product_id, A.first_changed_at <= moment)
+            .order_by(A.first_changed_at.desc(), A.last_version.desc())
+            .limit(1)
+        )
+        return self.db.execute(stmt).scalars().first()
+
+class SearchRepository:
+    """Product name search: case-insensitive prefix ranges on lower(name), substrings in products_fts."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add(self, rows: Iterable[Tuple[int, str]]):
+        """(id, name) of created products."""
+        rows = [{"rowid": pid, "name": name} for pid, name in rows]
+        if rows:
+            self.db.execute(insert(models.products_fts), rows)
+
+    def rename(self, rows: Iterable[Tuple[int, str]]):
+        """(id, new name) of renamed products."""
+        rows = [{"pid": pid, "new_name": name} for pid, name in rows]
+        if rows:
+            F = models.products_fts
+            self.db.execute(update(F).where(F.c.rowid == bindparam("pid")).values(name=bindparam("new_name")), rows)
+
+    def remove(self, ids: Iterable[int]):
+        ids = list(ids)
+        if ids:
+            F = models.products_fts
+            self.db.execute(delete(F).where(F.c.rowid.in_(ids)))
+
+    def prefix_page(
+        self, prefix: str, limit: int, category: Optional[str] = None, after: Optional[Tuple[str, int]] = None,
+    ) -> List[Row]:
+        """Names starting with `prefix` (lowercase, letters and digits), ordered by (lower(name), id)."""
+        P = models.Product
+        lower = func.lower(P.name)
+        # [prefix, prefix with its last character bumped) is exactly the set of strings starting with prefix
+        stmt = select(*[getattr(P, f) for f in PRODUCT_FIELDS]).where(
+            lower >= prefix, lower < prefix[:-1] + chr(ord(prefix[-1]) + 1),
+        )
+        if category is not None:
+            stmt = stmt.where(P.category == category)
+        if after is not None:
+            stmt = stmt.where(tuple_(lower, P.id) > tuple_(*after))
+        return self.db.execute(stmt.order_by(lower, P.id).limit(limit)).all()
+
+    def substring_page(
+        self, query: str, limit: int, category: Optional[str] = None, after_id: Optional[int] = None,
+    ) -> List[Row]:
+        """Names containing `query` (3+ characters) but not starting with it, ordered by id."""
+        P, F = models.Product, models.products_fts
+        stmt = (
+            select(*[getattr(P, f) for f in PRODUCT_FIELDS])
+            .select_from(F)
+            .join(P, P.id == F.c.rowid)
+            # FTS5 phrase: the trigram tokenizer matches it anywhere in the name
+            .where(F.c.name.match('"%s"' % query.replace('"', '""')), P.name.not_like(query + "%"))
+        )
+        if category is not None:
+            stmt = stmt.where(P.category == category)
+        if after_id is not None:
+            stmt = stmt.where(F.c.rowid > after_id)
+        return self.db.execute(stmt.order_by(F.c.rowid).limit(limit)).all()
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Hashable, Iterable, NamedTuple, Optional
+import hashlib
+import os
+import threading
+import time
+
+from fastapi import HTTPException, Request, Response
+
+from . import cache_sync
+from .database import database_key, reads_from_primary
+
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30"))
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "10000"))
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: Optional[float]  # time of the last write before the load; None if unknown
+    headers: Dict[str, str]
+    version: int
+    expires: float
+
+class ResponseCache:
+    """
+    In-process LRU/TTL cache of serialized product responses for one database.
+
+    `version` is the collection version: ProductService bumps it on every write, which
+    retires all cached lists at once. Single products are dropped by id on write.
+    A response loaded while a write was in flight is not stored (put() checks the
+    version seen before the load), so the cache never keeps pre-write data.
+    Writes by other workers clear it through cache_sync; the TTL bounds staleness from
+    any other writer. `changed_at` is the time of the last write seen (or of the start): the
+    Last-Modified of everything loaded after it.
+    """
+
+    def __init__(self, max_entries: int = PRODUCT_CACHE_SIZE, ttl: float = PRODUCT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 0
+        self.changed_at = time.time()
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, collection: bool = False) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic() or (collection and entry.version != self.version):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, body: bytes, version: int, headers: Optional[Dict[str, str]] = None, etag: Optional[str] = None) -> CachedResponse:
+        with self._lock:
+            current = version == self.version
+            entry = CachedResponse(
+                body=body,
+                etag=etag or '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest(),
+                # loaded across a write: which side of it the data is from is not known
+                last_modified=self.changed_at if current else None,
+                headers=headers or {},
+                version=version,
+                expires=time.monotonic() + self.ttl,
+            )
+            if current and self.max_entries > 0:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def products_changed(self, product_ids: Iterable[int]):
+        with self._lock:
+            self.version += 1
+            self.changed_at = time.time()
+            for pid in product_ids:
+                self._entries.pop(("product", pid), None)
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self.changed_at = time.time()
+            self._entries.clear()
+
+
+_caches: Dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+def for_session(db) -> ResponseCache:
+    cache_sync.check(db)
+    key = database_key(db)
+    cache = _caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(key, ResponseCache())
+    return cache
+
+# get() always misses and put() stores nothing
+_uncached = ResponseCache(max_entries=0)
+
+def for_request(request: Request, db) -> ResponseCache:
+    """
+    The cache for a GET route. A client reading from the primary after its own write (the
+    read_primary cookie) bypasses it: entries may have been filled from a lagging replica.
+    """
+    if reads_from_primary(request):
+        return _uncached
+    return for_session(db)
+
+def products_changed(db, product_ids: Iterable[int]):
+    """Called by ProductService after each committed write."""
+    for_session(db).products_changed(product_ids)
+
+def _changed_elsewhere(key: str):
+    cache = _caches.get(key)
+    if cache is not None:
+        cache.clear()
+
+cache_sync.on_invalidate("products", _changed_elsewhere)
+
+def reset():
+    with _caches_lock:
+        _caches.clear()
+
+def list_key(request: Request, kind: str = "list") -> Any:
+    return (kind, tuple(sorted(request.query_params.multi_items())))
+
+def product_etag(version: int) -> str:
+    """ETag of a single product: its version, so the value can be sent back in If-Match."""
+    return f'"{version}"'
+
+def parse_if_match(header: Optional[str]) -> Optional[int]:
+    """
+    The product version an If-Match header asks for; None without the header or for "*"
+    (any current representation). A tag that is not one of our product ETags can never
+    match: 412.
+    """
+    if header is None or header.strip() == "*":
+        return None
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    if len(tags) == 1:
+        tag = tags.pop()
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            return int(tag[1:-1])
+    raise HTTPException(status_code=412, detail={"version": "If-Match must be a single product ETag"})
+
+def _last_modified(entry: CachedResponse) -> Optional[int]:
+    """
+    The entry's Last-Modified in whole seconds: the second after its last write, and only once
+    that second has begun. Earlier, another write in the same second would get the same date
+    and a client's If-Modified-Since would still match it.
+    """
+    if entry.last_modified is None:
+        return None
+    second = int(entry.last_modified) + 1
+    return second if time.time() >= second else None
+
+def _not_modified(request: Request, entry: CachedResponse) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or entry.etag in tags or f"W/{entry.etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    last_modified = _last_modified(entry)
+    if if_modified_since and last_modified is not None:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def respond(request: Request, entry: CachedResponse) -> Response:
+    """200 with the cached body, or 304 if the client's validators still match."""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", **entry.headers}
+    last_modified = _last_modified(entry)
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Response, status
 from typing import List
 from sqlalchemy.orm import Session
 
@@ -6,11 +6,15 @@ from .. import schemas, services, database
 
 router = APIRouter(prefix="/api/v1/forbidden", tags=["forbidden"])
 
-def get_service(db: Session = Depends(database.get_db)):
+def get_service(response: Response, db: Session = Depends(database.get_db)):
+    database.written(response)
+    return services.ForbiddenService(db)
+
+def get_read_service(db: Session = Depends(database.get_read_db)):
     return services.ForbiddenService(db)
 
 @router.get("/", response_model=List[schemas.ForbiddenPhraseOut])
-def list_phrases(svc: services.ForbiddenService = Depends(get_service)):
+def list_phrases(svc: services.ForbiddenService = Depends(get_read_service)):
     return svc.list_phrases()
 
 @router.post("/", response_model=schemas.ForbiddenPhraseOut, status_code=status.HTTP_201_CREATED)
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, Response, status
+from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas, async_services, database
+
+# async twins of the routes in forbidden.py, used when DB_MODE=async
+router = APIRouter(prefix="/api/v1/forbidden", tags=["forbidden"])
+
+def get_service(response: Response, db: AsyncSession = Depends(database.get_async_db)):
+    database.written(response)
+    return async_services.AsyncForbiddenService(db)
+
+def get_read_service(db: AsyncSession = Depends(database.get_async_read_db)):
+    return async_services.AsyncForbiddenService(db)
+
+@router.get("/", response_model=List[schemas.ForbiddenPhraseOut])
+async def list_phrases(svc: async_services.AsyncForbiddenService = Depends(get_read_service)):
+    return await svc.list_phrases()
+
+@router.post("/", response_model=schemas.ForbiddenPhraseOut, status_code=status.HTTP_201_CREATED)
+async def create_phrase(payload: schemas.ForbiddenPhraseCreate, svc: async_services.AsyncForbiddenService = Depends(get_service)):
+    return await svc.create_phrase(payload.phrase)
+
+@router.delete("/{phrase_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_phrase(phrase_id: int, svc: async_services.AsyncForbiddenService = Depends(get_service)):
+    await svc.delete_phrase(phrase_id)
+    return None
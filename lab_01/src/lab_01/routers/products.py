@@ -1,35 +1,226 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, Header, status, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from datetime import datetime
+from typing import List, Optional
 from sqlalchemy.orm import Session
 
-from .. import schemas, services, database, models
+from .. import schemas, services, database, models, exports, imports, response_cache, fast_json, repositories, change_feed
+from ..instrumentation import span
 
 router = APIRouter(prefix="/api/v1/products", tags=["products"])
 
-def get_service(db: Session = Depends(database.get_db)):
+# writes use the primary (and mark the client for read-your-writes), GET routes the read engine
+def get_service(response: Response, db: Session = Depends(database.get_db)):
+    database.written(response)
+    return services.ProductService(db)
+
+def get_read_service(db: Session = Depends(database.get_read_db)):
     return services.ProductService(db)
 
 @router.post("/", response_model=schemas.ProductOut, status_code=status.HTTP_201_CREATED)
 def create_product(payload: schemas.ProductCreate, svc: services.ProductService = Depends(get_service)):
     return svc.create_product(payload)
 
+def list_filters(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page."),
+    sort: schemas.ProductSort = schemas.ProductSort.id,
+    order: schemas.SortOrder = schemas.SortOrder.asc,
+    category: Optional[schemas.Category] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_quantity: Optional[int] = Query(None, ge=0),
+    max_quantity: Optional[int] = Query(None, ge=0),
+) -> dict:
+    return dict(
+        limit=limit, cursor=cursor, sort=sort, order=order, category=category,
+        min_price=min_price, max_price=max_price, min_quantity=min_quantity, max_quantity=max_quantity,
+    )
+
+@span("serialize")
+def product_json(product) -> bytes:
+    return schemas.ProductOut.model_validate(product).model_dump_json().encode()
+
+# list and history pages skip per-row model validation: column rows go straight to
+# JSON (fast_json); response_model stays on the routes for the OpenAPI schema
+
+@span("serialize")
+def product_list_json(rows) -> bytes:
+    return fast_json.rows(repositories.PRODUCT_FIELDS, rows)
+
+@span("serialize")
+def history_response(items: List[dict], next_cursor: Optional[int]) -> Response:
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+    return Response(fast_json.dumps(items), media_type="application/json", headers=headers)
+
+@span("serialize")
+def name_check_response(names: List[str], errors: List[Optional[dict]]) -> Response:
+    rejected = [{"index": i, "name": names[i], "error": error} for i, error in enumerate(errors) if error is not None]
+    body = {
+        "checked": len(names), "accepted": len(names) - len(rejected), "rejected": len(rejected),
+        "valid": [error is None for error in errors], "errors": rejected,
+    }
+    return Response(fast_json.dumps(body), media_type="application/json")
+
+# GET responses are served from response_cache (ETag / Last-Modified, 304 on If-None-Match)
+
 @router.get("/", response_model=List[schemas.ProductOut])
-def list_products(svc: services.ProductService = Depends(get_service)):
-    return svc.list_products()
+def list_products(request: Request, filters: dict = Depends(list_filters), svc: services.ProductService = Depends(get_read_service)):
+    cache = response_cache.for_request(request, svc.db)
+    key = response_cache.list_key(request)
+    entry = cache.get(key, collection=True)
+    if entry is None:
+        version = cache.version
+        items, next_cursor = svc.list_products(**filters)
+        entry = cache.put(key, product_list_json(items), version, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+    return response_cache.respond(request, entry)
+
+# /stats and /search must be registered before /{product_id}
+@router.get("/stats", response_model=List[schemas.CategoryStatsOut])
+def get_category_stats(svc: services.ProductService = Depends(get_read_service)):
+    return svc.get_category_stats()
+
+def search_params(
+    q: str = Query(..., min_length=1, max_length=20, pattern=r"^[A-Za-z0-9]+$", description="Name prefix or substring (case-insensitive)."),
+    mode: schemas.SearchMode = schemas.SearchMode.substring,
+    category: Optional[schemas.Category] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Value of X-Next-Cursor from the previous page."),
+) -> dict:
+    return dict(q=q, mode=mode, category=category, limit=limit, cursor=cursor)
+
+@router.get("/search", response_model=List[schemas.ProductOut])
+def search_products(request: Request, params: dict = Depends(search_params), svc: services.ProductService = Depends(get_read_service)):
+    cache = response_cache.for_request(request, svc.db)
+    key = response_cache.list_key(request, "search")
+    entry = cache.get(key, collection=True)
+    if entry is None:
+        version = cache.version
+        items, next_cursor = svc.search_products(**params)
+        entry = cache.put(key, product_list_json(items), version, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+    return response_cache.respond(request, entry)
+
+@router.post("/batch", response_model=schemas.ProductBatchResult)
+def apply_batch(payload: schemas.ProductBatchRequest, svc: services.ProductService = Depends(get_service)):
+    return svc.apply_batch(payload.operations, payload.mode)
+
+# dry run of create_product for candidate names: nothing is written, so the read engine serves it
+@router.post("/validate-names", response_model=schemas.NameCheckResult)
+def validate_names(payload: schemas.NameCheckRequest, svc: services.ProductService = Depends(get_read_service)):
+    return name_check_response(payload.names, svc.validate_names(payload.names, payload.categories, payload.prices))
+
+# the upload is the raw request body (text/csv or application/x-ndjson), received into a
+# temporary file first; the response streams the rejected lines and progress per chunk
+@router.post("/import", response_class=StreamingResponse)
+async def import_products(
+    request: Request,
+    format: schemas.ExportFormat = schemas.ExportFormat.ndjson,
+    chunk_size: int = Query(imports.IMPORT_CHUNK_SIZE, ge=1, le=10000, description="Lines validated and committed together."),
+    svc: services.ProductService = Depends(get_service),
+):
+    upload = await imports.spool(request.stream())
+    response = StreamingResponse(imports.report(svc, format.value, upload, chunk_size), media_type="application/x-ndjson")
+    database.written(response)
+    return response
+
+# /stock must be registered before /{product_id}
+@router.patch("/stock", response_model=schemas.StockBatchResult)
+def adjust_stock_batch(payload: schemas.StockBatchRequest, svc: services.ProductService = Depends(get_service)):
+    return svc.adjust_stock_batch(payload.adjustments, payload.mode)
+
+# /changes must be registered before /{product_id}; a plain (sync) route in both DB modes:
+# the stream itself reads from change_feed's buffer, the dependency only picks the database
+@router.get("/changes", response_class=StreamingResponse)
+def stream_changes(
+    cursor: Optional[int] = Query(None, ge=0, description="History id of the last event received (0 = from the beginning); default: only new events."),
+    limit: Optional[int] = Query(None, ge=1, description="Close the stream after this many events."),
+    last_event_id: Optional[int] = Header(None, ge=0, description="Sent by EventSource on reconnect; takes precedence over cursor."),
+    db: Session = Depends(database.get_read_db),
+):
+    feed = change_feed.for_session(db)
+    feed.start()
+    if last_event_id is not None:
+        cursor = last_event_id
+    return StreamingResponse(
+        change_feed.stream(feed, feed.head if cursor is None else cursor, limit),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _export_response(fmt: schemas.ExportFormat, name: str, chunks):
+    return StreamingResponse(
+        chunks,
+        media_type=exports.MEDIA_TYPES[fmt.value],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt.value}"'},
+    )
+
+# export routes must be registered before /{product_id}
+@router.get("/export", response_class=StreamingResponse)
+def export_products(
+    format: schemas.ExportFormat = schemas.ExportFormat.ndjson,
+    category: Optional[schemas.Category] = None,
+    svc: services.ProductService = Depends(get_read_service),
+):
+    return _export_response(format, "products", exports.stream(format.value, svc.export_products(category)))
+
+@router.get("/history/export", response_class=StreamingResponse)
+def export_history(
+    format: schemas.ExportFormat = schemas.ExportFormat.ndjson,
+    product_id: Optional[int] = None,
+    since: Optional[datetime] = Query(None, description="changed_at >= since"),
+    until: Optional[datetime] = Query(None, description="changed_at < until"),
+    mode: schemas.HistoryExportMode = Query(schemas.HistoryExportMode.snapshot, description="snapshot: full state of every version; delta: rows as stored"),
+    svc: services.ProductService = Depends(get_read_service),
+):
+    fields, batches = svc.export_history(product_id, since, until, mode)
+    return _export_response(format, "product_histories", exports.encode(format.value, fields, batches))
 
 @router.get("/{product_id}", response_model=schemas.ProductOut)
-def get_product(product_id: int, svc: services.ProductService = Depends(get_service)):
-    return svc.get_product(product_id)
+def get_product(product_id: int, request: Request, svc: services.ProductService = Depends(get_read_service)):
+    cache = response_cache.for_request(request, svc.db)
+    entry = cache.get(("product", product_id))
+    if entry is None:
+        version = cache.version
+        product = svc.get_product(product_id)
+        entry = cache.put(("product", product_id), product_json(product), version, etag=response_cache.product_etag(product.version))
+    return response_cache.respond(request, entry)
+
+# optimistic concurrency: If-Match with the product's ETag (412 on mismatch) or its version in the
+# body / query string (409); either way the write itself is a compare-and-swap on the version
+
+def if_match(if_match: Optional[str] = Header(None, description='ETag of the product (its version, e.g. "3").')) -> Optional[int]:
+    return response_cache.parse_if_match(if_match)
 
 @router.put("/{product_id}", response_model=schemas.ProductOut)
-def update_product(product_id: int, payload: schemas.ProductUpdate, svc: services.ProductService = Depends(get_service)):
-    return svc.update_product(product_id, payload)
+def update_product(product_id: int, payload: schemas.ProductUpdate, response: Response, expected: Optional[int] = Depends(if_match), svc: services.ProductService = Depends(get_service)):
+    product = svc.update_product(product_id, payload, expected)
+    response.headers["ETag"] = response_cache.product_etag(product.version)
+    return product
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product(product_id: int, svc: services.ProductService = Depends(get_service)):
-    svc.delete_product(product_id)
+def delete_product(
+    product_id: int,
+    version: Optional[int] = Query(None, description="Delete only if the product is at this version (409 otherwise)."),
+    expected: Optional[int] = Depends(if_match),
+    svc: services.ProductService = Depends(get_service),
+):
+    svc.delete_product(product_id, version, expected)
     return None
 
+@router.patch("/{product_id}/stock", response_model=schemas.ProductOut)
+def adjust_stock(product_id: int, payload: schemas.StockAdjustment, svc: services.ProductService = Depends(get_service)):
+    return svc.adjust_stock(product_id, payload.delta)
+
+def history_page(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = Query(None, ge=1, description="Value of X-Next-Cursor from the previous page."),
+) -> dict:
+    return dict(limit=limit, cursor=cursor)
+
 @router.get("/{product_id}/history", response_model=List[schemas.ProductHistoryOut])
-def get_history(product_id: int, svc: services.ProductService = Depends(get_service)):
-    return svc.get_history(product_id)
+def get_history(product_id: int, page: dict = Depends(history_page), svc: services.ProductService = Depends(get_read_service)):
+    return history_response(*svc.get_history(product_id, **page))
+
+@router.get("/{product_id}/history/as-of", response_model=schemas.ProductAsOfOut)
+def get_product_as_of(product_id: int, at: datetime = Query(..., description="Point in time (ISO 8601); naive values are UTC."), svc: services.ProductService = Depends(get_read_service)):
+    return svc.get_product_as_of(product_id, at)
@@ -0,0 +1,88 @@
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import schemas, async_services, database, response_cache
+from .products import list_filters, search_params, history_page, history_response, product_json, product_list_json, if_match
+
+# async twins of the CRUD routes in products.py, used when DB_MODE=async
+router = APIRouter(prefix="/api/v1/products", tags=["products"])
+
+def get_service(response: Response, db: AsyncSession = Depends(database.get_async_db)):
+    database.written(response)
+    return async_services.AsyncProductService(db)
+
+def get_read_service(db: AsyncSession = Depends(database.get_async_read_db)):
+    return async_services.AsyncProductService(db)
+
+@router.post("/", response_model=schemas.ProductOut, status_code=status.HTTP_201_CREATED)
+async def create_product(payload: schemas.ProductCreate, svc: async_services.AsyncProductService = Depends(get_service)):
+    return await svc.create_product(payload)
+
+@router.get("/", response_model=List[schemas.ProductOut])
+async def list_products(request: Request, filters: dict = Depends(list_filters), svc: async_services.AsyncProductService = Depends(get_read_service)):
+    await async_services.off_loop(svc.db)  # cache_sync read
+    cache = response_cache.for_request(request, svc.db)
+    key = response_cache.list_key(request)
+    entry = cache.get(key, collection=True)
+    if entry is None:
+        version = cache.version
+        items, next_cursor = await svc.list_products(**filters)
+        entry = cache.put(key, product_list_json(items), version, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+    return response_cache.respond(request, entry)
+
+@router.get("/stats", response_model=List[schemas.CategoryStatsOut])
+async def get_category_stats(svc: async_services.AsyncProductService = Depends(get_read_service)):
+    return await svc.get_category_stats()
+
+@router.get("/search", response_model=List[schemas.ProductOut])
+async def search_products(request: Request, params: dict = Depends(search_params), svc: async_services.AsyncProductService = Depends(get_read_service)):
+    await async_services.off_loop(svc.db)  # cache_sync read
+    cache = response_cache.for_request(request, svc.db)
+    key = response_cache.list_key(request, "search")
+    entry = cache.get(key, collection=True)
+    if entry is None:
+        version = cache.version
+        items, next_cursor = await svc.search_products(**params)
+        entry = cache.put(key, product_list_json(items), version, {"X-Next-Cursor": next_cursor} if next_cursor else None)
+    return response_cache.respond(request, entry)
+
+@router.get("/{product_id}", response_model=schemas.ProductOut)
+async def get_product(product_id: int, request: Request, svc: async_services.AsyncProductService = Depends(get_read_service)):
+    await async_services.off_loop(svc.db)  # cache_sync read
+    cache = response_cache.for_request(request, svc.db)
+    entry = cache.get(("product", product_id))
+    if entry is None:
+        version = cache.version
+        product = await svc.get_product(product_id)
+        entry = cache.put(("product", product_id), product_json(product), version, etag=response_cache.product_etag(product.version))
+    return response_cache.respond(request, entry)
+
+@router.put("/{product_id}", response_model=schemas.ProductOut)
+async def update_product(product_id: int, payload: schemas.ProductUpdate, response: Response, expected: Optional[int] = Depends(if_match), svc: async_services.AsyncProductService = Depends(get_service)):
+    product = await svc.update_product(product_id, payload, expected)
+    response.headers["ETag"] = response_cache.product_etag(product.version)
+    return product
+
+@router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_product(
+    product_id: int,
+    version: Optional[int] = Query(None, description="Delete only if the product is at this version (409 otherwise)."),
+    expected: Optional[int] = Depends(if_match),
+    svc: async_services.AsyncProductService = Depends(get_service),
+):
+    await svc.delete_product(product_id, version, expected)
+    return None
+
+@router.patch("/{product_id}/stock", response_model=schemas.ProductOut)
+async def adjust_stock(product_id: int, payload: schemas.StockAdjustment, svc: async_services.AsyncProductService = Depends(get_service)):
+    return await svc.adjust_stock(product_id, payload.delta)
+
+@router.get("/{product_id}/history", response_model=List[schemas.ProductHistoryOut])
+async def get_history(product_id: int, page: dict = Depends(history_page), svc: async_services.AsyncProductService = Depends(get_read_service)):
+    return history_response(*await svc.get_history(product_id, **page))
+
+@router.get("/{product_id}/history/as-of", response_model=schemas.ProductAsOfOut)
+async def get_product_as_of(product_id: int, at: datetime = Query(..., description="Point in time (ISO 8601); naive values are UTC."), svc: async_services.AsyncProductService = Depends(get_read_service)):
+    return await svc.get_product_as_of(product_id, at)
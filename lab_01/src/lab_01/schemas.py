@@ -1,6 +1,6 @@
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
-from pydantic import BaseModel, Field, field_validator, constr
+from pydantic import BaseModel, Field, field_validator, model_validator, constr
 from enum import Enum
 
 class Category(Enum):
@@ -8,6 +8,27 @@ class Category(Enum):
     books = "books"
     clothing = "clothing"
 
+class ProductSort(Enum):
+    id = "id"
+    name = "name"
+    price = "price"
+
+class SortOrder(Enum):
+    asc = "asc"
+    desc = "desc"
+
+class SearchMode(Enum):
+    prefix = "prefix"
+    substring = "substring"
+
+class ExportFormat(Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+class HistoryExportMode(Enum):
+    snapshot = "snapshot"  # every version with the full product state
+    delta = "delta"        # rows as stored: version, is_snapshot, data (full state or changed fields)
+
 class ProductCreate(BaseModel):
     name: constr(min_length=3, max_length=20, pattern=r'^[A-Za-z0-9]+$') = Field(..., description="Only letters and digits, 3-20 chars.")
     category: Category
@@ -25,6 +46,7 @@ class ProductUpdate(BaseModel):
     category: Optional[Category]
     price: Optional[float]
     quantity: Optional[int]
+    version: Optional[int] = Field(None, description="Apply only if the product is still at this version (409 otherwise); the If-Match header does the same with 412.")
 
     @field_validator("quantity")
     def quantity_non_negative(cls, v):
@@ -38,9 +60,107 @@ class ProductOut(BaseModel):
     category: Category
     price: float
     quantity: int
+    version: int
 
     model_config = {"from_attributes": True}
 
+class BatchOperation(Enum):
+    create = "create"
+    update = "update"
+    delete = "delete"
+
+class BatchMode(Enum):
+    atomic = "atomic"    # all operations or none
+    partial = "partial"  # apply the valid ones, report the rest
+
+class ProductBatchItem(BaseModel):
+    op: BatchOperation
+    id: Optional[int] = Field(None, description="Required for update and delete.")
+    name: Optional[constr(min_length=3, max_length=20, pattern=r'^[A-Za-z0-9]+$')] = None
+    category: Optional[Category] = None
+    price: Optional[float] = None
+    quantity: Optional[int] = None
+    version: Optional[int] = Field(None, description="Update and delete: apply only if the product is at this version.")
+
+    @field_validator("quantity")
+    def quantity_non_negative(cls, v):
+        if v is not None and v < 0:
+            raise ValueError("quantity must be >= 0")
+        return v
+
+class ProductBatchRequest(BaseModel):
+    mode: BatchMode = BatchMode.atomic
+    operations: List[ProductBatchItem] = Field(..., min_length=1, max_length=10000)
+
+class ProductBatchItemResult(BaseModel):
+    index: int
+    op: BatchOperation
+    status: int
+    product: Optional[ProductOut] = None
+    error: Optional[Dict[str, Any]] = None
+
+class ProductBatchResult(BaseModel):
+    mode: BatchMode
+    applied: int
+    failed: int
+    results: List[ProductBatchItemResult]
+
+class NameCheckRequest(BaseModel):
+    # columns, not one object per item: 100k plain strings validate ~10x faster than 100k models.
+    # Malformed names and unknown categories are verdicts of their items, not a 422 for the request.
+    names: List[str] = Field(..., min_length=1, max_length=100000)
+    categories: Optional[List[Optional[str]]] = Field(None, description="Per name (same length); with prices, check each price against its category's range.")
+    prices: Optional[List[Optional[float]]] = Field(None, description="Per name (same length).")
+
+    @model_validator(mode="after")
+    def columns_match_names(self):
+        for column in ("categories", "prices"):
+            values = getattr(self, column)
+            if values is not None and len(values) != len(self.names):
+                raise ValueError(f"{column} must have one value per name")
+        return self
+
+class NameCheckError(BaseModel):
+    index: int
+    name: str
+    error: Dict[str, Any]
+
+class NameCheckResult(BaseModel):
+    checked: int
+    accepted: int
+    rejected: int
+    valid: List[bool] = Field(..., description="Verdict of each name, in request order.")
+    errors: List[NameCheckError] = Field(..., description="Why the rejected names would fail create_product.")
+
+class StockAdjustment(BaseModel):
+    delta: int = Field(..., description="Signed change of quantity; the result may not go below 0.")
+
+    @field_validator("delta")
+    def delta_non_zero(cls, v):
+        if v == 0:
+            raise ValueError("delta must not be 0")
+        return v
+
+class StockAdjustmentItem(StockAdjustment):
+    id: int
+
+class StockBatchRequest(BaseModel):
+    mode: BatchMode = BatchMode.atomic
+    adjustments: List[StockAdjustmentItem] = Field(..., min_length=1, max_length=10000)
+
+class StockBatchItemResult(BaseModel):
+    index: int
+    id: int
+    status: int
+    product: Optional[ProductOut] = None
+    error: Optional[Dict[str, Any]] = None
+
+class StockBatchResult(BaseModel):
+    mode: BatchMode
+    applied: int
+    failed: int
+    results: List[StockBatchItemResult]
+
 class ForbiddenPhraseCreate(BaseModel):
     phrase: str = Field(..., min_length=1)
 
@@ -55,6 +175,22 @@ class ProductHistoryOut(BaseModel):
     product_id: int
     changed_at: datetime
     operation: str
+    version: int
     snapshot: str
 
     model_config = {"from_attributes": True}
+
+class CategoryStatsOut(BaseModel):
+    category: Category
+    count: int
+    total_quantity: int
+    stock_value: float = Field(..., description="Sum of price * quantity.")
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    avg_price: Optional[float] = None
+
+class ProductAsOfOut(BaseModel):
+    version: int
+    changed_at: datetime
+    operation: str
+    product: ProductOut
@@ -1,11 +1,13 @@
 from pathlib import Path
 from typing import List
-import traceback
 
-from .database import DEFAULT_DB_PATH, DATABASE_URL, engine, SessionLocal, Base
-from .repositories import ForbiddenRepository
-from .services import ProductService
-from .schemas import ProductCreate, Category
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+
+from . import bulk_seed, models
+from .database import DEFAULT_DB_PATH, DATABASE_URL, engine, Base
+from .repositories import StatsRepository
 
 def _default_forbidden() -> List[str]:
     return [
@@ -35,6 +37,95 @@ def _default_products() -> List[dict]:
         {"name": "Mouse42", "category": "electronics", "price": 45.0 + 10.0, "quantity": 35},  # ensures >= 50 after addition
     ]
 
+class SchemaUpgradeError(RuntimeError):
+    """An existing database has a table layout _add_missing_schema cannot bring up to date."""
+
+def _migrate_snapshot_history(conn: Connection) -> bool:
+    """
+    product_histories from before delta history (one full JSON `snapshot` per row, NOT NULL)
+    rebuilt in the current layout: every old row becomes a snapshot version, numbered per
+    product by changed_at, id. Returns whether there was anything to migrate.
+    """
+    H = models.ProductHistory.__table__
+    columns = {c["name"] for c in inspect(conn).get_columns(H.name)} if inspect(conn).has_table(H.name) else set()
+    if "snapshot" not in columns or "data" in columns:
+        return False
+    conn.execute(text(f"ALTER TABLE {H.name} RENAME TO {H.name}_old"))
+    # the old table's indexes keep their names (ix_product_histories_id) and would clash
+    for name in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t AND sql IS NOT NULL"), {"t": f"{H.name}_old"}).scalars().all():
+        conn.execute(text(f'DROP INDEX "{name}"'))
+    H.create(conn)
+    conn.execute(text(
+        f"INSERT INTO {H.name} (id, product_id, changed_at, operation, version, is_snapshot, data) "
+        f"SELECT id, product_id, changed_at, operation, "
+        f"ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY changed_at, id), 1, json(snapshot) "
+        f"FROM {H.name}_old"
+    ))
+    conn.execute(text(f"DROP TABLE {H.name}_old"))
+    return True
+
+def _column_problems(conn: Connection) -> List[str]:
+    """
+    Columns ALTER TABLE ADD COLUMN cannot fix: a missing NOT NULL column without a server
+    default (SQLite rejects it, and existing rows would have no value), and a leftover
+    NOT NULL column without a default that the models no longer write (every INSERT fails).
+    """
+    problems = []
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue  # created by create_all
+        present = {c["name"]: c for c in inspector.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in present and not col.nullable and col.server_default is None:
+                problems.append(f"{table.name}.{col.name} is missing (NOT NULL, no server default)")
+        for name, col in present.items():
+            if name not in table.columns and not col["nullable"] and col["default"] is None:
+                problems.append(f"{table.name}.{name} is no longer used but is NOT NULL without a default")
+    return problems
+
+def _add_missing_schema(bind: Engine = engine):
+    """
+    Bring a database file from an older version up to date: the known layout changes
+    (_migrate_snapshot_history), then the tables, indexes and columns added since. Only
+    nullable columns and columns with a server default can be added; columns that were
+    dropped or renamed are not handled, and a layout with such changes raises
+    SchemaUpgradeError before anything is altered. The search index and category_stats are
+    filled from the products table.
+    """
+    with bind.begin() as conn:
+        history_migrated = _migrate_snapshot_history(conn)
+    with bind.connect() as conn:
+        problems = _column_problems(conn)
+    if problems:
+        raise SchemaUpgradeError(
+            f"cannot upgrade the database at {bind.url.render_as_string(hide_password=True)}: " + "; ".join(problems)
+            + ". Migrate these columns by hand or recreate the database."
+        )
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        # new columns have a server default (existing rows get it, e.g. products.version = 1) or are nullable
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            present = {c["name"] for c in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in present:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(col).compile(dialect=conn.dialect)}"))
+        if history_migrated:
+            # a product's version is the number of its last history version
+            conn.execute(text(
+                "UPDATE products SET version = (SELECT max(h.version) FROM product_histories h WHERE h.product_id = products.id) "
+                "WHERE EXISTS (SELECT 1 FROM product_histories h WHERE h.product_id = products.id)"
+            ))
+        # by name: reflection skips expression indexes (lower(name))
+        existing = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+        if conn.execute(select(models.CategoryStats.category).limit(1)).first() is None:
+            StatsRepository(conn).rebuild()
+
 def initialize_db_and_seed():
     """
     If DB is file-based and the file doesn't exist yet: create tables and seed initial data.
@@ -54,39 +145,27 @@ def initialize_db_and_seed():
         should_seed = False
 
     if not should_seed:
+        if DATABASE_URL.startswith("sqlite"):
+            _add_missing_schema()
         return
 
     # Create tables
     Base.metadata.create_all(bind=engine)
 
-    db = SessionLocal()
-    try:
-        # --- seed forbidden phrases ---
-        forb_repo = ForbiddenRepository(db)
-        for phrase in _default_forbidden():
-            try:
-                if not forb_repo.get_by_phrase(phrase):
-                    forb_repo.create(phrase)
-            except Exception:
-                print(f"Failed to create forbidden phrase '{phrase}':")
-                traceback.print_exc()
-
-        # --- seed products via service (records will also create history entries) ---
-        svc = ProductService(db)
+    # one transaction, bulk inserts; products are checked with the same rules as the API
+    with engine.begin() as conn:
+        bulk_seed.insert_forbidden(conn, _default_forbidden())
+        matcher = bulk_seed.load_matcher(conn)
+        existing = set(conn.execute(select(models.Product.name)).scalars())
+        next_id = (conn.execute(select(func.max(models.Product.id))).scalar() or 0) + 1
+        rows = []
         for pdata in _default_products():
-            try:
-                # construct schema; ProductService will perform validations
-                # ensure category uses correct enum string
-                payload = ProductCreate(
-                    name=pdata["name"],
-                    category=Category(pdata["category"]),
-                    price=float(pdata["price"]),
-                    quantity=int(pdata["quantity"])
-                )
-                # create product; ignores duplicates due to check inside service
-                svc.create_product(payload)
-            except Exception as e:
-                # print and continue (e.g. if duplicate or validation error)
-                print(f"Skipping product {pdata.get('name')}: {e}")
-    finally:
-        db.close()
+            if pdata["name"] in existing:
+                print(f"Skipping product {pdata['name']}: already exists")
+            elif not bulk_seed.is_valid(pdata, matcher):
+                print(f"Skipping product {pdata['name']}: violates product rules")
+            else:
+                rows.append({"id": next_id, **pdata})
+                next_id += 1
+        bulk_seed.insert_products(conn, rows, history=1)
+        StatsRepository(conn).rebuild()
@@ -1,9 +1,23 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from fastapi import HTTPException
-from typing import List, Dict, Any
+from pydantic import ValidationError
+from sqlalchemy.engine import Result, Row
+from datetime import datetime, timezone
+from typing import Iterator, List, Dict, Any, Optional, Sequence, Tuple
+from collections import Counter, OrderedDict
+import base64
+import binascii
+import json
 import re
 
-from . import repositories, models, schemas
+from . import repositories, models, schemas, cache_sync, forbidden_matcher, exports, response_cache, history_sink, history_archive, change_feed
+from .instrumentation import span
+from .repositories import HistoryEvent, replay
+
+# shortest substring the trigram index can look up; shorter queries match names by prefix only
+SEARCH_SUBSTRING_MIN = 3
 
 PRICE_RULES = {
     "electronics": {"min": 50.0, "max": 50000.0},
@@ -11,33 +25,75 @@ PRICE_RULES = {
     "clothing": {"min": 10.0, "max": 5000.0},
 }
 
+# the name rule of ProductCreate, for checks outside the schema (validate_names)
+NAME_RE = re.compile(r"[A-Za-z0-9]{3,20}")
+
 class ProductService:
     def __init__(self, db: Session):
         self.db = db
         self.repo = repositories.ProductRepository(db)
         self.forbidden_repo = repositories.ForbiddenRepository(db)
         self.history_repo = repositories.HistoryRepository(db)
+        self.search_repo = repositories.SearchRepository(db)
+        self.stats_repo = repositories.StatsRepository(db)
+        self._queued_history: List[HistoryEvent] = []
 
+    @span("check_forbidden")
     def _check_forbidden(self, name: str):
-        phrases = [p.phrase for p in self.forbidden_repo.list_all()]
-        lowered = name.lower()
-        for ph in phrases:
-            if ph.lower() in lowered:
-                raise HTTPException(status_code=400, detail={"name": f"Name contains forbidden phrase '{ph}'"})
+        # process-wide automaton, kept up to date by ForbiddenService
+        ph = forbidden_matcher.get_matcher(self.db).find(name)
+        if ph is not None:
+            raise HTTPException(status_code=400, detail={"name": f"Name contains forbidden phrase '{ph}'"})
 
+    @span("price_rules")
     def _validate_price_for_category(self, category: str, price: float):
         rules = PRICE_RULES.get(category)
         if not rules:
             raise HTTPException(status_code=400, detail={"category": f"Unknown category '{category}'"})
         if price < rules["min"] or price > rules["max"]:
-            raise HTTPException(status_code=400, detail={"price": f"Price {price} out of allowed range [{rules['min']}, {rules['max']}] for category {category}"})
+            raise HTTPException(status_code=400, detail={"price": _price_error(category, price)})
 
-    def create_product(self, data: schemas.ProductCreate) -> models.Product:
-        # name uniqueness
-        existing = self.repo.get_by_name(data.name)
-        if existing:
+    @span("history_write")
+    def _record_history(self, events: List[HistoryEvent]):
+        # sync durability: part of the current transaction; batched: queued by _commit
+        if history_sink.batched():
+            now = history_sink.utcnow()
+            self._queued_history.extend(e._replace(changed_at=now) for e in events)
+        elif len(events) == 1:
+            e = events[0]
+            self.history_repo.add_history(e.product_id, e.operation, e.state, e.before)
+        else:
+            self.history_repo.bulk_add(events)
+
+    def _commit(self, product_ids: List[int]):
+        generation = cache_sync.bump(self.db, "products")
+        with span("commit"):
+            self.db.commit()
+        queued, self._queued_history = self._queued_history, []
+        history_sink.record(self.db, queued)
+        cache_sync.committed(self.db, "products", generation)
+        response_cache.products_changed(self.db, product_ids)
+        change_feed.notify(self.db)
+
+    @span("flush")
+    def _flush_product(self, write, product: models.Product, conflict_status: int = 409) -> models.Product:
+        # name uniqueness is enforced by the unique index (the only unique constraint on products)
+        try:
+            return write(product)
+        except IntegrityError:
+            self.db.rollback()
             raise HTTPException(status_code=400, detail={"name": "Product with this name already exists"})
+        except StaleDataError:
+            # the UPDATE's "AND version = :read_version" matched nothing: written meanwhile
+            self.db.rollback()
+            raise HTTPException(status_code=conflict_status, detail={"version": "Product was modified concurrently, read it again and retry"})
+
+    def _check_version(self, current: int, expected: Optional[int], status_code: int):
+        # 409 for a version in the body, 412 for If-Match
+        if expected is not None and expected != current:
+            raise HTTPException(status_code=status_code, detail={"version": f"Product is at version {current}, not {expected}"})
 
+    def create_product(self, data: schemas.ProductCreate) -> models.Product:
         # forbidden phrases
         self._check_forbidden(data.name)
 
@@ -50,15 +106,88 @@ class ProductService:
             price=data.price,
             quantity=data.quantity
         )
-        created = self.repo.create(product)
-        # save history
-        self.history_repo.add_history(created.id, "create", {
-            "id": created.id, "name": created.name, "category": created.category, "price": created.price, "quantity": created.quantity
-        })
+        created = self._flush_product(self.repo.create, product)
+        self.search_repo.add([(created.id, created.name)])
+        state = _snapshot(created)
+        self.stats_repo.apply(repositories.stats_deltas([(None, state)]))
+        self._record_history([HistoryEvent(created.id, "create", None, state)])
+        self._commit([created.id])
         return created
 
-    def list_products(self):
-        return self.repo.list_all()
+    def list_products(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        sort: schemas.ProductSort = schemas.ProductSort.id,
+        order: schemas.SortOrder = schemas.SortOrder.asc,
+        category: Optional[schemas.Category] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_quantity: Optional[int] = None,
+        max_quantity: Optional[int] = None,
+    ) -> Tuple[List[Row], Optional[str]]:
+        """Return one page of products (PRODUCT_FIELDS rows) and the cursor of the next page (None on the last page)."""
+        after = _decode_cursor(cursor, sort, order) if cursor else None
+        rows = self.repo.list_page(
+            limit + 1,  # one extra row tells whether there is a next page
+            sort=sort.value,
+            descending=order is schemas.SortOrder.desc,
+            after=after,
+            category=category.value if category else None,
+            min_price=min_price,
+            max_price=max_price,
+            min_quantity=min_quantity,
+            max_quantity=max_quantity,
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = _encode_cursor(sort, order, getattr(last, sort.value), last.id)
+        return rows, next_cursor
+
+    def export_products(self, category: Optional[schemas.Category] = None) -> Result:
+        return self.repo.stream_rows(category.value if category else None, batch_size=exports.EXPORT_BATCH_SIZE)
+
+    def export_history(
+        self,
+        product_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        mode: schemas.HistoryExportMode = schemas.HistoryExportMode.snapshot,
+    ) -> Tuple[Sequence[str], Iterator[Sequence]]:
+        """
+        (columns, batches of rows) of the history table in changed_at order. By default each
+        version carries the product's full snapshot, rebuilt from the stored deltas (as the
+        history endpoint returns it); mode=delta exports the rows as stored.
+        """
+        result = self.history_repo.stream_rows(
+            product_id, _naive_utc(since), _naive_utc(until), batch_size=exports.EXPORT_BATCH_SIZE
+        )
+        if mode is schemas.HistoryExportMode.delta:
+            return list(result.keys()), result.partitions()
+        return exports.HISTORY_FIELDS, self._snapshot_batches(result)
+
+    def _snapshot_batches(self, result: Result) -> Iterator[List[Sequence]]:
+        # (version, state) of the products seen last; a delta whose previous version is not
+        # here (first row after `since`, or evicted) is replayed from the nearest snapshot
+        states: "OrderedDict[int, Tuple[int, dict]]" = OrderedDict()
+        loads = json.loads
+        for batch in result.partitions():
+            rows = []
+            for id_, pid, changed_at, operation, version, is_snapshot, data in batch:
+                previous = states.pop(pid, None)
+                if is_snapshot:
+                    state = loads(data)
+                elif previous is not None and previous[0] == version - 1:
+                    state = {**previous[1], **loads(data)}
+                else:
+                    state = replay(self.history_repo.replay_rows(pid, version, version))[version]
+                states[pid] = (version, state)
+                if len(states) > exports.EXPORT_HISTORY_STATES:
+                    states.popitem(last=False)
+                rows.append((id_, pid, changed_at, operation, _snapshot_json(state)))
+            yield rows
 
     def get_product(self, product_id: int):
         p = self.repo.get_by_id(product_id)
@@ -66,15 +195,16 @@ class ProductService:
             raise HTTPException(status_code=404, detail="Product not found")
         return p
 
-    def update_product(self, product_id: int, data: schemas.ProductUpdate):
+    def update_product(self, product_id: int, data: schemas.ProductUpdate, if_match: Optional[int] = None):
         product = self.repo.get_by_id(product_id)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
+        self._check_version(product.version, data.version, 409)
+        self._check_version(product.version, if_match, 412)
+        before = _snapshot(product)
 
-        # if name changes, check uniqueness and pattern already validated by Pydantic
+        # if name changes, check forbidden phrases (pattern already validated by Pydantic, uniqueness on flush)
         if data.name and data.name != product.name:
-            if self.repo.get_by_name(data.name):
-                raise HTTPException(status_code=400, detail={"name": "Product with this name already exists"})
             self._check_forbidden(data.name)
             product.name = data.name
 
@@ -92,28 +222,476 @@ class ProductService:
                 raise HTTPException(status_code=400, detail={"quantity": "Quantity must be >= 0"})
             product.quantity = data.quantity
 
-        updated = self.repo.update(product)
-        # save history (snapshot after update)
-        self.history_repo.add_history(updated.id, "update", {
-            "id": updated.id, "name": updated.name, "category": updated.category, "price": updated.price, "quantity": updated.quantity
-        })
+        # compare-and-swap: the flush UPDATE only applies if the row is still at the version read above
+        product.version += 1
+        updated = self._flush_product(self.repo.update, product, 412 if if_match is not None else 409)
+        if updated.name != before["name"]:
+            self.search_repo.rename([(updated.id, updated.name)])
+        state = _snapshot(updated)
+        self.stats_repo.apply(repositories.stats_deltas([(before, state)]))
+        self._record_history([HistoryEvent(updated.id, "update", before, state)])
+        self._commit([updated.id])
         return updated
 
-    def delete_product(self, product_id: int):
-        product = self.repo.get_by_id(product_id)
-        if not product:
+    def delete_product(self, product_id: int, version: Optional[int] = None, if_match: Optional[int] = None):
+        # the history stays (audit trail, change feed) and ends with a 'delete' version holding
+        # the last state, which the DELETE ... RETURNING gives without loading the row first
+        self.search_repo.remove([product_id])
+        deleted = self.repo.delete(product_id, version=if_match if if_match is not None else version)
+        if deleted is None:
+            self.db.rollback()
+            # failure path only: missing, or at another version
+            current = self.repo.rows_by_ids([product_id]).get(product_id)
+            if current is None:
+                raise HTTPException(status_code=404, detail="Product not found")
+            self._check_version(current["version"], if_match, 412)
+            self._check_version(current["version"], version, 409)
+            raise HTTPException(status_code=409, detail={"version": "Product was modified concurrently, read it again and retry"})
+        self.stats_repo.apply(repositories.stats_deltas([(deleted, None)]))
+        self._record_history([HistoryEvent(product_id, "delete", deleted, deleted)])
+        self._commit([product_id])
+
+    def apply_batch(self, ops: List[schemas.ProductBatchItem], mode: schemas.BatchMode) -> schemas.ProductBatchResult:
+        """
+        Validate all operations together, as if they ran one after another, then write the
+        accepted ones with bulk statements in a single transaction.
+        Database round trips: one SELECT for the referenced ids, one for the names, then
+        one statement per kind of write and a single commit.
+        """
+        state = self.repo.rows_by_ids(op.id for op in ops if op.id is not None)  # id -> row, None once deleted
+        taken = self.repo.ids_by_names(op.name for op in ops if op.name)         # name -> id (-index-1 for new rows)
+        original = dict(state)                                                     # rows before the batch
+
+        results: List[schemas.ProductBatchItemResult] = []
+        accepted: List[Tuple[schemas.ProductBatchItemResult, dict, Optional[dict]]] = []  # (result, row, row before)
+        creates: List[dict] = []
+        updated: Dict[int, dict] = {}
+        deleted: List[int] = []
+        for i, op in enumerate(ops):
+            before = state.get(op.id) if op.op is schemas.BatchOperation.update else None
+            try:
+                if op.op is schemas.BatchOperation.create:
+                    row = self._batch_create(op, taken)
+                    taken[row["name"]] = -i - 1
+                    creates.append(row)
+                    status = 201
+                elif op.op is schemas.BatchOperation.update:
+                    row = self._batch_update(op, state, taken)
+                    state[row["id"]] = updated[row["id"]] = row
+                    status = 200
+                else:
+                    row = self._batch_target(op, state)
+                    state[row["id"]] = None
+                    taken.pop(row["name"], None)
+                    updated.pop(row["id"], None)
+                    deleted.append(row["id"])
+                    status = 204
+            except HTTPException as e:
+                detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+                results.append(schemas.ProductBatchItemResult(index=i, op=op.op, status=e.status_code, error=detail))
+                continue
+            results.append(schemas.ProductBatchItemResult(index=i, op=op.op, status=status))
+            accepted.append((results[-1], row, before))
+
+        failed = len(results) - len(accepted)
+        if failed and mode is schemas.BatchMode.atomic:
+            raise HTTPException(status_code=400, detail={"operations": [
+                {"index": r.index, "status": r.status, "error": r.error} for r in results if r.error is not None
+            ]})
+
+        try:
+            # compare-and-swap against the versions read at the start of the batch
+            read_versions = {pid: row["version"] for pid, row in original.items() if row is not None}
+            # names the batch moves from one product to another: free them before the UPDATE
+            claimed = {row["name"] for pid, row in updated.items() if row["name"] != original[pid]["name"]}
+            park = [pid for pid in updated if original[pid]["name"] in claimed and updated[pid]["name"] != original[pid]["name"]]
+            if not (self.repo.bulk_delete(deleted, read_versions) and self.repo.bulk_update(list(updated.values()), read_versions, park)):
+                raise StaleDataError("products changed since the batch read them")
+            self.search_repo.remove(deleted)
+            for row, new_id in zip(creates, self.repo.bulk_insert(creates)):
+                row["id"] = new_id
+            self.search_repo.add((row["id"], row["name"]) for row in creates)
+            self.search_repo.rename((row["id"], row["name"]) for row in updated.values() if row["name"] != original[row["id"]]["name"])
+            self.stats_repo.apply(repositories.stats_deltas(
+                [(None, row) for row in creates]
+                + [(original[pid], row) for pid, row in updated.items()]
+                + [(original[pid], None) for pid in deleted]
+            ))
+            # one history version per operation, in batch order (a delete keeps the last state)
+            self._record_history([
+                HistoryEvent(row["id"], r.op.value, row if r.op is schemas.BatchOperation.delete else before, row)
+                for r, row, before in accepted
+            ])
+            self._commit([row["id"] for _, row, _ in accepted])
+        except (IntegrityError, StaleDataError):
+            self.db.rollback()
+            self._queued_history = []
+            raise HTTPException(status_code=409, detail={"operations": "Conflicting concurrent write, nothing was applied"})
+
+        for r, row, _ in accepted:
+            if r.op is not schemas.BatchOperation.delete:
+                r.product = schemas.ProductOut(**row)
+        return schemas.ProductBatchResult(mode=mode, applied=len(accepted), failed=failed, results=results)
+
+    def import_products(self, records: List[Tuple[int, dict]]) -> Tuple[int, List[Tuple[int, dict]]]:
+        """
+        One chunk of an import (imports.py): (line number, fields) records checked with the
+        create_product rules, the valid ones inserted with bulk statements and committed.
+        Names must be unique in the database and in the chunk; earlier chunks are already
+        committed, so the database check covers the rest of the file.
+        Returns the number of products created and the (line number, error) of the others.
+        """
+        for attempt in range(2):
+            errors: List[Tuple[int, dict]] = []
+            valid: List[Tuple[int, schemas.ProductCreate]] = []
+            for line, fields in records:
+                try:
+                    data = schemas.ProductCreate.model_validate(fields)
+                    self._check_forbidden(data.name)
+                    self._validate_price_for_category(data.category.value, data.price)
+                except ValidationError as e:
+                    errors.append((line, {".".join(map(str, err["loc"])) or "line": err["msg"] for err in e.errors()}))
+                    continue
+                except HTTPException as e:
+                    errors.append((line, e.detail))
+                    continue
+                valid.append((line, data))
+
+            taken = self.repo.ids_by_names(data.name for _, data in valid)
+            rows = []
+            for line, data in valid:
+                if data.name in taken:
+                    errors.append((line, {"name": "Product with this name already exists"}))
+                    continue
+                taken[data.name] = 0
+                rows.append({"id": None, "name": data.name, "category": data.category.value, "price": data.price, "quantity": data.quantity, "version": 1})
+
+            try:
+                if rows:
+                    for row, new_id in zip(rows, self.repo.bulk_insert(rows)):
+                        row["id"] = new_id
+                    self.search_repo.add((row["id"], row["name"]) for row in rows)
+                    self.stats_repo.apply(repositories.stats_deltas([(None, row) for row in rows]))
+                    self._record_history([HistoryEvent(row["id"], "create", None, row) for row in rows])
+                    self._commit([row["id"] for row in rows])
+            except IntegrityError:
+                # a name was taken by a concurrent write after the check: check the chunk again
+                self.db.rollback()
+                self._queued_history = []
+                if attempt:
+                    raise HTTPException(status_code=409, detail={"name": "Conflicting concurrent write, chunk not applied"})
+                continue
+            errors.sort(key=lambda e: e[0])
+            return len(rows), errors
+
+    @span("validate_names")
+    def validate_names(
+        self,
+        names: List[str],
+        categories: Optional[List[Optional[str]]] = None,
+        prices: Optional[List[Optional[float]]] = None,
+    ) -> List[Optional[dict]]:
+        """
+        Dry run of the create_product checks for a batch of candidate names (categories and
+        prices optional, one per name); nothing is written. Returns the error dict of each
+        name (None: it would be accepted). The batch is checked as a whole: one query for the
+        names already taken, one pass of the forbidden-phrase matcher over every name, and one
+        range check per category over its prices. A name repeated in the batch fails from its
+        second occurrence on.
+        """
+        errors: List[Optional[dict]] = [None] * len(names)
+
+        def fail(i: int, field: str, message: str):
+            if errors[i] is None:
+                errors[i] = {}
+            errors[i].setdefault(field, message)
+
+        well_formed = [i for i, name in enumerate(names) if NAME_RE.fullmatch(name)]
+        if len(well_formed) < len(names):
+            ok = set(well_formed)
+            for i in range(len(names)):
+                if i not in ok:
+                    fail(i, "name", "Name must be 3-20 letters or digits")
+        checked = [names[i] for i in well_formed]
+        phrases = forbidden_matcher.get_matcher(self.db).find_many(checked)
+        taken = self.repo.existing_names(checked)
+        first: Dict[str, int] = {}
+        for i, name, phrase in zip(well_formed, checked, phrases):
+            if phrase is not None:
+                fail(i, "name", f"Name contains forbidden phrase '{phrase}'")
+            elif name in taken:
+                fail(i, "name", "Product with this name already exists")
+            elif first.setdefault(name, i) != i:
+                fail(i, "name", f"Name repeated in this batch (item {first[name]})")
+
+        categories = categories or [None] * len(names)
+        prices = prices or [None] * len(names)
+        by_category: Dict[str, List[int]] = {}
+        for i, category in enumerate(categories):
+            if category is not None:
+                by_category.setdefault(category, []).append(i)
+            elif prices[i] is not None:
+                fail(i, "category", "Category required to check the price")
+        for category, indexes in by_category.items():
+            rules = PRICE_RULES.get(category)
+            if rules is None:
+                for i in indexes:
+                    fail(i, "category", f"Unknown category '{category}'")
+                continue
+            low, high = rules["min"], rules["max"]
+            for i in [i for i in indexes if prices[i] is not None and not low <= prices[i] <= high]:
+                fail(i, "price", _price_error(category, prices[i]))
+        return errors
+
+    def _batch_create(self, op: schemas.ProductBatchItem, taken: Dict[str, int]) -> dict:
+        missing = [f for f in ("name", "category", "price", "quantity") if getattr(op, f) is None]
+        if missing:
+            raise HTTPException(status_code=400, detail={f: "Field required for create" for f in missing})
+        if op.name in taken:
+            raise HTTPException(status_code=400, detail={"name": "Product with this name already exists"})
+        self._check_forbidden(op.name)
+        self._validate_price_for_category(op.category.value, op.price)
+        return {"id": None, "name": op.name, "category": op.category.value, "price": op.price, "quantity": op.quantity, "version": 1}
+
+    def _batch_target(self, op: schemas.ProductBatchItem, state: Dict[int, Optional[dict]]) -> dict:
+        if op.id is None:
+            raise HTTPException(status_code=400, detail={"id": f"Field required for {op.op.value}"})
+        row = state.get(op.id)
+        if row is None:
             raise HTTPException(status_code=404, detail="Product not found")
-        # snapshot before delete
-        self.history_repo.add_history(product.id, "delete", {
-            "id": product.id, "name": product.name, "category": product.category, "price": product.price, "quantity": product.quantity
-        })
-        self.repo.delete(product)
-
-    def get_history(self, product_id: int):
-        histories = self.history_repo.list_for_product(product_id)
-        if not histories:
-            raise HTTPException(status_code=404, detail="No history found for product")
-        return histories
+        self._check_version(row["version"], op.version, 409)
+        return row
+
+    def _batch_update(self, op: schemas.ProductBatchItem, state: Dict[int, Optional[dict]], taken: Dict[str, int]) -> dict:
+        # mirrors update_product
+        row = dict(self._batch_target(op, state))
+        if op.name and op.name != row["name"]:
+            if op.name in taken:
+                raise HTTPException(status_code=400, detail={"name": "Product with this name already exists"})
+            self._check_forbidden(op.name)
+            taken.pop(row["name"], None)
+            taken[op.name] = row["id"]
+            row["name"] = op.name
+        if op.category:
+            row["category"] = op.category.value
+        if op.price is not None:
+            self._validate_price_for_category(row["category"], op.price)
+            row["price"] = op.price
+        if op.quantity is not None:
+            row["quantity"] = op.quantity
+        row["version"] += 1
+        return row
+
+    # --- stock adjustments: quantity += delta without reading the row first ---
+
+    def _stock_adjusted(self, rows: List[Row], deltas: Dict[int, int]):
+        """Search needs nothing; stats and history get the change from the RETURNING rows."""
+        changes = []
+        for row in rows:
+            state = dict(row._mapping)
+            changes.append((dict(state, quantity=state["quantity"] - deltas[state["id"]]), state))
+        self.stats_repo.apply(repositories.stats_deltas(changes))
+        self._record_history([HistoryEvent(after["id"], "adjust", before, after) for before, after in changes])
+
+    def _stock_error(self, product: Optional[dict], delta: int) -> HTTPException:
+        if product is None:
+            return HTTPException(status_code=404, detail="Product not found")
+        return HTTPException(status_code=409, detail={"quantity": f"Insufficient stock: {product['quantity']} available, delta {delta}"})
+
+    def adjust_stock(self, product_id: int, delta: int) -> dict:
+        rows = self.repo.adjust_quantities({product_id: delta})
+        if not rows:
+            # failure path only: find out why nothing matched
+            raise self._stock_error(self.repo.rows_by_ids([product_id]).get(product_id), delta)
+        self._stock_adjusted(rows, {product_id: delta})
+        self._commit([product_id])
+        return dict(rows[0]._mapping)
+
+    def adjust_stock_batch(self, items: List[schemas.StockAdjustmentItem], mode: schemas.BatchMode) -> schemas.StockBatchResult:
+        """
+        All adjustments in one conditional UPDATE; the ids it did not return are looked up
+        afterwards to report 404 / 409. Atomic mode rolls everything back if any failed.
+        """
+        counts = Counter(item.id for item in items)
+        duplicates = sorted(pid for pid, n in counts.items() if n > 1)
+        if duplicates:
+            raise HTTPException(status_code=400, detail={"adjustments": f"Duplicate product ids: {duplicates}"})
+
+        deltas = {item.id: item.delta for item in items}
+        applied = {row.id: row for row in self.repo.adjust_quantities(deltas)}
+        missing = self.repo.rows_by_ids(pid for pid in deltas if pid not in applied) if len(applied) < len(deltas) else {}
+
+        results: List[schemas.StockBatchItemResult] = []
+        for i, item in enumerate(items):
+            row = applied.get(item.id)
+            if row is None:
+                e = self._stock_error(missing.get(item.id), item.delta)
+                detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+                results.append(schemas.StockBatchItemResult(index=i, id=item.id, status=e.status_code, error=detail))
+            else:
+                results.append(schemas.StockBatchItemResult(index=i, id=item.id, status=200, product=schemas.ProductOut.model_validate(row)))
+
+        failed = len(items) - len(applied)
+        if failed and mode is schemas.BatchMode.atomic:
+            self.db.rollback()
+            raise HTTPException(status_code=400, detail={"adjustments": [
+                {"index": r.index, "id": r.id, "status": r.status, "error": r.error} for r in results if r.error is not None
+            ]})
+        if applied:
+            self._stock_adjusted(list(applied.values()), deltas)
+            self._commit(list(applied))
+        return schemas.StockBatchResult(mode=mode, applied=len(applied), failed=failed, results=results)
+
+    def get_category_stats(self) -> List[dict]:
+        """Inventory aggregates of every category, read from category_stats (one row per category)."""
+        stats = {row.category: row for row in self.stats_repo.all()}
+        result = []
+        for category in schemas.Category:
+            row = stats.get(category.value)
+            count = row.product_count if row else 0
+            result.append({
+                "category": category,
+                "count": count,
+                "total_quantity": row.total_quantity if row else 0,
+                # the sums are maintained incrementally: round away floating point drift
+                "stock_value": round(row.stock_value, 2) if count else 0.0,
+                "min_price": row.min_price if count else None,
+                "max_price": row.max_price if count else None,
+                "avg_price": round(row.price_sum / count, 2) if count else None,
+            })
+        return result
+
+    def search_products(
+        self,
+        q: str,
+        mode: schemas.SearchMode = schemas.SearchMode.substring,
+        category: Optional[schemas.Category] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Row], Optional[str]]:
+        """
+        Products whose name matches `q` (case-insensitive), ranked: names starting with `q`
+        first (in name order), then, in substring mode, names containing it elsewhere (in id
+        order). Substrings need SEARCH_SUBSTRING_MIN characters (the trigram index); shorter
+        queries only match as a prefix. Returns the page and the cursor of the next one.
+        """
+        query = q.lower()
+        stage, after = _decode_search_cursor(cursor, query, mode) if cursor else ("prefix", None)
+        category_value = category.value if category else None
+        page: List[Tuple[str, Row]] = []
+        if stage == "prefix":
+            rows = self.search_repo.prefix_page(query, limit + 1, category_value, after)
+            page += [("prefix", row) for row in rows]
+            after = None
+        if mode is schemas.SearchMode.substring and len(query) >= SEARCH_SUBSTRING_MIN and len(page) <= limit:
+            rows = self.search_repo.substring_page(query, limit + 1 - len(page), category_value, after)
+            page += [("substring", row) for row in rows]
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            stage, last = page[-1]
+            key = [last.name.lower(), last.id] if stage == "prefix" else last.id
+            next_cursor = _pack_cursor([query, mode.value, stage, key])
+        return [row for _, row in page], next_cursor
+
+    def get_history(self, product_id: int, limit: int = 100, cursor: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+        """
+        One page of a product's history, newest version first, each with the full snapshot
+        rebuilt from the stored deltas. Versions older than the table's are read from the
+        history archive. Returns the page and the version to pass as the next cursor (None on
+        the last page).
+        """
+        rows = self.history_repo.page(product_id, limit + 1, before_version=cursor)
+        items = []
+        if rows:
+            states = replay(self.history_repo.replay_rows(product_id, rows[-1].version, rows[0].version))
+            items = [
+                {
+                    "id": id_, "product_id": pid, "changed_at": changed_at, "operation": operation,
+                    "version": version, "snapshot": _snapshot_json(states[version]),
+                }
+                for id_, pid, changed_at, operation, version in rows
+            ]
+        # the table ran out before version 1: the older versions were archived
+        if len(rows) <= limit and (rows[-1].version > 1 if rows else cursor is not None):
+            items += [
+                {
+                    "id": r["id"], "product_id": r["product_id"], "changed_at": r["changed_at"], "operation": r["operation"],
+                    "version": r["version"], "snapshot": _snapshot_json(r["product"]),
+                }
+                for r in history_archive.page(self.db, product_id, limit + 1 - len(items), rows[-1].version if rows else cursor)
+            ]
+        if not items:
+            if cursor is None:
+                raise HTTPException(status_code=404, detail="No history found for product")
+            return [], None
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = items[-1]["version"]
+        return items, next_cursor
+
+    def get_product_as_of(self, product_id: int, moment: datetime) -> dict:
+        """The product as it was at `moment`: its last version then, rebuilt from the nearest snapshot or read from the archive."""
+        moment = _naive_utc(moment)
+        h = self.history_repo.at(product_id, moment)
+        if h is None:
+            archived = history_archive.at(self.db, product_id, moment)
+            if archived is None or archived["operation"] == "delete":
+                raise HTTPException(status_code=404, detail="No history found for product at this time")
+            return {**{k: archived[k] for k in ("version", "changed_at", "operation")}, "product": {**archived["product"], "version": archived["version"]}}
+        if h.operation == "delete":
+            raise HTTPException(status_code=404, detail="No history found for product at this time")
+        state = replay(self.history_repo.replay_rows(product_id, h.version, h.version))[h.version]
+        return {"version": h.version, "changed_at": h.changed_at, "operation": h.operation, "product": {**state, "version": h.version}}
+
+def _price_error(category: str, price: float) -> str:
+    rules = PRICE_RULES[category]
+    return f"Price {price} out of allowed range [{rules['min']}, {rules['max']}] for category {category}"
+
+def _snapshot(product) -> Dict[str, Any]:
+    return {"id": product.id, "name": product.name, "category": product.category, "price": product.price, "quantity": product.quantity}
+
+# the API's snapshot text (json.dumps defaults); one encoder instead of one per call
+_snapshot_json = json.JSONEncoder(default=str).encode
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # changed_at is stored by the database as naive UTC (CURRENT_TIMESTAMP)
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _pack_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _unpack_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail={"cursor": "Invalid cursor"})
+    return values
+
+def _encode_cursor(sort: schemas.ProductSort, order: schemas.SortOrder, value: Any, last_id: int) -> str:
+    return _pack_cursor([sort.value, order.value, value, last_id])
+
+def _decode_cursor(cursor: str, sort: schemas.ProductSort, order: schemas.SortOrder) -> Tuple[Any, int]:
+    c_sort, c_order, value, last_id = _unpack_cursor(cursor, 4)
+    if c_sort != sort.value or c_order != order.value or not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail={"cursor": "Cursor does not match the requested sort order"})
+    return value, last_id
+
+def _decode_search_cursor(cursor: str, query: str, mode: schemas.SearchMode) -> Tuple[str, Any]:
+    c_query, c_mode, stage, key = _unpack_cursor(cursor, 4)
+    if c_query != query or c_mode != mode.value:
+        raise HTTPException(status_code=400, detail={"cursor": "Cursor does not match the search query"})
+    if stage == "prefix" and isinstance(key, list) and len(key) == 2 and isinstance(key[0], str) and isinstance(key[1], int):
+        return stage, tuple(key)
+    if stage == "substring" and isinstance(key, int):
+        return stage, key
+    raise HTTPException(status_code=400, detail={"cursor": "Invalid cursor"})
 
 class ForbiddenService:
     def __init__(self, db: Session):
@@ -124,10 +702,20 @@ class ForbiddenService:
         return self.repo.list_all()
 
     def create_phrase(self, phrase: str):
-        existing = self.repo.get_by_phrase(phrase)
-        if existing:
+        try:
+            created = self.repo.create(phrase)
+        except IntegrityError:
+            self.db.rollback()
             raise HTTPException(status_code=400, detail="Phrase already exists")
-        return self.repo.create(phrase)
+        generation = cache_sync.bump(self.db, "forbidden")
+        self.db.commit()
+        cache_sync.committed(self.db, "forbidden", generation)
+        forbidden_matcher.phrase_added(self.db, created.id, created.phrase)
+        return created
 
     def delete_phrase(self, phrase_id: int):
         self.repo.delete_by_id(phrase_id)
+        generation = cache_sync.bump(self.db, "forbidden")
+        self.db.commit()
+        cache_sync.committed(self.db, "forbidden", generation)
+        forbidden_matcher.phrase_removed(self.db, phrase_id)
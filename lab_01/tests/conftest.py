@@ -0,0 +1,118 @@
+"""
+Test databases for the integration tests.
+
+By default (TEST_DB=memory) every test runs on one shared in-memory SQLite database
+(create_db_engine gives it a StaticPool: a single connection) whose schema is created once
+per session. Each test gets a connection with an outer transaction that is rolled back
+afterwards; sessions join it with savepoints, so a service's commit releases a savepoint
+and a rollback returns to it. Tests marked `file_db` need what a single connection cannot
+give (other threads or processes, CLIs opening their own engine, read-only connections,
+two sessions whose transactions overlap, exact statement counts without SAVEPOINTs) and
+get a temporary file database of their own, as every test does with TEST_DB=file.
+
+The terminal summary reports the time spent preparing databases and the speedup over a
+file database.
+"""
+import os
+import tempfile
+import time
+import pytest
+from sqlalchemy import event
+
+from lab_01 import cache_sync, forbidden_matcher, models, response_cache  # models: tables for create_all
+from lab_01.database import Base, create_db_engine, session_factory
+
+TEST_DB = os.getenv("TEST_DB", "memory").lower()
+
+# mode -> [seconds spent creating and dropping test databases, tests]
+_setup = {"memory": [0.0, 0], "file": [0.0, 0]}
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "file_db: run on a temporary file database instead of the shared in-memory one")
+
+def _sqlite_savepoints(engine):
+    # pysqlite begins transactions on its own and breaks SAVEPOINT; let SQLAlchemy emit BEGIN
+    @event.listens_for(engine, "connect")
+    def _autocommit(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+@pytest.fixture(scope="session")
+def memory_engine():
+    start = time.perf_counter()
+    engine = create_db_engine("sqlite://")
+    _sqlite_savepoints(engine)
+    Base.metadata.create_all(engine)
+    _setup["memory"][0] += time.perf_counter() - start
+    yield engine
+    engine.dispose()
+
+def _file_database():
+    """(session factory, read-only session factory, cleanup) on a new temporary file database."""
+    db_fd, db_path = tempfile.mkstemp()
+    url = f"sqlite:///{db_path}"
+    engine = create_db_engine(url)
+    Base.metadata.create_all(engine)
+    # GET routes: same file, read-only connections (a write there fails the test)
+    read_engine = create_db_engine(url, read_only=True)
+
+    def cleanup():
+        engine.dispose()
+        read_engine.dispose()
+        os.close(db_fd)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+    return session_factory(engine), session_factory(read_engine), cleanup
+
+@pytest.fixture
+def db_sessions(request):
+    """(Session, ReadSession) factories for get_db / get_read_db, isolated to this test."""
+    if TEST_DB == "file" or request.node.get_closest_marker("file_db"):
+        start = time.perf_counter()
+        Session, ReadSession, cleanup = _file_database()
+        elapsed = time.perf_counter() - start
+        yield Session, ReadSession
+        start = time.perf_counter()
+        cleanup()
+        _setup["file"][0] += elapsed + time.perf_counter() - start
+        _setup["file"][1] += 1
+        return
+
+    engine = request.getfixturevalue("memory_engine")
+    start = time.perf_counter()
+    conn = engine.connect()
+    outer = conn.begin()
+    Session = session_factory(conn, join_transaction_mode="create_savepoint")
+    elapsed = time.perf_counter() - start
+    # reads share the connection (and the uncommitted outer transaction); read-only is checked on file databases
+    yield Session, Session
+    start = time.perf_counter()
+    outer.rollback()
+    conn.close()
+    # process-wide caches are keyed by database URL, the same for every test here
+    response_cache.reset()
+    forbidden_matcher.reset()
+    cache_sync.reset()
+    _setup["memory"][0] += elapsed + time.perf_counter() - start
+    _setup["memory"][1] += 1
+
+def pytest_terminal_summary(terminalreporter):
+    seconds, tests = _setup["memory"]
+    if not tests:
+        return
+    if not _setup["file"][1]:
+        # no file database in this run: time one for the comparison
+        start = time.perf_counter()
+        _file_database()[2]()
+        _setup["file"] = [time.perf_counter() - start, 1]
+    per_file = _setup["file"][0] / _setup["file"][1]
+    terminalreporter.write_line(
+        f"test databases: {tests} tests in memory, {seconds * 1000:.0f} ms setup/teardown "
+        f"({seconds / tests * 1000:.1f} ms per test, {per_file * 1000:.1f} ms on a file database: "
+        f"{per_file * tests / seconds:.0f}x faster)"
+    )
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import pytest
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("greenlet")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from lab_01.database import Base, get_async_db, get_async_read_db, make_read_only
+from lab_01.routers import products_async, forbidden_async
+
+@pytest.fixture
+def client():
+    db_fd, db_path = tempfile.mkstemp()
+    sync_engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=sync_engine)
+    sync_engine.dispose()
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    TestingSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    read_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    make_read_only(read_engine.sync_engine)
+    ReadSessionLocal = async_sessionmaker(read_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with TestingSessionLocal() as db:
+            yield db
+
+    async def override_get_async_read_db():
+        async with ReadSessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(products_async.router)
+    app.include_router(forbidden_async.router)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_async_read_db] = override_get_async_read_db
+
+    with TestClient(app) as c:
+        yield c
+
+    os.close(db_fd)
+    os.unlink(db_path)
+
+def test_async_routes_apply_the_same_rules(client):
+    r = client.post("/api/v1/forbidden/", json={"phrase": "bad"})
+    assert r.status_code == 201
+
+    r = client.post("/api/v1/products/", json={"name": "BadPhone1", "category": "electronics", "price": 100.0, "quantity": 1})
+    assert r.status_code == 400
+    assert "forbidden" in r.json()["detail"]["name"].lower()
+
+    r = client.post("/api/v1/products/", json={"name": "Phone1", "category": "electronics", "price": 100.0, "quantity": 1})
+    assert r.status_code == 201
+    pid = r.json()["id"]
+    r = client.post("/api/v1/products/", json={"name": "Phone1", "category": "electronics", "price": 100.0, "quantity": 1})
+    assert r.status_code == 400
+
+    r = client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": 120.0, "quantity": 3})
+    assert r.status_code == 200
+    assert r.json()["price"] == 120.0
+
+    r = client.get("/api/v1/products/", params={"limit": 1})
+    assert [p["id"] for p in r.json()] == [pid]
+
+    r = client.get(f"/api/v1/products/{pid}/history")
+    assert sorted(h["operation"] for h in r.json()) == ["create", "update"]
+
+    assert client.delete(f"/api/v1/products/{pid}").status_code == 204
+    assert client.get(f"/api/v1/products/{pid}").status_code == 404
@@ -1,38 +1,36 @@
 import os
 import json
-import tempfile
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from lab_01.main import app
-from lab_01.database import Base, get_db
+from sqlalchemy import inspect, text
+from lab_01.main import create_app
+from lab_01 import history_sink, instrumentation
+from lab_01.database import get_db, get_read_db
+
+app = create_app(seed=False)
 
 @pytest.fixture(autouse=True)
-def prepare_db():
-    db_fd, db_path = tempfile.mkstemp()
-    database_url = f"sqlite:///{db_path}"
-    
-    engine = create_engine(database_url)
-    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    
-    Base.metadata.create_all(bind=engine)
-    
+def prepare_db(db_sessions):
+    # sessions from conftest.py: the shared in-memory database, or a file one for `file_db` tests
+    TestingSessionLocal, ReadSessionLocal = db_sessions
+
     def override_get_db():
         try:
             db = TestingSessionLocal()
             yield db
         finally:
             db.close()
-    
+
+    def override_get_read_db():
+        try:
+            db = ReadSessionLocal()
+            yield db
+        finally:
+            db.close()
+
     app.dependency_overrides[get_db] = override_get_db
-    
-    yield  # run the tests
-    
-    # Cleanup
-    engine.dispose()
-    os.close(db_fd)
-    os.unlink(db_path)
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    yield
 
 client = TestClient(app)
 
@@ -131,3 +129,994 @@ def test_name_validation_and_quantity():
         "quantity": -5
     })
     assert r.status_code == 422
+
+def test_forbidden_phrases_are_case_insensitive_and_follow_list_changes():
+    r = client.post("/api/v1/forbidden/", json={"phrase": "SPAM"})
+    assert r.status_code == 201
+    spam_id = r.json()["id"]
+
+    # matcher is built from the table on first use
+    r = client.post("/api/v1/products/", json={
+        "name": "NoSpamHere1",
+        "category": "books",
+        "price": 10.0,
+        "quantity": 1
+    })
+    assert r.status_code == 400
+    assert r.json()["detail"]["name"] == "Name contains forbidden phrase 'SPAM'"
+
+    # a phrase added later is picked up without a restart
+    r = client.post("/api/v1/forbidden/", json={"phrase": "ugly"})
+    assert r.status_code == 201
+    r = client.post("/api/v1/products/", json={
+        "name": "UglyHat1",
+        "category": "clothing",
+        "price": 20.0,
+        "quantity": 1
+    })
+    assert r.status_code == 400
+    assert "ugly" in r.json()["detail"]["name"]
+
+    # removing the phrase unblocks the name
+    r = client.delete(f"/api/v1/forbidden/{spam_id}")
+    assert r.status_code == 204
+    r = client.post("/api/v1/products/", json={
+        "name": "NoSpamHere1",
+        "category": "books",
+        "price": 10.0,
+        "quantity": 1
+    })
+    assert r.status_code == 201
+
+@pytest.mark.file_db
+def test_forbidden_matcher_first_load_sees_phrases_committed_during_a_request():
+    from fastapi import HTTPException
+    from lab_01.services import ProductService
+
+    # a request whose transaction (and read snapshot) started before the phrase was committed
+    db = next(app.dependency_overrides[get_db]())
+    db.execute(text("BEGIN"))
+    db.execute(text("SELECT count(*) FROM forbidden_phrases")).scalar()
+    assert client.post("/api/v1/forbidden/", json={"phrase": "evil"}).status_code == 201  # no matcher to update yet
+    with pytest.raises(HTTPException):
+        ProductService(db)._check_forbidden("EvilHat1")  # first load, on a connection of its own
+    db.rollback()
+    db.close()
+    # and the cached matcher has it for everyone else
+    assert client.post("/api/v1/products/", json={"name": "EvilHat2", "category": "clothing", "price": 20.0, "quantity": 1}).status_code == 400
+
+def test_list_products_keyset_pagination_filters_and_sorting():
+    items = [
+        ("Alpha1", "books", 12.0, 3),
+        ("Bravo2", "books", 30.0, 0),
+        ("Charlie3", "clothing", 40.0, 8),
+        ("Delta4", "books", 30.0, 5),
+        ("Echo5", "electronics", 300.0, 2),
+    ]
+    for name, category, price, quantity in items:
+        r = client.post("/api/v1/products/", json={"name": name, "category": category, "price": price, "quantity": quantity})
+        assert r.status_code == 201
+
+    # walk all pages of books sorted by price desc (ties broken by id)
+    seen = []
+    params = {"limit": 2, "category": "books", "sort": "price", "order": "desc"}
+    r = client.get("/api/v1/products/", params=params)
+    while True:
+        assert r.status_code == 200
+        seen += [p["name"] for p in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        r = client.get("/api/v1/products/", params={**params, "cursor": cursor})
+    assert seen == ["Delta4", "Bravo2", "Alpha1"]
+
+    r = client.get("/api/v1/products/", params={"sort": "name", "min_quantity": 1, "max_price": 100})
+    assert [p["name"] for p in r.json()] == ["Alpha1", "Charlie3", "Delta4"]
+    assert "X-Next-Cursor" not in r.headers
+
+    # a cursor is bound to the sort order it was issued for
+    r = client.get("/api/v1/products/?limit=1&sort=name")
+    r = client.get("/api/v1/products/", params={"sort": "price", "cursor": r.headers["X-Next-Cursor"]})
+    assert r.status_code == 400
+    r = client.get("/api/v1/products/", params={"cursor": "garbage"})
+    assert r.status_code == 400
+
+def test_export_products_and_history_stream_ndjson_and_csv(monkeypatch):
+    for name, category, price in [("Lamp1", "electronics", 60.0), ("Poem2", "books", 8.0), ("Scarf3", "clothing", 15.0)]:
+        r = client.post("/api/v1/products/", json={"name": name, "category": category, "price": price, "quantity": 1})
+        assert r.status_code == 201
+
+    r = client.get("/api/v1/products/export")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row["name"] for row in rows] == ["Lamp1", "Poem2", "Scarf3"]
+    assert set(rows[0]) == {"id", "name", "category", "price", "quantity"}
+
+    r = client.get("/api/v1/products/export", params={"format": "csv", "category": "books"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/csv")
+    lines = r.text.splitlines()
+    assert lines[0] == "id,name,category,price,quantity"
+    assert lines[1].split(",")[1:] == ["Poem2", "books", "8.0", "1"]
+    assert len(lines) == 2
+
+    lamp = rows[0]["id"]
+    for price in (61.0, 62.0):
+        client.put(f"/api/v1/products/{lamp}", json={"name": None, "category": None, "price": price, "quantity": None})
+
+    # every version with the full product state, rebuilt from the stored deltas
+    r = client.get("/api/v1/products/history/export")
+    history = [json.loads(line) for line in r.text.splitlines()]
+    assert len(history) == 5 and set(history[0]) == {"id", "product_id", "changed_at", "operation", "snapshot"}
+    assert [h["operation"] for h in history] == ["create"] * 3 + ["update"] * 2
+    assert json.loads(history[-1]["snapshot"]) == {"id": lamp, "name": "Lamp1", "category": "electronics", "price": 62.0, "quantity": 1}
+    assert history[-1]["snapshot"] == client.get(f"/api/v1/products/{lamp}/history").json()[0]["snapshot"]
+
+    # a product whose state was not kept (only the last product's is here) is replayed from its stored snapshot
+    from lab_01 import exports
+    monkeypatch.setattr(exports, "EXPORT_HISTORY_STATES", 1)
+    r = client.get("/api/v1/products/history/export")
+    assert [json.loads(line)["snapshot"] for line in r.text.splitlines()] == [h["snapshot"] for h in history]
+
+    # opt-in: the rows as stored
+    r = client.get("/api/v1/products/history/export", params={"mode": "delta", "product_id": lamp})
+    stored = [json.loads(line) for line in r.text.splitlines()]
+    assert [(h["version"], h["is_snapshot"], json.loads(h["data"])) for h in stored][1:] == [(2, False, {"price": 61.0}), (3, False, {"price": 62.0})]
+
+    r = client.get("/api/v1/products/history/export", params={"format": "csv", "since": "2999-01-01T00:00:00"})
+    assert r.text.splitlines() == ["id,product_id,changed_at,operation,snapshot"]
+    r = client.get("/api/v1/products/history/export", params={"format": "csv", "mode": "delta", "since": "2999-01-01T00:00:00"})
+    assert r.text.splitlines() == ["id,product_id,changed_at,operation,version,is_snapshot,data"]
+
+def test_product_batch_atomic_and_partial():
+    r = client.post("/api/v1/forbidden/", json={"phrase": "bad"})
+    assert r.status_code == 201
+    r = client.post("/api/v1/products/", json={"name": "Existing1", "category": "books", "price": 20.0, "quantity": 1})
+    existing_id = r.json()["id"]
+
+    operations = [
+        {"op": "create", "name": "Kettle1", "category": "electronics", "price": 80.0, "quantity": 3},
+        {"op": "create", "name": "Existing1", "category": "books", "price": 20.0, "quantity": 1},  # duplicate
+        {"op": "create", "name": "BadCoat1", "category": "clothing", "price": 50.0, "quantity": 1},  # forbidden
+        {"op": "create", "name": "Atlas1", "category": "books", "price": 900.0, "quantity": 1},  # price rule
+        {"op": "update", "id": existing_id, "price": 25.0, "quantity": 4},
+        {"op": "delete", "id": 999999},  # missing
+    ]
+
+    # atomic: any failure rejects the whole batch
+    r = client.post("/api/v1/products/batch", json={"operations": operations})
+    assert r.status_code == 400
+    assert [e["index"] for e in r.json()["detail"]["operations"]] == [1, 2, 3, 5]
+    assert len(client.get("/api/v1/products/").json()) == 1
+
+    # partial: valid operations are applied in one transaction
+    r = client.post("/api/v1/products/batch", json={"mode": "partial", "operations": operations})
+    assert r.status_code == 200
+    body = r.json()
+    assert (body["applied"], body["failed"]) == (2, 4)
+    statuses = [item["status"] for item in body["results"]]
+    assert statuses == [201, 400, 400, 400, 200, 404]
+    assert "forbidden" in body["results"][2]["error"]["name"].lower()
+    kettle = body["results"][0]["product"]
+    assert kettle["name"] == "Kettle1"
+    assert body["results"][4]["product"]["quantity"] == 4
+
+    history = client.get(f"/api/v1/products/{kettle['id']}/history").json()
+    assert [h["operation"] for h in history] == ["create"]
+    assert json.loads(history[0]["snapshot"])["id"] == kettle["id"]
+    assert len(client.get(f"/api/v1/products/{existing_id}/history").json()) == 2
+
+    # operations see the effects of earlier ones in the same batch
+    r = client.post("/api/v1/products/batch", json={"operations": [
+        {"op": "delete", "id": existing_id},
+        {"op": "create", "name": "Existing1", "category": "books", "price": 30.0, "quantity": 2},
+        {"op": "update", "id": kettle["id"], "name": "Kettle2"},
+        {"op": "create", "name": "Kettle1", "category": "electronics", "price": 70.0, "quantity": 1},
+    ]})
+    assert r.status_code == 200
+    names = sorted(p["name"] for p in client.get("/api/v1/products/").json())
+    assert names == ["Existing1", "Kettle1", "Kettle2"]
+
+    # renames that move names between products: a swap through a temporary name, and a chain
+    # whose first product comes first in the single UPDATE
+    ids = {p["name"]: p["id"] for p in client.get("/api/v1/products/").json()}
+    r = client.post("/api/v1/products/batch", json={"operations": [
+        {"op": "update", "id": ids["Kettle1"], "name": "Swap1"},
+        {"op": "update", "id": ids["Kettle2"], "name": "Kettle1"},
+        {"op": "update", "id": ids["Kettle1"], "name": "Kettle2"},
+    ]})
+    assert r.status_code == 200 and r.json()["applied"] == 3
+    r = client.post("/api/v1/products/batch", json={"operations": [
+        {"op": "update", "id": ids["Existing1"], "price": 31.0},
+        {"op": "update", "id": ids["Kettle2"], "name": "Chain1"},
+        {"op": "update", "id": ids["Existing1"], "name": "Kettle1"},
+    ]})
+    assert r.status_code == 200
+    assert {p["id"]: p["name"] for p in client.get("/api/v1/products/").json()} == {
+        ids["Kettle1"]: "Kettle2", ids["Kettle2"]: "Chain1", ids["Existing1"]: "Kettle1",
+    }
+    assert [p["name"] for p in client.get("/api/v1/products/search", params={"q": "kettle"}).json()] == ["Kettle1", "Kettle2"]
+
+def test_conditional_get_with_etags_and_cache_invalidation():
+    r = client.post("/api/v1/products/", json={"name": "Clock1", "category": "electronics", "price": 70.0, "quantity": 2})
+    pid = r.json()["id"]
+
+    r = client.get(f"/api/v1/products/{pid}")
+    assert r.status_code == 200
+    etag = r.headers["ETag"]
+
+    r = client.get(f"/api/v1/products/{pid}", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+
+    list_etag = client.get("/api/v1/products/").headers["ETag"]
+    assert client.get("/api/v1/products/", headers={"If-None-Match": list_etag}).status_code == 304
+
+    # a write through the service invalidates both the product and the lists
+    r = client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": 75.0, "quantity": None})
+    assert r.status_code == 200
+    r = client.get(f"/api/v1/products/{pid}", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json()["price"] == 75.0
+    assert r.headers["ETag"] != etag
+
+    r = client.get("/api/v1/products/", headers={"If-None-Match": list_etag})
+    assert r.status_code == 200
+    assert r.json()[0]["price"] == 75.0
+
+    client.delete(f"/api/v1/products/{pid}")
+    assert client.get(f"/api/v1/products/{pid}").status_code == 404
+
+def test_last_modified_is_not_reused_by_a_write_in_the_same_second(monkeypatch):
+    from types import SimpleNamespace
+    import time
+    from lab_01 import response_cache
+
+    clock = [1_000_000.2]
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(time=lambda: clock[0], monotonic=time.monotonic))
+    pid = client.post("/api/v1/products/", json={"name": "Dial1", "category": "books", "price": 10.0, "quantity": 1}).json()["id"]
+
+    # no date while a write could still come in the same second
+    assert "Last-Modified" not in client.get(f"/api/v1/products/{pid}").headers
+    clock[0] = 1_000_001.5
+    last_modified = client.get(f"/api/v1/products/{pid}").headers["Last-Modified"]
+    assert client.get(f"/api/v1/products/{pid}", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    # write and re-read within the same second: the old date must not match
+    clock[0] = 1_000_001.6
+    client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": 12.0, "quantity": None})
+    clock[0] = 1_000_001.7
+    r = client.get(f"/api/v1/products/{pid}", headers={"If-Modified-Since": last_modified})
+    assert r.status_code == 200 and r.json()["price"] == 12.0
+    r = client.get("/api/v1/products/", headers={"If-Modified-Since": last_modified})
+    assert r.status_code == 200 and r.json()[0]["price"] == 12.0
+
+    clock[0] = 1_000_002.1
+    r = client.get(f"/api/v1/products/{pid}", headers={"If-Modified-Since": last_modified})
+    assert r.status_code == 200 and r.headers["Last-Modified"] != last_modified
+    assert client.get(f"/api/v1/products/{pid}", headers={"If-Modified-Since": r.headers["Last-Modified"]}).status_code == 304
+
+def test_delta_history_pages_and_point_in_time_state():
+    r = client.post("/api/v1/products/", json={"name": "Radio1", "category": "electronics", "price": 100.0, "quantity": 0})
+    pid = r.json()["id"]
+    for q in range(1, 13):
+        client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": None, "quantity": q})
+    client.put(f"/api/v1/products/{pid}", json={"name": "Radio2", "category": None, "price": 120.0, "quantity": None})
+
+    # 14 versions: full snapshots at 1 and 11, deltas in between
+    db = next(app.dependency_overrides[get_db]())
+    stored = db.execute(text("SELECT version, is_snapshot, data FROM product_histories ORDER BY version")).all()
+    assert [v for v, snap, _ in stored if snap] == [1, 11]
+    assert stored[1].data == '{"quantity":1}'
+    assert json.loads(stored[13].data) == {"name": "Radio2", "price": 120.0}
+
+    # pages rebuild full snapshots from the deltas, newest first
+    versions, cursor, pages = [], None, 0
+    while True:
+        r = client.get(f"/api/v1/products/{pid}/history", params={"limit": 5, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200
+        versions += [h["version"] for h in r.json()]
+        for h in r.json():
+            assert json.loads(h["snapshot"])["quantity"] == min(h["version"] - 1, 12)
+        pages += 1
+        cursor = r.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert versions == list(range(14, 0, -1)) and pages == 3
+    assert json.loads(client.get(f"/api/v1/products/{pid}/history").json()[0]["snapshot"])["name"] == "Radio2"
+
+    # state at a point in time: spread the versions one minute apart
+    db.execute(text("UPDATE product_histories SET changed_at = datetime('2030-01-01 12:00:00', '+' || version || ' minutes')"))
+    db.commit()
+    db.close()
+    r = client.get(f"/api/v1/products/{pid}/history/as-of", params={"at": "2030-01-01T12:07:30"})
+    assert r.status_code == 200
+    assert r.json()["version"] == 7
+    assert r.json()["product"] == {"id": pid, "name": "Radio1", "category": "electronics", "price": 100.0, "quantity": 6, "version": 7}
+    r = client.get(f"/api/v1/products/{pid}/history/as-of", params={"at": "2030-01-01T16:00:00+02:00"})
+    assert r.json()["version"] == 14 and r.json()["product"]["name"] == "Radio2"
+    r = client.get(f"/api/v1/products/{pid}/history/as-of", params={"at": "2030-01-01T12:00:00"})
+    assert r.status_code == 404
+
+@pytest.mark.file_db
+def test_batched_history_sink_flushes_in_order(monkeypatch):
+    monkeypatch.setattr(history_sink, "HISTORY_DURABILITY", "batched")
+    monkeypatch.setattr(history_sink, "HISTORY_FLUSH_INTERVAL_MS", 60_000)
+    monkeypatch.setattr(history_sink, "HISTORY_QUEUE_MAX", 500)
+    flushed = history_sink.FLUSHED_EVENTS.value()
+    try:
+        r = client.post("/api/v1/products/", json={"name": "Drum1", "category": "electronics", "price": 90.0, "quantity": 1})
+        pid = r.json()["id"]
+        for q in range(2, 5):
+            client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": None, "quantity": q})
+
+        # the product is written, its history is still queued
+        assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 4
+        assert client.get(f"/api/v1/products/{pid}/history").status_code == 404
+        assert history_sink.QUEUE_DEPTH.value() == 4
+
+        history_sink.flush_all()
+        assert history_sink.QUEUE_DEPTH.value() == 0
+        assert history_sink.FLUSHED_EVENTS.value() - flushed == 4
+        assert history_sink.FLUSH_SECONDS.count() >= 1
+        history = client.get(f"/api/v1/products/{pid}/history").json()
+        assert [h["version"] for h in history] == [4, 3, 2, 1]
+        assert [json.loads(h["snapshot"])["quantity"] for h in history] == [4, 3, 2, 1]
+
+        # a full queue is flushed by the request that finds it full
+        monkeypatch.setattr(history_sink.for_session(next(app.dependency_overrides[get_db]())), "max_queue", 2)
+        for q in range(5, 8):
+            client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": None, "quantity": q})
+        assert history_sink.BACKPRESSURE.value() >= 1
+        assert history_sink.QUEUE_DEPTH.value() <= 2
+    finally:
+        history_sink.shutdown()
+    assert len(client.get(f"/api/v1/products/{pid}/history").json()) == 7
+
+@pytest.mark.file_db
+def test_batched_history_sinks_of_several_workers_share_versions():
+    from sqlalchemy import event
+    from lab_01.database import create_db_engine
+    from lab_01.repositories import HistoryEvent
+
+    r = client.post("/api/v1/products/", json={"name": "Flute1", "category": "electronics", "price": 90.0, "quantity": 1})
+    pid, state = r.json()["id"], r.json()
+    url = next(app.dependency_overrides[get_db]()).get_bind().url.render_as_string(hide_password=False)
+    # two workers: separate engines (connections) on the same database file, each with its own sink
+    engine_a, engine_b = create_db_engine(url), create_db_engine(url)
+    sink_a = history_sink.HistorySink(engine_a, flush_interval_ms=60_000)
+    sink_b = history_sink.HistorySink(engine_b, flush_interval_ms=60_000)
+    dropped = history_sink.DROPPED_EVENTS.value()
+
+    def event_for(q):
+        return HistoryEvent(pid, "update", dict(state), dict(state, quantity=q))
+
+    # worker B flushes its batch while worker A's flush is about to write
+    interleaved = []
+
+    @event.listens_for(engine_a, "before_cursor_execute")
+    def _b_flushes_first(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO product_histories") and not interleaved:
+            interleaved.append(True)
+            sink_b.flush()
+
+    try:
+        sink_a.record([event_for(2), event_for(3)])
+        sink_b.record([event_for(20), event_for(30)])
+        sink_a.flush()
+    finally:
+        sink_a.close()
+        sink_b.close()
+        engine_a.dispose()
+        engine_b.dispose()
+
+    assert history_sink.DROPPED_EVENTS.value() == dropped
+    history = client.get(f"/api/v1/products/{pid}/history").json()
+    assert [h["version"] for h in history] == [5, 4, 3, 2, 1]
+    assert [json.loads(h["snapshot"])["quantity"] for h in history] == [3, 2, 30, 20, 1]
+
+@pytest.mark.file_db
+def test_metrics_endpoint_and_slow_request_log(monkeypatch, caplog):
+    r = client.post("/api/v1/products/", json={"name": "Organ1", "category": "electronics", "price": 900.0, "quantity": 1})
+    pid = r.json()["id"]
+
+    monkeypatch.setattr(instrumentation, "SLOW_REQUEST_MS", 0)
+    with caplog.at_level("WARNING", logger="lab_01.instrumentation"):
+        r = client.put(f"/api/v1/products/{pid}", json={"name": "Organ2", "category": None, "price": None, "quantity": 3})
+    assert r.status_code == 200
+    slow = [rec.getMessage() for rec in caplog.records if "slow request" in rec.getMessage()]
+    assert len(slow) == 1
+    assert f"PUT /api/v1/products/{pid} -> 200" in slow[0]
+    assert "5 SQL statements" in slow[0] and "UPDATE products" in slow[0] and "UPDATE products_fts" in slow[0]
+    assert "INSERT INTO category_stats" in slow[0]
+    assert "check_forbidden=" in slow[0] and "commit=" in slow[0]
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    lines = r.text.splitlines()
+    put = 'method="PUT",route="/api/v1/products/{product_id}"'
+    assert any(line.startswith('http_request_duration_seconds_count{%s,status="200"}' % put) for line in lines)
+    assert any(line.startswith('http_request_sql_statements_bucket{%s,le="5"}' % put) for line in lines)
+    assert any(line.startswith('app_span_duration_seconds_count{span="check_forbidden"}') for line in lines)
+    assert "# TYPE history_sink_queue_depth gauge" in lines
+
+@pytest.mark.file_db
+def test_bulk_seed_generates_valid_products_with_history(monkeypatch):
+    from lab_01 import bulk_seed
+    from lab_01.services import PRICE_RULES
+    client.post("/api/v1/products/", json={"name": "Existing1", "category": "books", "price": 10.0, "quantity": 1})
+    # names the generator would give to id 20 (one of the categories gets it), taken by hand
+    manual = {"Existing1", "Elec20", "Book20", "Wear20"}
+    for name in ("Elec20", "Book20", "Wear20"):
+        client.post("/api/v1/products/", json={"name": name, "category": "books", "price": 10.0, "quantity": 1})
+    db = next(app.dependency_overrides[get_db]())
+    engine = db.get_bind()
+    db.close()
+    with engine.begin() as conn:
+        bulk_seed.insert_forbidden(conn, ["ook1"])  # rules out Book1, Book10..Book19, ...
+
+    monkeypatch.setattr(bulk_seed, "DEFER_INDEXES_MIN_ROWS", 0)
+    stats = bulk_seed.seed(engine, per_category=12, history=12, chunk_size=10)
+    assert stats.products == 36 and stats.histories == 36 * 12
+
+    products = client.get("/api/v1/products/", params={"limit": 100}).json()
+    generated = [p for p in products if p["id"] > 4]
+    assert len(generated) == 36 and not manual & {p["name"] for p in generated}
+    assert min(p["id"] for p in generated) == 5
+    for category, rules in PRICE_RULES.items():
+        in_category = [p for p in generated if p["category"] == category]
+        assert len(in_category) == 12
+        assert all(rules["min"] <= p["price"] <= rules["max"] for p in in_category)
+    assert not any("ook1" in p["name"].lower() for p in generated)
+
+    # history is stored like the API stores it, and replays to the current row
+    p = generated[0]
+    history = client.get(f"/api/v1/products/{p['id']}/history").json()
+    assert [h["version"] for h in history] == list(range(12, 0, -1))
+    assert [h["operation"] for h in history][-2:] == ["update", "create"]
+    assert p["version"] == 12 and {**json.loads(history[0]["snapshot"]), "version": 12} == p
+    with engine.connect() as conn:
+        snapshots = conn.execute(text("SELECT version FROM product_histories WHERE product_id = :id AND is_snapshot"), {"id": p["id"]}).scalars().all()
+        indexes = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'")).scalars().all()
+    assert snapshots == [1, 11]
+    assert "ix_product_histories_product_changed_at" in indexes and "ix_products_category_price_id" in indexes
+
+def test_fast_list_and_history_json_match_the_response_models(monkeypatch):
+    from typing import List
+    from pydantic import TypeAdapter
+    from lab_01 import fast_json, schemas
+    for i, (category, price) in enumerate([("books", 7.0), ("clothing", 19.99), ("electronics", 1234.5)]):
+        client.post("/api/v1/products/", json={"name": f"Fast{i}", "category": category, "price": price, "quantity": i})
+    client.put("/api/v1/products/1", json={"name": "Fast9", "category": None, "price": 8.25, "quantity": None})
+
+    products_out = TypeAdapter(List[schemas.ProductOut])
+    history_out = TypeAdapter(List[schemas.ProductHistoryOut])
+    bodies = []
+    for run, encoder in enumerate((fast_json.orjson, None)):
+        monkeypatch.setattr(fast_json, "orjson", encoder)
+        # max_price differs per run so the list is not served from the response cache
+        products = client.get("/api/v1/products/", params={"sort": "price", "limit": 2, "max_price": 10000 + run})
+        history = client.get("/api/v1/products/1/history", params={"limit": 1})
+        assert products.headers["content-type"] == history.headers["content-type"] == "application/json"
+        assert history.headers["X-Next-Cursor"] == "2"
+        # byte for byte what validating every row through the response models gives
+        assert products.content == products_out.dump_json(products_out.validate_json(products.content))
+        assert history.content == history_out.dump_json(history_out.validate_json(history.content))
+        bodies.append((products.content, history.content))
+    assert bodies[0] == bodies[1]
+    assert json.loads(bodies[0][0]) == [
+        {"id": 1, "name": "Fast9", "category": "books", "price": 8.25, "quantity": 0, "version": 2},
+        {"id": 2, "name": "Fast1", "category": "clothing", "price": 19.99, "quantity": 1, "version": 1},
+    ]
+    assert json.loads(json.loads(bodies[0][1])[0]["snapshot"])["name"] == "Fast9"
+
+def test_search_prefix_and_substring_ranked_paginated_and_in_sync():
+    for name, category, price in [("Lamp1", "electronics", 60.0), ("lampshade", "clothing", 20.0), ("Clamp2", "electronics", 70.0),
+                                  ("Book1", "books", 9.0), ("Lampoon", "books", 12.0)]:
+        client.post("/api/v1/products/", json={"name": name, "category": category, "price": price, "quantity": 1})
+    r = client.post("/api/v1/products/batch", json={"operations": [
+        {"op": "create", "name": "Clamp9", "category": "books", "price": 7.0, "quantity": 0},
+        {"op": "update", "id": 4, "name": "Lamp4"},
+    ]})
+    assert r.status_code == 200
+    names = lambda r: [p["name"] for p in r.json()]
+
+    # prefix matches first (case-insensitive, name order), then names containing the query (id order)
+    r = client.get("/api/v1/products/search", params={"q": "LAMP"})
+    assert r.status_code == 200
+    assert names(r) == ["Lamp1", "Lamp4", "Lampoon", "lampshade", "Clamp2", "Clamp9"]
+    assert names(client.get("/api/v1/products/search", params={"q": "lamp", "mode": "prefix"})) == ["Lamp1", "Lamp4", "Lampoon", "lampshade"]
+    assert names(client.get("/api/v1/products/search", params={"q": "lamp", "category": "books"})) == ["Lamp4", "Lampoon", "Clamp9"]
+    # too short for the trigram index: prefix only
+    assert names(client.get("/api/v1/products/search", params={"q": "cl"})) == ["Clamp2", "Clamp9"]
+    assert client.get("/api/v1/products/search", params={"q": "Book"}).json() == []
+
+    # pages continue across the prefix and substring parts
+    seen, cursor = [], None
+    while True:
+        r = client.get("/api/v1/products/search", params={"q": "lamp", "limit": 4, **({"cursor": cursor} if cursor else {})})
+        seen += names(r)
+        cursor = r.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == ["Lamp1", "Lamp4", "Lampoon", "lampshade", "Clamp2", "Clamp9"]
+    r = client.get("/api/v1/products/search", params={"q": "lamp", "limit": 4})
+    r = client.get("/api/v1/products/search", params={"q": "clamp", "cursor": r.headers["X-Next-Cursor"]})
+    assert r.status_code == 400
+    assert client.get("/api/v1/products/search", params={"q": "la mp"}).status_code == 422
+
+    # renames and deletes are reflected (and invalidate cached results)
+    client.put("/api/v1/products/1", json={"name": "Torch1", "category": None, "price": None, "quantity": None})
+    client.delete("/api/v1/products/3")
+    assert names(client.get("/api/v1/products/search", params={"q": "lamp"})) == ["Lamp4", "Lampoon", "lampshade", "Clamp9"]
+    assert names(client.get("/api/v1/products/search", params={"q": "orch"})) == ["Torch1"]
+
+def test_category_stats_follow_every_write_and_rebuild():
+    from lab_01 import maintenance
+    def stats():
+        r = client.get("/api/v1/products/stats")
+        assert r.status_code == 200
+        return {s.pop("category"): s for s in r.json()}
+    assert stats()["books"] == {"count": 0, "total_quantity": 0, "stock_value": 0.0, "min_price": None, "max_price": None, "avg_price": None}
+
+    for name, category, price, quantity in [("Stat1", "books", 10.0, 3), ("Stat2", "books", 20.0, 1), ("Stat3", "electronics", 100.0, 2)]:
+        client.post("/api/v1/products/", json={"name": name, "category": category, "price": price, "quantity": quantity})
+    assert stats()["books"] == {"count": 2, "total_quantity": 4, "stock_value": 50.0, "min_price": 10.0, "max_price": 20.0, "avg_price": 15.0}
+
+    # moving the cheapest book to electronics, deleting the dearest one, a batch
+    client.put("/api/v1/products/1", json={"name": None, "category": "electronics", "price": 60.0, "quantity": None})
+    client.delete("/api/v1/products/3")
+    client.post("/api/v1/products/batch", json={"operations": [
+        {"op": "create", "name": "Stat4", "category": "clothing", "price": 30.0, "quantity": 5},
+        {"op": "update", "id": 2, "quantity": 10},
+        {"op": "delete", "id": 1},
+    ]})
+    expected = {
+        "books": {"count": 1, "total_quantity": 10, "stock_value": 200.0, "min_price": 20.0, "max_price": 20.0, "avg_price": 20.0},
+        "clothing": {"count": 1, "total_quantity": 5, "stock_value": 150.0, "min_price": 30.0, "max_price": 30.0, "avg_price": 30.0},
+        "electronics": {"count": 0, "total_quantity": 0, "stock_value": 0.0, "min_price": None, "max_price": None, "avg_price": None},
+    }
+    assert stats() == expected
+
+    # repair: the rebuild gives the same numbers from the products table
+    db = next(app.dependency_overrides[get_db]())
+    db.execute(text("UPDATE category_stats SET product_count = 99, stock_value = -1"))
+    db.commit()
+    maintenance.rebuild_stats(db.get_bind())
+    db.close()
+    assert stats() == expected
+
+@pytest.mark.file_db
+def test_stock_adjustments_are_atomic_under_concurrency():
+    from concurrent.futures import ThreadPoolExecutor
+    r = client.post("/api/v1/products/", json={"name": "Stock1", "category": "books", "price": 10.0, "quantity": 250})
+    pid = r.json()["id"]
+    client.post("/api/v1/products/", json={"name": "Stock2", "category": "books", "price": 20.0, "quantity": 5})
+
+    assert client.patch(f"/api/v1/products/{pid}/stock", json={"delta": 0}).status_code == 422
+    assert client.patch("/api/v1/products/999/stock", json={"delta": -1}).status_code == 404
+
+    # 300 parallel decrements of 1 on 250 items: exactly 250 succeed, no update is lost
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        codes = list(pool.map(lambda _: client.patch(f"/api/v1/products/{pid}/stock", json={"delta": -1}).status_code, range(300)))
+    assert codes.count(200) == 250 and codes.count(409) == 50
+    assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 0
+    r = client.get(f"/api/v1/products/{pid}/history", params={"limit": 1000})
+    assert len(r.json()) == 251 and r.json()[0]["operation"] == "adjust"
+    r = client.patch(f"/api/v1/products/{pid}/stock", json={"delta": -1})
+    assert r.status_code == 409 and "Insufficient" in r.json()["detail"]["quantity"]
+
+    r = client.patch(f"/api/v1/products/{pid}/stock", json={"delta": 7})
+    assert r.status_code == 200 and r.json()["quantity"] == 7
+
+    # batch: atomic applies nothing if one adjustment fails, partial applies the rest
+    body = {"adjustments": [{"id": pid, "delta": -2}, {"id": 2, "delta": -6}, {"id": 999, "delta": 1}]}
+    r = client.patch("/api/v1/products/stock", json=body)
+    assert r.status_code == 400
+    assert [(e["index"], e["status"]) for e in r.json()["detail"]["adjustments"]] == [(1, 409), (2, 404)]
+    assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 7
+
+    r = client.patch("/api/v1/products/stock", json={**body, "mode": "partial"})
+    assert r.status_code == 200
+    out = r.json()
+    assert (out["applied"], out["failed"]) == (1, 2)
+    assert out["results"][0]["product"]["quantity"] == 5
+    assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 5
+
+    r = client.patch("/api/v1/products/stock", json={"adjustments": [{"id": 2, "delta": 1}, {"id": 2, "delta": 1}]})
+    assert r.status_code == 400
+
+    books = {s["category"]: s for s in client.get("/api/v1/products/stats").json()}["books"]
+    assert books["total_quantity"] == 10 and books["stock_value"] == 150.0
+
+@pytest.mark.file_db
+def test_optimistic_concurrency_with_versions_and_if_match():
+    from fastapi import HTTPException
+    from lab_01 import schemas, services
+    r = client.post("/api/v1/products/", json={"name": "Vers1", "category": "books", "price": 10.0, "quantity": 1})
+    pid = r.json()["id"]
+    assert r.json()["version"] == 1
+    assert client.get(f"/api/v1/products/{pid}").headers["ETag"] == '"1"'
+
+    change = {"name": None, "category": None, "price": 11.0, "quantity": None}
+    r = client.put(f"/api/v1/products/{pid}", json=change, headers={"If-Match": '"1"'})
+    assert r.status_code == 200 and r.json()["version"] == 2 and r.headers["ETag"] == '"2"'
+    assert client.put(f"/api/v1/products/{pid}", json=change, headers={"If-Match": '"1"'}).status_code == 412
+    assert client.put(f"/api/v1/products/{pid}", json=change, headers={"If-Match": "abc"}).status_code == 412
+    r = client.put(f"/api/v1/products/{pid}", json={**change, "version": 1})
+    assert r.status_code == 409 and "version 2" in r.json()["detail"]["version"]
+    # every write bumps the version, which stays equal to the last history version
+    client.patch(f"/api/v1/products/{pid}/stock", json={"delta": 4})
+    client.put(f"/api/v1/products/{pid}", json={**change, "version": 3})
+    assert client.get(f"/api/v1/products/{pid}").json()["version"] == 4
+    assert client.get(f"/api/v1/products/{pid}/history").json()[0]["version"] == 4
+
+    # lost update: read at version 4, someone else writes, the compare-and-swap UPDATE fails
+    db = next(app.dependency_overrides[get_db]())
+    svc = services.ProductService(db)
+    product = svc.get_product(pid)  # held, so update_product works on this copy
+    assert product.version == 4
+    assert client.put(f"/api/v1/products/{pid}", json={**change, "quantity": 9}).status_code == 200
+    with pytest.raises(HTTPException) as e:
+        svc.update_product(pid, schemas.ProductUpdate(**{**change, "quantity": 1}))
+    assert e.value.status_code == 409
+    db.close()
+    assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 9
+
+    # batch: stale version fails the operation
+    r = client.post("/api/v1/products/batch", json={"operations": [{"op": "update", "id": pid, "quantity": 2, "version": 4}]})
+    assert r.status_code == 400 and r.json()["detail"]["operations"][0]["status"] == 409
+    r = client.post("/api/v1/products/batch", json={"operations": [{"op": "update", "id": pid, "quantity": 2, "version": 5}]})
+    assert r.json()["results"][0]["product"]["version"] == 6
+
+    assert client.delete(f"/api/v1/products/{pid}", params={"version": 5}).status_code == 409
+    assert client.delete(f"/api/v1/products/{pid}", headers={"If-Match": '"5"'}).status_code == 412
+    assert client.delete(f"/api/v1/products/{pid}", headers={"If-Match": '"6"'}).status_code == 204
+    assert client.delete(f"/api/v1/products/{pid}", headers={"If-Match": '"6"'}).status_code == 404
+
+@pytest.mark.file_db
+def test_change_feed_streams_resumes_and_shares_one_load():
+    import threading, time
+    from lab_01 import change_feed
+
+    def events(body: str):
+        return [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: ")]
+
+    try:
+        pid = client.post("/api/v1/products/", json={"name": "Feed1", "category": "books", "price": 10.0, "quantity": 1}).json()["id"]
+        client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": None, "quantity": 2})
+
+        # from the beginning: read from the table (the feed starts at the current head)
+        r = client.get("/api/v1/products/changes", params={"cursor": 0, "limit": 2})
+        assert r.status_code == 200 and r.headers["content-type"].startswith("text/event-stream")
+        first = events(r.text)
+        assert [(e["operation"], e["version"], e["product"]["quantity"]) for e in first] == [("create", 1, 1), ("update", 2, 2)]
+        assert f"id: {first[1]['id']}" in r.text
+
+        # live: several subscribers waiting for new events, woken after each commit
+        loaded = change_feed.LOADED_EVENTS.value()
+        results = []
+        def subscribe():
+            results.append(events(client.get("/api/v1/products/changes", params={"limit": 3}).text))
+        threads = [threading.Thread(target=subscribe) for _ in range(5)]
+        for t in threads:
+            t.start()
+        deadline = time.monotonic() + 5
+        while change_feed.SUBSCRIBERS.value() < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        client.patch(f"/api/v1/products/{pid}/stock", json={"delta": 5})
+        client.delete(f"/api/v1/products/{pid}")
+        client.post("/api/v1/products/batch", json={"operations": [{"op": "create", "name": "Feed2", "category": "books", "price": 5.0, "quantity": 0}]})
+        for t in threads:
+            t.join(10)
+        assert len(results) == 5
+        for got in results:
+            assert [(e["product_id"], e["operation"]) for e in got] == [(pid, "adjust"), (pid, "delete"), (pid + 1, "create")]
+            assert got[1]["product"] == {"id": pid, "name": "Feed1", "category": "books", "price": 10.0, "quantity": 7, "version": 4}
+        assert change_feed.LOADED_EVENTS.value() - loaded == 3  # loaded once, not once per subscriber
+
+        # resume after the 'adjust' event with Last-Event-ID (served from the buffer)
+        r = client.get("/api/v1/products/changes", params={"limit": 2}, headers={"Last-Event-ID": str(results[0][0]["id"])})
+        assert [e["operation"] for e in events(r.text)] == ["delete", "create"]
+
+        # the deleted product's history is kept and ends with its 'delete' version
+        history = client.get(f"/api/v1/products/{pid}/history").json()
+        assert [h["operation"] for h in history] == ["delete", "adjust", "update", "create"]
+    finally:
+        change_feed.shutdown()
+
+@pytest.mark.file_db
+def test_cache_sync_drops_caches_written_by_other_workers(monkeypatch):
+    from lab_01 import cache_sync, forbidden_matcher, main, models, repositories
+
+    monkeypatch.setattr(cache_sync, "CACHE_SYNC", True)
+    monkeypatch.setattr(cache_sync, "CACHE_SYNC_INTERVAL_MS", 0)
+    cache_sync.reset()
+    try:
+        pid = client.post("/api/v1/products/", json={"name": "Shared1", "category": "books", "price": 10.0, "quantity": 1}).json()["id"]
+        assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 1
+        assert client.post("/api/v1/products/", json={"name": "Shared2", "category": "books", "price": 10.0, "quantity": 1}).status_code == 201
+
+        # another worker: writes and bumps the generations in its own transaction
+        db = next(app.dependency_overrides[get_db]())
+        db.get(models.Product, pid).quantity = 9
+        db.add(models.ForbiddenPhrase(phrase="remote"))
+        repositories.GenerationRepository(db).bump("products")
+        repositories.GenerationRepository(db).bump("forbidden")
+        db.commit()
+        db.close()
+
+        assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 9
+        r = client.post("/api/v1/products/", json={"name": "Remote1", "category": "books", "price": 10.0, "quantity": 1})
+        assert r.status_code == 400 and "remote" in r.json()["detail"]["name"]
+    finally:
+        cache_sync.reset()
+        forbidden_matcher.reset()
+
+    # run_prod: schema and seed once in the parent, then the workers
+    calls = []
+    monkeypatch.setattr(main, "initialize_db_and_seed", lambda: calls.append("seed"))
+    monkeypatch.setattr(main.uvicorn, "run", lambda app, **kw: calls.append((app, kw["workers"], os.environ["DB_INITIALIZED"])))
+    monkeypatch.setattr(cache_sync, "WORKERS", 4)
+    monkeypatch.setenv("DB_INITIALIZED", "0")
+    monkeypatch.setenv("WORKERS", "4")
+    main.run_prod()
+    assert calls == ["seed", ("lab_01.main:app", 4, "1")]
+
+@pytest.mark.file_db
+def test_read_engine_is_read_only_and_read_your_writes(monkeypatch):
+    from sqlalchemy.exc import OperationalError
+    from starlette.requests import Request
+    from lab_01 import database, response_cache
+
+    # GET routes run on the fixture's query_only session, writes on the primary
+    pid = client.post("/api/v1/products/", json={"name": "Split1", "category": "books", "price": 10.0, "quantity": 1}).json()["id"]
+    assert client.get(f"/api/v1/products/{pid}").json()["name"] == "Split1"
+    assert client.get("/api/v1/forbidden/").status_code == 200
+    assert "read_primary" not in client.cookies  # same database: no replica lag to wait for
+
+    read = database.create_db_engine(str(next(app.dependency_overrides[get_db]()).get_bind().url), read_only=True)
+    with read.connect() as conn:
+        assert conn.execute(text("SELECT name FROM products")).scalar_one() == "Split1"
+        with pytest.raises(OperationalError, match="readonly"):
+            conn.execute(text("DELETE FROM products"))
+    read.dispose()
+
+    # with a replica: a write marks the client, whose GETs then go to the primary
+    monkeypatch.setattr(database, "READ_YOUR_WRITES_S", 5)
+    r = client.put(f"/api/v1/products/{pid}", json={"name": None, "category": None, "price": None, "quantity": 2})
+    assert "read_primary=1" in r.headers["set-cookie"] and "Max-Age=5" in r.headers["set-cookie"]
+    # a lagging replica refills the shared response cache with the old version: the writer
+    # (with the cookie) must not be served it, other clients may until the replica catches up
+    cache = response_cache.for_session(next(app.dependency_overrides[get_db]()))
+    stale = {"id": pid, "name": "Split1", "category": "books", "price": 10.0, "quantity": 1, "version": 1}
+    cache.put(("product", pid), json.dumps(stale).encode(), cache.version, etag=response_cache.product_etag(1))
+    assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 2
+    client.cookies.clear()
+    assert client.get(f"/api/v1/products/{pid}").json()["quantity"] == 1
+    def session_for(cookie: bytes):
+        sessions = database.get_read_db(Request({"type": "http", "headers": [(b"cookie", cookie)]}))
+        db = next(sessions)
+        sessions.close()
+        return db.get_bind()
+    assert session_for(b"read_primary=1") is database.engine
+    assert session_for(b"") is database.read_engine
+
+@pytest.mark.file_db
+def test_import_validates_per_chunk_and_reports_lines(tmp_path):
+    from lab_01 import imports
+
+    client.post("/api/v1/forbidden/", json={"phrase": "bad"})
+    client.post("/api/v1/products/", json={"name": "Existing1", "category": "books", "price": 10.0, "quantity": 1})
+    body = "\n".join([
+        "name,category,price,quantity,extra",
+        "Import1,books,12.5,3,x",
+        "Existing1,books,10,1,x",      # taken in the database
+        "Import2,electronics,10,1,x",  # below the electronics minimum
+        "Import1,books,13,1,x",        # taken by line 2, committed in the previous chunk
+        "BadName1,books,10,1,x",       # forbidden phrase
+        "No,books,10,1,x",             # too short
+        "Import3,clothing,20,-1,x",    # negative quantity
+        "Import4,clothing,20,7,x",
+    ]) + "\n"
+    r = client.post("/api/v1/products/import", params={"format": "csv", "chunk_size": 3}, content=body.encode(), headers={"Content-Type": "text/csv"})
+    assert r.status_code == 200 and r.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in r.text.splitlines()]
+    errors = {e["line"]: e["error"] for e in events if e["event"] == "error"}
+    assert sorted(errors) == [3, 4, 5, 6, 7, 8]
+    assert errors[3] == errors[5] == {"name": "Product with this name already exists"}
+    assert "price" in errors[4] and "forbidden" in errors[6]["name"] and "name" in errors[7] and "quantity" in errors[8]
+    assert [e["records"] for e in events if e["event"] == "progress"] == [3, 6, 8]
+    assert {k: events[-1][k] for k in ("event", "records", "imported", "failed")} == {"event": "done", "records": 8, "imported": 2, "failed": 6}
+
+    rows = client.get("/api/v1/products/search", params={"q": "Import"}).json()
+    assert [(p["name"], p["price"], p["quantity"], p["version"]) for p in rows] == [("Import1", 12.5, 3, 1), ("Import4", 20.0, 7, 1)]
+    assert [h["operation"] for h in client.get(f"/api/v1/products/{rows[0]['id']}/history").json()] == ["create"]
+    stats = {s["category"]: s["count"] for s in client.get("/api/v1/products/stats").json()}
+    assert stats == {"electronics": 0, "books": 2, "clothing": 1}
+
+    # command line: NDJSON file, rejected lines written to the error file
+    db_url = str(next(app.dependency_overrides[get_db]()).get_bind().url)
+    source = tmp_path / "supplier.ndjson"
+    source.write_text('{"name": "Cli1", "category": "books", "price": 9, "quantity": 1}\n\nnot json\n[1]\n{"name": "Cli1", "category": "books", "price": 9, "quantity": 1}\n')
+    imports.main([str(source), "--errors", str(tmp_path / "errors.ndjson"), "--database-url", db_url, "--chunk-size", "2"])
+    rejected = [json.loads(line) for line in (tmp_path / "errors.ndjson").read_text().splitlines()]
+    assert [e["line"] for e in rejected] == [3, 4, 5]
+    assert rejected[2]["error"] == {"name": "Product with this name already exists"}
+    assert [p["name"] for p in client.get("/api/v1/products/search", params={"q": "Cli1"}).json()] == ["Cli1"]
+
+@pytest.mark.file_db
+def test_history_compaction_archives_old_versions_and_keeps_them_readable(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    from lab_01 import history_archive, maintenance
+
+    monkeypatch.setattr(history_archive, "HISTORY_ARCHIVE_DIR", tmp_path)
+    pid = client.post("/api/v1/products/", json={"name": "Aged1", "category": "books", "price": 10.0, "quantity": 0}).json()["id"]
+    for q in range(1, 13):
+        client.patch(f"/api/v1/products/{pid}/stock", json={"delta": 1})
+    gone = client.post("/api/v1/products/", json={"name": "Aged2", "category": "books", "price": 10.0, "quantity": 0}).json()["id"]
+    client.put(f"/api/v1/products/{gone}", json={"name": None, "category": None, "price": 11.0, "quantity": None})
+    client.delete(f"/api/v1/products/{gone}")
+    # version v written v hours after 2024-01-01
+    db = next(app.dependency_overrides[get_db]())
+    db.execute(text("UPDATE product_histories SET changed_at = datetime('2024-01-01', '+' || version || ' hours')"))
+    db.commit()
+
+    def full_history(product_id, limit):
+        items, cursor = [], None
+        while True:
+            r = client.get(f"/api/v1/products/{product_id}/history", params={"limit": limit, **({"cursor": cursor} if cursor else {})})
+            items += r.json()
+            cursor = r.headers.get("X-Next-Cursor")
+            if not cursor:
+                return items
+
+    before = full_history(pid, 100)
+    assert [h["version"] for h in before] == list(range(13, 0, -1))
+    before_gone = full_history(gone, 100)
+
+    db_url = str(db.get_bind().url)
+    maintenance.main(["compact-history", "--keep-versions", "3", "--database-url", db_url, "--archive-dir", str(tmp_path)])
+    rows = db.execute(text("SELECT product_id, version, is_snapshot FROM product_histories ORDER BY product_id, version")).all()
+    assert rows == [(pid, 11, 1), (pid, 12, 0), (pid, 13, 0), (gone, 1, 1), (gone, 2, 0), (gone, 3, 0)]
+    assert db.execute(text("SELECT count(*) FROM history_archive")).scalar() == 1
+    assert len(list(tmp_path.glob("history-*.ndjson.gz"))) == 1
+
+    # same pages as before, across the table and the archive
+    assert full_history(pid, 100) == before
+    assert full_history(pid, 4) == before
+    assert full_history(gone, 2) == before_gone
+    r = client.get(f"/api/v1/products/{pid}/history/as-of", params={"at": "2024-01-01T02:30:00"})
+    assert r.json()["version"] == 2 and r.json()["product"]["quantity"] == 1
+    assert client.get(f"/api/v1/products/{pid}/history/as-of", params={"at": "2023-12-31T00:00:00"}).status_code == 404
+
+    # new versions continue from the table; a second run by age appends another segment
+    client.patch(f"/api/v1/products/{pid}/stock", json={"delta": 1})
+    cutoff_days = (datetime.utcnow() - datetime(2024, 1, 1, 11, 30)).total_seconds() / 86400
+    maintenance.main(["compact-history", "--older-than-days", str(cutoff_days), "--database-url", db_url, "--archive-dir", str(tmp_path)])
+    assert db.execute(text("SELECT version FROM product_histories WHERE product_id = :p"), {"p": pid}).scalars().all() == [12, 13, 14]
+    assert len(list(tmp_path.glob("history-*.ndjson.gz"))) == 2
+    after = full_history(pid, 5)
+    assert [h["version"] for h in after] == list(range(14, 0, -1))
+    assert after[1:] == before and json.loads(after[0]["snapshot"])["quantity"] == 13
+    db.close()
+
+def test_validate_names_checks_a_batch_without_writing():
+    client.post("/api/v1/forbidden/", json={"phrase": "bad"})
+    client.post("/api/v1/products/", json={"name": "Taken1", "category": "books", "price": 10.0, "quantity": 1})
+    names = ["Fresh1", "Taken1", "VeryBad1", "x!", "Fresh1", "Cheap1", "Odd1", "Free1", "Lone1"]
+    categories = [None, None, None, None, None, "books", "toys", None, "clothing"]
+    prices = [None, None, None, None, None, 1.0, 10.0, 99.0, None]
+    r = client.post("/api/v1/products/validate-names", json={"names": names, "categories": categories, "prices": prices})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["checked"] == 9 and body["accepted"] == 2 and body["rejected"] == 7
+    assert body["valid"] == [True, False, False, False, False, False, False, False, True]
+    errors = {e["index"]: e["error"] for e in body["errors"]}
+    assert errors[1] == {"name": "Product with this name already exists"}
+    assert errors[2] == {"name": "Name contains forbidden phrase 'bad'"}
+    assert errors[3] == {"name": "Name must be 3-20 letters or digits"}
+    assert errors[4] == {"name": "Name repeated in this batch (item 0)"}
+    assert errors[5] == {"price": "Price 1.0 out of allowed range [5.0, 500.0] for category books"}
+    assert errors[6] == {"category": "Unknown category 'toys'"}
+    assert errors[7] == {"category": "Category required to check the price"}
+    # same verdicts as the create they stand in for; nothing was written
+    assert client.post("/api/v1/products/", json={"name": "VeryBad1", "category": "books", "price": 10.0, "quantity": 1}).json()["detail"] == errors[2]
+    assert [p["name"] for p in client.get("/api/v1/products/").json()] == ["Taken1"]
+
+    assert client.post("/api/v1/products/validate-names", json={"names": ["Abc1"], "prices": [1.0, 2.0]}).status_code == 422
+    assert client.post("/api/v1/products/validate-names", json={"names": []}).status_code == 422
+
+def test_forbidden_matcher_find_many_matches_find():
+    import random
+    from lab_01.forbidden_matcher import ForbiddenMatcher
+    rnd = random.Random(7)
+    texts = ["".join(rnd.choice("abcXYZ") for _ in range(rnd.randint(0, 12))) for _ in range(500)] + ["ab\nc"]
+    for count in (3, ForbiddenMatcher.SCAN_LIMIT + 20):
+        m = ForbiddenMatcher((i, "".join(rnd.choice("abcxyz") for _ in range(rnd.randint(1, 4)))) for i in range(count, 0, -1))
+        m.find("warm")
+        m.add(count + 1, "b\nc")  # pending, and spanning the separator of the joined batch
+        assert m.find_many(texts) == [m.find(t) for t in texts]
+
+# the schema of the first version of the app, as SQLAlchemy created it
+BASELINE_SCHEMA = [
+    "CREATE TABLE forbidden_phrases (id INTEGER NOT NULL, phrase VARCHAR(200) NOT NULL, PRIMARY KEY (id))",
+    "CREATE INDEX ix_forbidden_phrases_id ON forbidden_phrases (id)",
+    "CREATE UNIQUE INDEX ix_forbidden_phrases_phrase ON forbidden_phrases (phrase)",
+    "CREATE TABLE products (id INTEGER NOT NULL, name VARCHAR(20) NOT NULL, category VARCHAR(50) NOT NULL, "
+    "price FLOAT NOT NULL, quantity INTEGER NOT NULL, PRIMARY KEY (id))",
+    "CREATE INDEX ix_products_id ON products (id)",
+    "CREATE UNIQUE INDEX ix_products_name ON products (name)",
+    "CREATE TABLE product_histories (id INTEGER NOT NULL, product_id INTEGER NOT NULL, "
+    "changed_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL, operation VARCHAR(20) NOT NULL, snapshot TEXT NOT NULL, "
+    "PRIMARY KEY (id), FOREIGN KEY(product_id) REFERENCES products (id) ON DELETE CASCADE)",
+    "CREATE INDEX ix_product_histories_id ON product_histories (id)",
+]
+
+def _baseline_database(path):
+    from lab_01 import database
+    engine = database.create_db_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO forbidden_phrases (id, phrase) VALUES (1, 'bad')"))
+        conn.execute(text("INSERT INTO products VALUES (1, 'Old1', 'books', 12.0, 3), (2, 'Old2', 'clothing', 20.0, 1)"))
+        # Old1: created, then updated twice in the same second (ids order them)
+        for hid, pid, at, op, state in [
+            (1, 1, "2024-01-01 10:00:00", "create", {"price": 10.0, "quantity": 1}),
+            (2, 2, "2024-01-01 10:00:00", "create", {"price": 20.0, "quantity": 1}),
+            (3, 1, "2024-01-02 09:00:00", "update", {"price": 11.0, "quantity": 1}),
+            (4, 1, "2024-01-02 09:00:00", "update", {"price": 12.0, "quantity": 3}),
+        ]:
+            name, category = ("Old1", "books") if pid == 1 else ("Old2", "clothing")
+            snapshot = json.dumps({"id": pid, "name": name, "category": category, **state})
+            conn.execute(text("INSERT INTO product_histories VALUES (:id, :pid, :at, :op, :snapshot)"),
+                         {"id": hid, "pid": pid, "at": at, "op": op, "snapshot": snapshot})
+    return engine
+
+def test_startup_upgrades_a_baseline_database(tmp_path):
+    from lab_01 import seeds, schemas
+    from lab_01.database import session_factory
+    from lab_01.services import ProductService
+
+    engine = _baseline_database(tmp_path / "lab01.db")
+    seeds._add_missing_schema(engine)
+    seeds._add_missing_schema(engine)  # nothing left to do the second time
+    try:
+        with session_factory(engine)() as db:
+            svc = ProductService(db)
+            history, _ = svc.get_history(1)
+            assert [(h["version"], h["operation"], json.loads(h["snapshot"])["price"]) for h in history] == [
+                (3, "update", 12.0), (2, "update", 11.0), (1, "create", 10.0)]
+            assert svc.get_product(1).version == 3 and svc.get_product(2).version == 1
+            # new writes continue the numbering, and the new features see the old rows
+            updated = svc.update_product(1, schemas.ProductUpdate(name=None, category=None, price=13.0, quantity=None, version=3))
+            assert updated.version == 4 and svc.get_history(1)[0][0]["version"] == 4
+            assert [p.name for p in svc.search_products(q="old", mode=schemas.SearchMode.substring, category=None, limit=10, cursor=None)[0]] == ["Old1", "Old2"]
+            assert {s["category"].value: s["count"] for s in svc.get_category_stats()}["books"] == 1
+        with engine.connect() as conn:
+            columns = [c["name"] for c in inspect(conn).get_columns("product_histories")]
+        assert "snapshot" not in columns and {"version", "is_snapshot", "data"} <= set(columns)
+    finally:
+        engine.dispose()
+
+def test_startup_refuses_column_changes_it_cannot_apply(tmp_path):
+    from lab_01 import seeds
+
+    engine = _baseline_database(tmp_path / "lab01.db")
+    with engine.begin() as conn:
+        # not the layout _migrate_snapshot_history knows: the history rows are under another name
+        conn.execute(text("ALTER TABLE product_histories RENAME COLUMN snapshot TO payload"))
+    try:
+        with pytest.raises(seeds.SchemaUpgradeError) as error:
+            seeds._add_missing_schema(engine)
+        message = str(error.value)
+        assert "product_histories.version is missing" in message and "product_histories.data is missing" in message
+        assert "product_histories.payload is no longer used" in message
+        # nothing was altered
+        with engine.connect() as conn:
+            assert [c["name"] for c in inspect(conn).get_columns("products")] == ["id", "name", "category", "price", "quantity"]
+    finally:
+        engine.dispose()